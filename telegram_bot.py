@@ -1,23 +1,43 @@
+import gzip
 import json
 import os
 import sys
+import ssl
 import time
+import hmac
+import uuid
+import zlib
+import queue
+import socket
+import asyncio
 import logging
+import urllib.parse
 import requests
 import threading
 import signal
-from flask import Flask
-from concurrent.futures import ThreadPoolExecutor
+import hashlib
+import heapq
+import io
+import weakref
+import random
+import functools
+import sqlite3
+import multiprocessing
+from contextlib import contextmanager
+from concurrent.futures import Future, ThreadPoolExecutor
 from datetime import datetime, timedelta
-from collections import OrderedDict
+from collections import OrderedDict, deque
+from itertools import islice
 from requests.adapters import HTTPAdapter
 from urllib3.util.retry import Retry
-import firebase_admin
-from firebase_admin import credentials, firestore
 try:
     from dotenv import load_dotenv
 except ModuleNotFoundError:
     load_dotenv = None
+try:
+    import orjson
+except ModuleNotFoundError:
+    orjson = None
 
 # Logging sozlamalari
 logging.basicConfig(
@@ -34,61 +54,648 @@ logger = logging.getLogger("TelegramBot")
 if load_dotenv:
     load_dotenv(override=True)
 
-class LRUCacheWithTTL:
-    """LRU cache with TTL (Time To Live) and max size limit"""
-    def __init__(self, max_size=1000, ttl_seconds=3600):
-        self.cache = OrderedDict()
-        self.timestamps = {}
+# Cache'da yo'q kalit uchun belgi (saqlangan None - "ma'lum, qiymat yo'q" degani)
+_MISSING = object()
+
+_monotonic = time.monotonic
+
+
+class _CacheShard:
+    __slots__ = ("lock", "entries", "max_size", "hits", "misses")
+
+    def __init__(self, max_size):
+        self.lock = threading.Lock()
+        self.entries = {}   # key -> (value, expires_at); tartib - yozilish tartibi
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+
+
+class ShardedTTLCache:
+    """Lock-striped TTL cache: kalitlar shard'larga bo'linadi, har shard o'z lock'i bilan.
+
+    Yozuv bitta (value, expires_at) tuple; muddat time.monotonic() bo'yicha. get() tartibni
+    o'zgartirmaydi (LRU emas, yozilish tartibi). Shard to'lganda eng eski yozilgan
+    sample_size ta yozuv ko'rib chiqiladi: muddati o'tganlari, bo'lmasa eng eskisi
+    chiqariladi. Muddati o'tgan, lekin so'ralmayotgan yozuvlarni fon sweep'i tozalaydi.
+    """
+    def __init__(self, max_size=1000, ttl_seconds=3600, shards=16, sample_size=5):
+        # Shard'lar soni 2 ning darajasi: indeks hash & mask bilan olinadi
+        count = 1
+        while count * 2 <= min(shards, max_size):
+            count *= 2
         self.max_size = max_size
         self.ttl_seconds = ttl_seconds
+        self.sample_size = sample_size
+        self._mask = count - 1
+        self._shards = [_CacheShard(-(-max_size // count)) for _ in range(count)]
+        _CacheSweeper.register(self)
+
+    def _shard(self, key):
+        return self._shards[hash(key) & self._mask]
+
+    def get(self, key, default=None):
+        """Cache'dagi qiymat yoki default. Saqlangan None'ni miss'dan ajratish uchun default=_MISSING"""
+        shard = self._shards[hash(key) & self._mask]
+        with shard.lock:
+            entry = shard.entries.get(key)
+            if entry is not None:
+                if entry[1] > _monotonic():
+                    shard.hits += 1
+                    return entry[0]
+                del shard.entries[key]
+            shard.misses += 1
+            return default
+
+    def set(self, key, value):
+        shard = self._shards[hash(key) & self._mask]
+        now = _monotonic()
+        with shard.lock:
+            entries = shard.entries
+            if entries.pop(key, None) is None and len(entries) >= shard.max_size:
+                self._evict(entries, now)
+            entries[key] = (value, now + self.ttl_seconds)
+
+    def _evict(self, entries, now):
+        # TTL hamma yozuv uchun bir xil: eng eski yozilgan - eng birinchi eskiradigan.
+        # Boshidagi sample_size ta yozuvdan muddati o'tganlari chiqariladi, bo'lmasa eng eskisi.
+        sample = list(islice(entries, self.sample_size))
+        expired = 0
+        for key in sample:
+            if entries[key][1] > now:
+                break
+            del entries[key]
+            expired += 1
+        if not expired:
+            del entries[sample[0]]
+
+    def delete(self, key):
+        shard = self._shard(key)
+        with shard.lock:
+            shard.entries.pop(key, None)
+
+    def clear(self):
+        for shard in self._shards:
+            with shard.lock:
+                shard.entries.clear()
+
+    def sweep(self, batch=500):
+        """Muddati o'tgan yozuvlarni o'chirish; lock har shard'da qisqa vaqt ushlanadi"""
+        removed = 0
+        for shard in self._shards:
+            now = _monotonic()
+            with shard.lock:
+                expired = [key for key, (_, expires_at) in shard.entries.items() if expires_at <= now][:batch]
+                for key in expired:
+                    del shard.entries[key]
+            removed += len(expired)
+        return removed
+
+    @property
+    def hits(self):
+        return sum(shard.hits for shard in self._shards)
+
+    @property
+    def misses(self):
+        return sum(shard.misses for shard in self._shards)
+
+    def __len__(self):
+        return sum(len(shard.entries) for shard in self._shards)
+
+
+class _CacheSweeper:
+    """Barcha ShardedTTLCache'lar uchun bitta fon thread'i (muddati o'tganlarni tozalash)"""
+    interval = 30
+    _caches = weakref.WeakSet()
+    _lock = threading.Lock()
+    _thread = None
+
+    @classmethod
+    def register(cls, cache):
+        with cls._lock:
+            cls._caches.add(cache)
+            if cls._thread is None:
+                cls._thread = threading.Thread(target=cls._run, name="cache-sweeper", daemon=True)
+                cls._thread.start()
+
+    @classmethod
+    def _run(cls):
+        while True:
+            time.sleep(cls.interval)
+            for cache in list(cls._caches):
+                try:
+                    cache.sweep()
+                except Exception as e:
+                    logger.debug(f"Cache sweep xatosi: {e}")
+
+class Histogram:
+    """Prometheus uslubidagi histogram (label'lar bo'yicha kumulyativ bucket'lar)"""
+    DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+    def __init__(self, name, help_text, buckets=None):
+        self.name = name
+        self.help = help_text
+        self.buckets = tuple(buckets or self.DEFAULT_BUCKETS)
+        self._series = {}  # labels (tuple) -> [bucket counts..., sum, count]
         self._lock = threading.Lock()
 
-    def get(self, key):
+    def observe(self, value, **labels):
+        key = tuple(sorted(labels.items()))
         with self._lock:
-            if key not in self.cache:
-                return None
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [0] * (len(self.buckets) + 2)
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[i] += 1
+                    break
+            series[-2] += value
+            series[-1] += 1
 
-            # Check TTL
-            if time.time() - self.timestamps.get(key, 0) > self.ttl_seconds:
-                self._remove(key)
-                return None
+    @contextmanager
+    def time(self, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
 
-            # Move to end (most recently used)
-            self.cache.move_to_end(key)
-            return self.cache[key]
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            series = {key: list(values) for key, values in self._series.items()}
+        for key, values in sorted(series.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets, values):
+                cumulative += count
+                lines.append(f"{self.name}_bucket{_format_labels(key + (('le', _format_value(bound)),))} {cumulative}")
+            lines.append(f"{self.name}_bucket{_format_labels(key + (('le', '+Inf'),))} {values[-1]}")
+            lines.append(f"{self.name}_sum{_format_labels(key)} {_format_value(values[-2])}")
+            lines.append(f"{self.name}_count{_format_labels(key)} {values[-1]}")
+        return lines
+
+
+class Counter:
+    """Label'lar bo'yicha o'suvchi hisoblagich"""
+    def __init__(self, name, help_text):
+        self.name = name
+        self.help = help_text
+        self._series = {}
+        self._lock = threading.Lock()
 
-    def set(self, key, value):
+    def inc(self, amount=1, **labels):
+        key = tuple(sorted(labels.items()))
         with self._lock:
-            if key in self.cache:
-                self.cache.move_to_end(key)
-            else:
-                # Check size limit
-                if len(self.cache) >= self.max_size:
-                    # Remove oldest item
-                    oldest_key = next(iter(self.cache))
-                    self._remove(oldest_key)
+            self._series[key] = self._series.get(key, 0) + amount
 
-            self.cache[key] = value
-            self.timestamps[key] = time.time()
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            series = sorted(self._series.items())
+        lines.extend(f"{self.name}{_format_labels(key)} {_format_value(value)}" for key, value in series)
+        return lines
 
-    def delete(self, key):
+
+def _format_labels(items):
+    if not items:
+        return ""
+    escaped = (f'{k}="{str(v).replace(chr(92), chr(92) * 2).replace(chr(34), chr(92) + chr(34))}"' for k, v in items)
+    return "{" + ",".join(escaped) + "}"
+
+
+def _format_value(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class MetricsRegistry:
+    """/metrics endpointi uchun metrikalar to'plami (Prometheus text format).
+
+    Histogram'lar chaqiruv joyida yoziladi; gauge/counter'lar esa har scrape'da
+    callback orqali o'qiladi (cache, dispatcher va h.k. o'z hisoblagichlarini saqlaydi).
+    """
+    def __init__(self):
+        self._metrics = OrderedDict()  # name -> Histogram/Counter
+        self._gauges = OrderedDict()   # name -> [type, help, {labels: fn}]
+        self._lock = threading.Lock()
+
+    def histogram(self, name, help_text, buckets=None):
         with self._lock:
-            self._remove(key)
+            if name not in self._metrics:
+                self._metrics[name] = Histogram(name, help_text, buckets)
+            return self._metrics[name]
 
-    def _remove(self, key):
-        self.cache.pop(key, None)
-        self.timestamps.pop(key, None)
+    def counter(self, name, help_text):
+        with self._lock:
+            if name not in self._metrics:
+                self._metrics[name] = Counter(name, help_text)
+            return self._metrics[name]
 
-    def clear(self):
+    def gauge(self, name, help_text, fn, metric_type="gauge", **labels):
+        """Qiymati scrape paytida fn() orqali olinadigan metrika"""
+        with self._lock:
+            entry = self._gauges.setdefault(name, [metric_type, help_text, {}])
+            entry[2][tuple(sorted(labels.items()))] = fn
+
+    def track_cache(self, name, cache):
+        """Cache hit/miss hisoblagichlarini eksport qilish"""
+        def hit_ratio():
+            total = cache.hits + cache.misses
+            return cache.hits / total if total else 0.0
+
+        self.gauge("bot_cache_hits_total", "Cache hits", lambda: cache.hits, "counter", cache=name)
+        self.gauge("bot_cache_misses_total", "Cache misses", lambda: cache.misses, "counter", cache=name)
+        self.gauge("bot_cache_hit_ratio", "Cache hit ratio since start", hit_ratio, cache=name)
+        self.gauge("bot_cache_size", "Cached entries", lambda: len(cache), cache=name)
+
+    def render(self):
+        lines = []
         with self._lock:
-            self.cache.clear()
-            self.timestamps.clear()
+            metrics = list(self._metrics.values())
+            gauges = [(name, entry[0], entry[1], list(entry[2].items())) for name, entry in self._gauges.items()]
+        for metric in metrics:
+            lines.extend(metric.render())
+        for name, metric_type, help_text, series in gauges:
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {metric_type}")
+            for key, fn in series:
+                try:
+                    value = fn()
+                except Exception as e:
+                    logger.debug(f"Metrika o'qilmadi ({name}): {e}")
+                    continue
+                lines.append(f"{name}{_format_labels(key)} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+
+METRICS = MetricsRegistry()
+TELEGRAM_CALL_SECONDS = METRICS.histogram(
+    "bot_telegram_api_call_seconds", "Telegram Bot API call latency (retries included, rate-limit queueing excluded)"
+)
+TELEGRAM_CALL_ERRORS = METRICS.counter(
+    "bot_telegram_api_errors_total", "Telegram Bot API calls that returned ok=false"
+)
+DB_OP_SECONDS = METRICS.histogram("bot_db_operation_seconds", "FirestoreDB operation latency")
+GET_UPDATES_BATCH = METRICS.histogram(
+    "bot_get_updates_batch_size", "Updates returned per getUpdates call", buckets=(0, 1, 2, 5, 10, 20, 50, 100)
+)
+OUTBOX_JOBS = METRICS.counter("bot_outbox_jobs_total", "Outbox job attempts by outcome")
+OUTBOX_REVIVED = METRICS.counter("bot_outbox_revived_total", "Dead outbox jobs put back in the queue")
+UPDATE_DELAY_SECONDS = METRICS.histogram(
+    "bot_update_delay_seconds", "Delay from message date (Telegram) to handler start",
+    buckets=(0.5, 1, 2, 5, 10, 30, 60, 300, 900)
+)
+DISPATCH_WAIT_SECONDS = METRICS.histogram("bot_dispatcher_wait_seconds", "Time updates wait in the dispatcher queue")
+HANDLE_UPDATE_SECONDS = METRICS.histogram("bot_handle_update_seconds", "Update handler latency in dispatcher workers")
+
+
+def _timed_db_op(func):
+    """FirestoreDB metodining davomiyligini metrikaga va joriy trace'ga yozish"""
+    @functools.wraps(func)
+    def wrapper(self, *args, **kwargs):
+        with TRACER.span(f"db.{func.__name__}"), DB_OP_SECONDS.time(op=func.__name__):
+            return func(self, *args, **kwargs)
+    return wrapper
+
+
+class ChatDispatcher:
+    """Update'larni chat_id bo'yicha navbatlarga bo'lib qayta ishlovchi worker pool.
+
+    Bitta chatning update'lari FIFO tartibida ketma-ket ishlanadi (state race bo'lmaydi),
+    turli chatlar esa parallel ishlanadi. Sekin chat boshqa chatlarni bloklamaydi.
+
+    max_pending > 0 bo'lsa navbat chegaralangan: to'lganda submit() joy bo'shashini kutadi
+    (polling to'xtab turadi), priority(update) == "low" bo'lgan update'lar esa navbatga
+    kirmaydi - alohida thread'da on_shed(update) ga beriladi (keshdan tez javob). Bu faqat
+    chatda navbatdagi update bo'lmasa qilinadi va tartib buzilmaydi; on_shed javob bera
+    olmasa update chat navbatining boshiga qaytadi - hech narsa tashlab yuborilmaydi.
+    """
+    def __init__(self, handler, max_workers=8, name="dispatcher", max_pending=0, priority=None, on_shed=None,
+                 shed_queue_size=100):
+        self.handler = handler
+        self.max_workers = max_workers
+        self.max_pending = max_pending
+        self.priority = priority
+        self.on_shed = on_shed
+        self._queues = {}       # chat_key -> deque[(enqueued_at, update)]
+        self._ready = deque()   # navbatida update bor va hozir ishlanmayotgan chatlar
+        lock = threading.Lock()
+        self._cond = threading.Condition(lock)
+        self._not_full = threading.Condition(lock)
+        self._closed = False
+        self._pending = 0
+        self._active = 0
+        # To'lgan paytda chetlatilgan (chat_key, update)'lar; javob berilguncha chat band turadi
+        self._shed = deque(maxlen=shed_queue_size)
+        self._shed_ready = threading.Condition(lock)
+        self._shedding = 0
+
+        # Metrikalar
+        self._submitted = 0
+        self._completed = 0
+        self._failed = 0
+        self._max_depth = 0
+        self._wait_total = 0.0
+        self._wait_max = 0.0
+        self._blocked = 0
+        self._blocked_seconds = 0.0
+        self._rejected = 0
+        self._shed_answered = 0
+        self._shed_requeued = 0
+
+        for stat in ("queue_depth", "max_queue_depth", "active", "chats", "saturation"):
+            METRICS.gauge(f"bot_dispatcher_{stat}", f"ChatDispatcher {stat.replace('_', ' ')}",
+                          lambda stat=stat: self.stats()[stat], dispatcher=name)
+        for stat in ("submitted", "completed", "failed", "rejected", "shed_answered", "shed_requeued"):
+            METRICS.gauge(f"bot_dispatcher_{stat}_total", f"Updates {stat.replace('_', ' ')}",
+                          lambda stat=stat: self.stats()[stat], "counter", dispatcher=name)
+        METRICS.gauge("bot_dispatcher_blocked_seconds_total", "Seconds submitters waited for queue space",
+                      lambda: self.stats()["blocked_seconds"], "counter", dispatcher=name)
+
+        self._workers = []
+        for i in range(max_workers):
+            t = threading.Thread(target=self._worker, name=f"{name}-{i}", daemon=True)
+            t.start()
+            self._workers.append(t)
+        if max_pending and priority is not None and on_shed is not None:
+            t = threading.Thread(target=self._shed_worker, name=f"{name}-shed", daemon=True)
+            t.start()
+            self._workers.append(t)
+
+    @staticmethod
+    def chat_key(update):
+        """Update qaysi chatga tegishli ekanini aniqlash"""
+        message = update.get("message") or update.get("edited_message")
+        if message:
+            return message.get("chat", {}).get("id")
+        cb = update.get("callback_query")
+        if cb:
+            return (cb.get("message") or {}).get("chat", {}).get("id") or cb.get("from", {}).get("id")
+        return None
+
+    def submit(self, update, block=True):
+        """Update'ni chat navbatiga qo'yish. False - qabul qilinmadi (to'xtatilgan yoki block=False va to'la)"""
+        return self.submit_many([update], block)
+
+    def submit_many(self, updates, block=True):
+        """getUpdates batch'ini bitta lock ostida navbatlarga qo'yish; bo'sh worker'lar birdaniga uyg'onadi"""
+        with self._cond:
+            for update in updates:
+                if self._closed:
+                    logger.warning("Dispatcher to'xtatilgan, update qabul qilinmadi")
+                    return False
+                if self.max_pending and self._pending >= self.max_pending:
+                    if self._shed_locked(update):
+                        continue
+                    if not block:
+                        self._rejected += 1
+                        return False
+                    # Backpressure: navbatda joy bo'shaguncha chaqiruvchi (poller) kutadi
+                    started = time.monotonic()
+                    while self._pending >= self.max_pending and not self._closed:
+                        self._not_full.wait()
+                    self._blocked += 1
+                    self._blocked_seconds += time.monotonic() - started
+                    if self._closed:
+                        continue
+                self._enqueue_locked(update)
+        return True
+
+    def _enqueue_locked(self, update):
+        key = self.chat_key(update)
+        if key is None:
+            # Chatga bog'lanmagan update'lar tartibsiz ishlanadi
+            key = ("update", update.get("update_id"), id(update))
+        queue = self._queues.get(key)
+        if queue is None:
+            # Chat hozir ishlanmayapti - navbatga qo'yamiz
+            queue = self._queues[key] = deque()
+            self._ready.append(key)
+        queue.append((time.monotonic(), update))
+        self._pending += 1
+        self._submitted += 1
+        if self._pending > self._max_depth:
+            self._max_depth = self._pending
+        self._cond.notify()
+
+    def _shed_locked(self, update):
+        """Past ustuvorlikdagi update navbatga kirmaydi (ariza flow'i qadamlari oldinda turadi).
+
+        Chatda navbatdagi yoki ishlanayotgan update bo'lsa chetlatilmaydi (FIFO saqlanadi).
+        """
+        if self.priority is None or self.on_shed is None or self.priority(update) != "low":
+            return False
+        key = self.chat_key(update)
+        if key is None or key in self._queues or len(self._shed) == self._shed.maxlen:
+            return False
+        # Chat band: keyingi update'lari shu javobdan keyin ishlanadi (_ready'ga qo'yilmaydi)
+        self._queues[key] = deque()
+        self._shed.append((key, update))
+        self._shedding += 1
+        self._shed_ready.notify()
+        return True
+
+    def _shed_worker(self):
+        while True:
+            with self._cond:
+                while not self._shed and not self._closed:
+                    self._shed_ready.wait()
+                if not self._shed:
+                    return
+                key, update = self._shed.popleft()
+            kind = next((k for k in update if k != "update_id"), "unknown")
+            delay = self._update_delay(update)
+            started = time.perf_counter()
+            try:
+                answered = self.on_shed(update)
+            except Exception as e:
+                answered = False
+                logger.error(f"Chetlatilgan update'ga javob berishda xatolik: {e}")
+            if answered:
+                # Odatdagi yo'l bilan bir xil metrikalar (javobsizlari navbatda o'lchanadi)
+                if delay is not None:
+                    UPDATE_DELAY_SECONDS.observe(delay, kind=kind)
+                HANDLE_UPDATE_SECONDS.observe(time.perf_counter() - started, kind=kind)
+            with self._cond:
+                self._shedding -= 1
+                queue = self._queues[key]
+                if answered:
+                    self._shed_answered += 1
+                else:
+                    # Keshdan javob yo'q - odatdagi yo'l bilan, chat navbatining boshidan
+                    self._shed_requeued += 1
+                    queue.appendleft((time.monotonic(), update))
+                    self._pending += 1
+                    self._submitted += 1
+                if queue:
+                    self._ready.append(key)
+                    self._cond.notify()
+                else:
+                    del self._queues[key]
+                if self._closed:
+                    self._cond.notify_all()
+
+    def _worker(self):
+        while True:
+            with self._cond:
+                # To'xtatishda chetlatilganlar ham navbatga qaytishi mumkin - ularni kutamiz
+                while not self._ready and not (self._closed and not self._shedding):
+                    self._cond.wait()
+                if not self._ready:
+                    return
+                key = self._ready.popleft()
+                enqueued_at, update = self._queues[key].popleft()
+                self._pending -= 1
+                self._active += 1
+                if self.max_pending:
+                    self._not_full.notify()
+                wait = time.monotonic() - enqueued_at
+                self._wait_total += wait
+                if wait > self._wait_max:
+                    self._wait_max = wait
+
+            failed = False
+            kind = next((k for k in update if k != "update_id"), "unknown")
+            DISPATCH_WAIT_SECONDS.observe(wait)
+            delay = self._update_delay(update)
+            if delay is not None:
+                UPDATE_DELAY_SECONDS.observe(delay, kind=kind)
+            try:
+                with HANDLE_UPDATE_SECONDS.time(kind=kind):
+                    self.handler(update)
+            except Exception as e:
+                failed = True
+                logger.exception(f"Update qayta ishlashda xatolik: {e}")
+
+            with self._cond:
+                self._active -= 1
+                self._completed += 1
+                if failed:
+                    self._failed += 1
+                if self._queues[key]:
+                    # Shu chatning keyingi update'i - navbat oxiriga (chatlar orasida adolatli)
+                    self._ready.append(key)
+                    self._cond.notify()
+                else:
+                    del self._queues[key]
+                if self._closed:
+                    self._cond.notify_all()
+
+    @staticmethod
+    def _update_delay(update):
+        """Telegram serveridagi vaqtdan (soniya aniqligida): poll, navbat va jarayonlar orasidagi kutish"""
+        message = update.get("message") or update.get("edited_message")
+        sent_at = message and (message.get("edit_date") or message.get("date"))
+        return max(0.0, time.time() - sent_at) if sent_at else None
+
+    def saturation(self):
+        """Navbat to'lganlik ulushi (0..1); chegarasiz navbatda doim 0"""
+        if not self.max_pending:
+            return 0.0
+        return min(1.0, self._pending / self.max_pending)
+
+    def stats(self):
+        with self._cond:
+            started = self._completed + self._active
+            return {
+                "workers": self.max_workers,
+                "queue_depth": self._pending,
+                "max_pending": self.max_pending,
+                "saturation": round(self.saturation(), 3),
+                "max_queue_depth": self._max_depth,
+                "active": self._active,
+                "chats": len(self._queues),
+                "submitted": self._submitted,
+                "completed": self._completed,
+                "failed": self._failed,
+                "avg_wait_ms": round(self._wait_total / started * 1000, 2) if started else 0.0,
+                "max_wait_ms": round(self._wait_max * 1000, 2),
+                "blocked": self._blocked,
+                "blocked_seconds": round(self._blocked_seconds, 3),
+                "rejected": self._rejected,
+                "shed_answered": self._shed_answered,
+                "shed_requeued": self._shed_requeued,
+            }
+
+    def shutdown(self, wait=True):
+        """Yangi update qabul qilishni to'xtatish; wait=True bo'lsa navbatdagilar tugashini kutish"""
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+            self._not_full.notify_all()
+            self._shed_ready.notify_all()
+        if wait:
+            for t in self._workers:
+                t.join()
 
 class Config:
     TOKEN = os.environ.get("TELEGRAM_BOT_TOKEN")
     HR_CHAT_ID = os.environ.get("HR_CHAT_ID")
     FIREBASE_CREDS_JSON = os.environ.get("FIREBASE_CREDENTIALS")
     FIREBASE_CREDS_FILE = os.environ.get("FIREBASE_CREDENTIALS_FILE") or "alxorazmiyishbot-firebase-adminsdk-fbsvc-b24fba48ab.json"
+    # Update'larni qayta ishlovchi worker thread'lar soni
+    WORKERS = int(os.environ.get("BOT_WORKERS") or 8)
+    # >0 bo'lsa update'lar chat_id bo'yicha shuncha worker jarayoniga taqsimlanadi (har birida WORKERS thread)
+    WORKER_PROCESSES = int(os.environ.get("BOT_WORKER_PROCESSES") or 0)
+    # Har bir worker jarayoni navbatining hajmi; to'lsa polling kutadi
+    WORKER_QUEUE_SIZE = int(os.environ.get("BOT_WORKER_QUEUE_SIZE") or 1000)
+    # ChatDispatcher navbati chegarasi (0 - chegarasiz); to'lganda polling kutadi, statik menyu so'rovlari chetlatiladi
+    QUEUE_SIZE = int(os.environ.get("BOT_QUEUE_SIZE") or 2000)
+    # asyncio asosidagi Telegram klienti (bitta event loop, umumiy keep-alive pool)
+    ASYNC_API = (os.environ.get("TELEGRAM_ASYNC_API") or "").strip().lower() in ("1", "true", "yes")
+    # Chiquvchi xabarlar limiti (Telegram: ~30 xabar/s umumiy, ~1 xabar/s bitta chatga)
+    RATE_GLOBAL = float(os.environ.get("TELEGRAM_RATE_GLOBAL") or 30)
+    RATE_PER_CHAT = float(os.environ.get("TELEGRAM_RATE_PER_CHAT") or 1)
+    RATE_CHAT_BURST = int(os.environ.get("TELEGRAM_RATE_CHAT_BURST") or 3)
+    # Limit tufayli navbatga tushgan xabarlarni yuboruvchi thread'lar soni
+    SEND_WORKERS = int(os.environ.get("TELEGRAM_SEND_WORKERS") or 4)
+    # Firestore write-behind: har N ms da yoki M ta yozuv yig'ilganda batch yuboriladi
+    DB_FLUSH_INTERVAL_MS = int(os.environ.get("DB_FLUSH_INTERVAL_MS") or 200)
+    DB_FLUSH_MAX_ITEMS = int(os.environ.get("DB_FLUSH_MAX_ITEMS") or 100)
+    # Lokal SQLite ombori (state journal); bo'sh qiymat - o'chirilgan
+    LOCAL_DB_PATH = os.environ.get("LOCAL_DB_PATH", "bot_local.db")
+    # Lavozim qidiruvi uchun xotiradagi trigram indeksi (substring qidiruv)
+    SEARCH_NGRAM_INDEX = (os.environ.get("SEARCH_NGRAM_INDEX") or "").strip().lower() in ("1", "true", "yes")
+    # Bot profili (komandalar, description, logo) hash'lari saqlanadigan fayl
+    PROFILE_MANIFEST_PATH = os.environ.get("BOT_PROFILE_MANIFEST") or ".bot_profile_manifest.json"
+    # Shu chegaradan sekin update trace'lari /traces orqali ko'rinadi
+    TRACE_SLOW_MS = float(os.environ.get("TRACE_SLOW_MS") or 1000)
+    TRACE_BUFFER_SIZE = int(os.environ.get("TRACE_BUFFER_SIZE") or 100)
+    # /metrics, /traces, /stats uchun token (Authorization: Bearer <token>); bo'sh - faqat localhost'dan
+    DIAGNOSTICS_TOKEN = os.environ.get("DIAGNOSTICS_TOKEN")
+    # Ariza saqlash / HR xabari kabi fon ishlarini bajaruvchi outbox worker'lari
+    OUTBOX_WORKERS = int(os.environ.get("OUTBOX_WORKERS") or 4)
+    # Urinishlari tugagan ("dead") outbox ishlari shuncha soniyadan keyin qayta navbatga qo'yiladi; 0 - hech qachon
+    OUTBOX_DEAD_RETRY_SEC = int(os.environ.get("OUTBOX_DEAD_RETRY_SEC") or 3600)
+    # Firestore hr_outbox'ni tekshirish oralig'i (s); 0 - o'chirilgan
+    HR_OUTBOX_SWEEP_SEC = int(os.environ.get("HR_OUTBOX_SWEEP_SEC") or 60)
+    # HR xabarini yuborayotgan jarayonning hr_outbox lease muddati (s); tugasa boshqa jarayon qayta oladi
+    HR_OUTBOX_LEASE_SEC = int(os.environ.get("HR_OUTBOX_LEASE_SEC") or 600)
+    # Jarayonlar orasida umumiy state/til ombori: "" (faqat jarayon ichidagi cache),
+    # "memory", "redis://host:6379/0" (yoki tools/resp_server.py) yoki "firestore"
+    STATE_BACKEND = (os.environ.get("STATE_BACKEND") or "").strip()
+    # Kelgan update'larni replay uchun yozish (tools/replay.py); bo'sh qiymat - o'chirilgan
+    CAPTURE_DIR = os.environ.get("UPDATE_CAPTURE_DIR")
+    CAPTURE_MAX_MB = float(os.environ.get("UPDATE_CAPTURE_MAX_MB") or 64)
+    CAPTURE_MAX_FILES = int(os.environ.get("UPDATE_CAPTURE_MAX_FILES") or 20)
+
+    @classmethod
+    def rate_limiter(cls):
+        return TelegramRateLimiter(
+            global_rate=cls.RATE_GLOBAL,
+            chat_rate=cls.RATE_PER_CHAT,
+            chat_burst=cls.RATE_CHAT_BURST,
+        )
+    # getUpdates: maksimal limit va jim paytdagi long poll timeout'i (AdaptivePoller)
+    POLL_LIMIT = min(100, int(os.environ.get("POLL_LIMIT") or 100))
+    POLL_TIMEOUT = int(os.environ.get("POLL_TIMEOUT") or 30)
+    # Telegram Bot API manzili (lokal fake server bilan test qilish uchun o'zgartiriladi)
+    API_BASE_URL = (os.environ.get("TELEGRAM_API_BASE_URL") or "https://api.telegram.org").rstrip("/")
+
+    # Update'larni qabul qilish rejimi: "polling" (getUpdates) yoki "webhook"
+    BOT_MODE = (os.environ.get("BOT_MODE") or "polling").strip().lower()
+    WEBHOOK_URL = os.environ.get("WEBHOOK_URL")
+    WEBHOOK_SECRET = os.environ.get("WEBHOOK_SECRET")
+    WEBHOOK_PATH = os.environ.get("WEBHOOK_PATH") or "/webhook"
 
     @classmethod
     def validate(cls):
@@ -98,11 +705,404 @@ class Config:
         if not cls.HR_CHAT_ID:
             logger.error("HR_CHAT_ID topilmadi")
             return False
+        if cls.STATE_BACKEND and cls.STATE_BACKEND not in ("memory", "firestore") \
+                and not cls.STATE_BACKEND.startswith("redis://"):
+            logger.error(f"STATE_BACKEND noto'g'ri: {cls.STATE_BACKEND}")
+            return False
+        if cls.BOT_MODE not in ("polling", "webhook"):
+            logger.error(f"BOT_MODE noto'g'ri: {cls.BOT_MODE} (polling yoki webhook bo'lishi kerak)")
+            return False
+        if cls.BOT_MODE == "webhook":
+            if not cls.WEBHOOK_URL:
+                logger.error("Webhook rejimi uchun WEBHOOK_URL topilmadi")
+                return False
+            if not cls.WEBHOOK_SECRET:
+                logger.error("Webhook rejimi uchun WEBHOOK_SECRET topilmadi")
+                return False
         return True
 
+class Tracer:
+    """Jarayon ichidagi yengil tracer.
+
+    handle_update root trace ochadi; shu thread'dagi api.call va db.* chaqiruvlari
+    ichki span sifatida (davomiylik va natija bilan) yoziladi. Chegaradan sekin
+    trace'lar ring buffer'da saqlanadi va /traces orqali o'qiladi.
+    """
+    def __init__(self, slow_ms=1000, capacity=100):
+        self.slow_threshold = slow_ms / 1000
+        self._local = threading.local()
+        self._slow = deque(maxlen=capacity)
+        self._lock = threading.Lock()
+        self.traced = 0
+        self.slow_count = 0
+
+    @contextmanager
+    def trace(self, name, **attrs):
+        if getattr(self._local, "trace", None) is not None:
+            # Ichma-ich trace ochilmaydi, oddiy span bo'ladi
+            with self.span(name, **attrs) as span:
+                yield span
+            return
+        trace = {
+            "name": name,
+            "started_at": datetime.now().isoformat(timespec="milliseconds"),
+            "attrs": attrs,
+            "outcome": "ok",
+            "spans": [],
+            "_start": time.perf_counter(),
+        }
+        self._local.trace = trace
+        self._local.depth = 0
+        try:
+            yield trace
+        except Exception as e:
+            trace["outcome"] = f"error: {e.__class__.__name__}"
+            raise
+        finally:
+            self._local.trace = None
+            duration = time.perf_counter() - trace.pop("_start")
+            trace["duration_ms"] = round(duration * 1000, 2)
+            # Ichki span'lar tugash tartibida yig'iladi, boshlanish tartibiga keltiramiz
+            trace["spans"].sort(key=lambda span: span["offset_ms"])
+            with self._lock:
+                self.traced += 1
+                if duration >= self.slow_threshold:
+                    self.slow_count += 1
+                    self._slow.append(trace)
+
+    @contextmanager
+    def span(self, name, **attrs):
+        """Joriy trace ichida span; trace yo'q bo'lsa (fon thread'lari) hech narsa yozilmaydi"""
+        trace = getattr(self._local, "trace", None)
+        if trace is None:
+            yield None
+            return
+        start = time.perf_counter()
+        span = {
+            "name": name,
+            "depth": self._local.depth,
+            "offset_ms": round((start - trace["_start"]) * 1000, 2),
+            "outcome": "ok",
+        }
+        if attrs:
+            span["attrs"] = attrs
+        self._local.depth += 1
+        try:
+            yield span
+        except Exception as e:
+            span["outcome"] = f"error: {e.__class__.__name__}"
+            raise
+        finally:
+            self._local.depth -= 1
+            span["duration_ms"] = round((time.perf_counter() - start) * 1000, 2)
+            trace["spans"].append(span)
+
+    def slow_traces(self, limit=None):
+        """Eng so'nggi sekin trace'lar (yangilari birinchi)"""
+        with self._lock:
+            traces = list(reversed(self._slow))
+        return traces[:limit] if limit else traces
+
+    def stats(self):
+        with self._lock:
+            return {
+                "slow_threshold_ms": round(self.slow_threshold * 1000, 2),
+                "traced": self.traced,
+                "slow": self.slow_count,
+                "buffered": len(self._slow),
+            }
+
+
+TRACER = Tracer(slow_ms=Config.TRACE_SLOW_MS, capacity=Config.TRACE_BUFFER_SIZE)
+
+# Rate limit qo'llaniladigan (chatga xabar yuboruvchi) methodlar
+RATE_LIMITED_METHODS = frozenset({
+    "sendMessage", "sendPhoto", "sendDocument", "sendMediaGroup",
+    "editMessageText", "copyMessage", "forwardMessage",
+})
+
+
+def _retry_after(result):
+    """429 javobidagi parameters.retry_after (soniya)"""
+    try:
+        return float((result.get("parameters") or {}).get("retry_after") or 1)
+    except (TypeError, ValueError, AttributeError):
+        return 1.0
+
+
+class TokenBucket:
+    """GCRA (virtual scheduling) ko'rinishidagi token bucket.
+
+    tat - navbatdagi token "nazariy" chiqish vaqti. Navbat tokenlar manfiyga tushishi
+    kabi ishlaydi: yuborish rad etilmaydi, balki keyingi bo'sh vaqtga suriladi.
+    """
+    __slots__ = ("interval", "tolerance", "tat")
+
+    def __init__(self, rate, burst=1):
+        self.interval = 1.0 / rate
+        self.tolerance = self.interval * max(burst - 1, 0)
+        self.tat = 0.0
+
+    def earliest(self, now):
+        return max(now, self.tat - self.tolerance)
+
+    def commit(self, at):
+        self.tat = max(self.tat, at) + self.interval
+
+    def block_until(self, at):
+        self.tat = max(self.tat, at + self.tolerance)
+
+
+class TelegramRateLimiter:
+    """Telegram limitlari: umumiy (global) bucket + har bir chat uchun alohida bucket.
+
+    reserve() yuborishga ruxsat berilgan vaqtgacha necha soniya kutish kerakligini
+    qaytaradi va shu slotni band qiladi - burst'lar rad etilmay, tekislanadi.
+    """
+    def __init__(self, global_rate=30, chat_rate=1, chat_burst=3, group_rate=20 / 60, group_burst=3):
+        self.global_bucket = TokenBucket(global_rate, burst=global_rate)
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.group_rate = group_rate
+        self.group_burst = group_burst
+        self._chats = {}
+        self._lock = threading.Lock()
+
+    def _chat_bucket(self, chat_id, now):
+        key = str(chat_id)
+        bucket = self._chats.get(key)
+        if bucket is None:
+            if len(self._chats) >= 10000:
+                # Bo'sh turgan chat bucket'larini tozalash
+                self._chats = {k: b for k, b in self._chats.items() if b.tat > now}
+            # Manfiy chat_id - guruh/kanal (minutiga 20 ta xabar)
+            if key.startswith("-"):
+                bucket = TokenBucket(self.group_rate, burst=self.group_burst)
+            else:
+                bucket = TokenBucket(self.chat_rate, burst=self.chat_burst)
+            self._chats[key] = bucket
+        return bucket
+
+    def reserve(self, chat_id=None):
+        with self._lock:
+            now = time.monotonic()
+            chat = self._chat_bucket(chat_id, now) if chat_id is not None else None
+            at = self.global_bucket.earliest(now)
+            # Global slot chat slotigacha surilmaydi: bitta kutayotgan chat boshqa chatlarni to'xtatmasin
+            self.global_bucket.commit(at)
+            if chat is not None:
+                at = max(at, chat.earliest(now))
+                chat.commit(at)
+            return at - now
+
+    def penalize(self, chat_id, retry_after):
+        """429 javobidan keyin bucket'ni retry_after soniyaga bloklash"""
+        with self._lock:
+            until = time.monotonic() + retry_after
+            if chat_id is not None:
+                self._chat_bucket(chat_id, until).block_until(until)
+            else:
+                self.global_bucket.block_until(until)
+
+
+# Navbatga qo'yilgan (hali yuborilmagan) xabar uchun call() javobi
+QUEUED_RESULT = {"ok": True, "queued": True}
+
+
+def _buffer_files(files):
+    """Navbatdagi xabar fayllari xotiraga o'qiladi (chaqiruvchi faylni yopib qo'yishi mumkin)"""
+    if not files:
+        return files
+    buffered = {}
+    for name, f in files.items():
+        if hasattr(f, "read"):
+            if hasattr(f, "seek"):
+                f.seek(0)
+            data = io.BytesIO(f.read())
+            data.name = getattr(f, "name", name)
+            f = data
+        buffered[name] = f
+    return buffered
+
+
+class ChatSendQueue:
+    """Rate limit tufayli kutishi kerak bo'lgan xabarlar navbati.
+
+    Handler thread'i uxlamaydi: kutish kerak bo'lsa xabar chat navbatiga qo'yiladi va
+    limiter bergan vaqtda sender thread'lari yuboradi. Chat ichida tartib saqlanadi
+    (navbatda xabari bor chatning yangi xabarlari ham navbat oxiriga), xabarlar
+    tashlab yuborilmaydi - 429 bo'lsa retry_after'dan keyin qayta yuboriladi.
+    """
+    def __init__(self, limiter, send, workers=4, name="send-queue"):
+        self.limiter = limiter
+        self._send = send
+        self._chats = {}      # chat -> deque[(reserved_at, job, future)]
+        self._ready = []      # heap: (due, seq, chat) - har chatning birinchi xabari
+        self._seq = 0
+        self._pending = 0
+        self._cond = threading.Condition()
+        self._closed = False
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix=name)
+        self.sent = 0
+        self.throttled = 0
+        METRICS.gauge("bot_send_queue_pending", "Messages waiting for a rate limit slot",
+                      lambda: self.stats()["pending"], queue=name)
+        METRICS.gauge("bot_send_queue_throttled_total", "Telegram 429 responses rescheduled",
+                      lambda: self.stats()["throttled"], "counter", queue=name)
+        self._scheduler = threading.Thread(target=self._run, name=f"{name}-scheduler", daemon=True)
+        self._scheduler.start()
+
+    def call(self, chat_id, job, block=False):
+        """job = (method, params, files, timeout, max_retries).
+
+        Slot hozir bo'sh bo'lsa shu thread'da yuboriladi. Aks holda navbatga qo'yiladi:
+        block=False - darhol QUEUED_RESULT, block=True - haqiqiy javob kutiladi.
+        """
+        while True:
+            future = self._schedule(chat_id, job)
+            if future is not None:
+                return future.result() if block else dict(QUEUED_RESULT)
+            result = self._send(*job)
+            if result.get("error_code") != 429:
+                return result
+            self._throttle(job[0], chat_id, result)
+
+    def _schedule(self, chat_id, job):
+        key = str(chat_id)
+        with self._cond:
+            wait = self.limiter.reserve(chat_id)
+            if wait <= 0 and key not in self._chats:
+                return None
+            future = Future()
+            job = job[:2] + (_buffer_files(job[2]),) + job[3:]
+            chat = self._chats.get(key)
+            if chat is None:
+                # Chatda navbat yo'q - birinchi xabar jadvalga tushadi
+                chat = self._chats[key] = deque()
+                self._ready_locked(key, time.monotonic() + wait)
+            chat.append((time.monotonic() + wait, chat_id, job, future))
+            self._pending += 1
+            return future
+
+    def _ready_locked(self, key, due):
+        self._seq += 1
+        heapq.heappush(self._ready, (due, self._seq, key))
+        # close() ham shu condition'da kutadi - scheduler albatta uyg'onishi kerak
+        self._cond.notify_all()
+
+    def _throttle(self, method, chat_id, result):
+        retry_after = _retry_after(result)
+        self.limiter.penalize(chat_id, retry_after)
+        with self._cond:
+            self.throttled += 1
+        logger.warning(f"API 429 ({method}), {retry_after:.0f}s dan keyin qayta yuboriladi")
+
+    def _run(self):
+        with self._cond:
+            while not self._closed:
+                if not self._ready:
+                    self._cond.wait()
+                    continue
+                due, _, key = self._ready[0]
+                delay = due - time.monotonic()
+                if delay > 0:
+                    self._cond.wait(delay)
+                    continue
+                heapq.heappop(self._ready)
+                # Chat xabari yuborilguncha keyingisi jadvalga tushmaydi (tartib uchun)
+                self._pool.submit(self._deliver, key, self._chats[key][0])
+
+    def _deliver(self, key, item):
+        _, chat_id, job, future = item
+        try:
+            result = self._send(*job)
+        except Exception as e:
+            result = {"ok": False, "description": str(e)}
+        if result.get("error_code") == 429:
+            self._throttle(job[0], chat_id, result)
+        with self._cond:
+            chat = self._chats[key]
+            if result.get("error_code") == 429:
+                # Xabar navbat boshida qoladi, yangi slot bilan qayta yuboriladi
+                due = time.monotonic() + self.limiter.reserve(chat_id)
+                chat[0] = (due, chat_id, job, future)
+                self._ready_locked(key, due)
+                return
+            chat.popleft()
+            self._pending -= 1
+            self.sent += 1
+            if chat:
+                self._ready_locked(key, chat[0][0])
+            else:
+                del self._chats[key]
+                self._cond.notify_all()
+        future.set_result(result)
+
+    def stats(self):
+        with self._cond:
+            oldest = min((chat[0][0] for chat in self._chats.values()), default=None)
+            return {
+                "pending": self._pending,
+                "chats": len(self._chats),
+                "next_in": max(0.0, oldest - time.monotonic()) if oldest is not None else 0.0,
+                "sent": self.sent,
+                "throttled": self.throttled,
+            }
+
+    def close(self, timeout=30):
+        """Navbatdagi xabarlarni yuborib bo'lishni kutish (timeout'gacha)"""
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            while self._chats and time.monotonic() < deadline:
+                self._cond.wait(min(1.0, deadline - time.monotonic()))
+            if self._chats:
+                logger.warning(f"Yuborish navbati: {self._pending} ta xabar yuborilmay qoldi")
+            self._closed = True
+            self._cond.notify_all()
+        self._pool.shutdown(wait=False)
+
+# JSON codec: orjson o'rnatilgan bo'lsa u, aks holda stdlib json
+if orjson is not None:
+    JSON_CODEC = "orjson"
+
+    def _json_encode(obj):
+        return orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS)
+
+    _json_decode = orjson.loads
+else:
+    JSON_CODEC = "json"
+
+    def _json_encode(obj):
+        return json.dumps(obj, ensure_ascii=False, separators=(",", ":")).encode()
+
+    _json_decode = json.loads
+
+
+def _form_fields(params):
+    """Multipart/form uchun: ichma-ich qiymatlar (ro'yxat, dict, bool) JSON satrga aylantiriladi"""
+    return {
+        key: value if isinstance(value, (str, bytes, int, float)) and not isinstance(value, bool) else json.dumps(value)
+        for key, value in (params or {}).items()
+    }
+
+
+class RawJSON(str):
+    """Oldindan JSON'ga aylantirilgan qiymat (masalan, doimiy klaviatura) - qayta kodlanmaydi"""
+    __slots__ = ()
+
+
+def _markup_json(markup):
+    return markup if isinstance(markup, RawJSON) else json.dumps(markup)
+
+
+JSON_HEADERS = {"Content-Type": "application/json"}
+
+
 class TelegramAPI:
-    def __init__(self, token):
-        self.base_url = f"https://api.telegram.org/bot{token}/"
+    def __init__(self, token, api_base_url=None, rate_limiter=None):
+        self.base_url = f"{api_base_url or Config.API_BASE_URL}/bot{token}/"
+        self.limiter = rate_limiter or Config.rate_limiter()
+        self.sends = ChatSendQueue(self.limiter, self._call, workers=Config.SEND_WORKERS, name="telegram-send")
         self.session = requests.Session()
 
         # Configure connection pooling for better performance
@@ -120,7 +1120,33 @@ class TelegramAPI:
         self.session.mount("https://", adapter)
         self.session.mount("http://", adapter)
 
-    def call(self, method, params=None, files=None, timeout=10, max_retries=2):
+    def call(self, method, params=None, files=None, timeout=10, max_retries=2, block=False):
+        """Telegram API chaqiruvi.
+
+        Xabar yuborish methodlari rate limiter orqali o'tadi: kutish kerak bo'lsa xabar
+        chat navbatiga qo'yiladi va QUEUED_RESULT qaytadi (block=True - yuborilishini kutish).
+        """
+        with TRACER.span(f"api.{method}") as span:
+            if method in RATE_LIMITED_METHODS:
+                chat_id = params.get("chat_id") if params else None
+                result = self.sends.call(chat_id, (method, params, files, timeout, max_retries), block)
+            else:
+                result = self._call(method, params, files, timeout, max_retries)
+            if span is not None:
+                if result.get("queued"):
+                    span["outcome"] = "queued"
+                elif not result.get("ok"):
+                    span["outcome"] = f"error {result.get('error_code', '')}".strip()
+        return result
+
+    def _call(self, method, params, files, timeout, max_retries):
+        with TELEGRAM_CALL_SECONDS.time(method=method):
+            result = self._request(method, params, files, timeout, max_retries)
+        if not result.get("ok"):
+            TELEGRAM_CALL_ERRORS.inc(method=method, code=result.get("error_code", ""))
+        return result
+
+    def _request(self, method, params, files, timeout, max_retries):
         url = self.base_url + method
 
         # getUpdates uchun timeout'ni sozlash
@@ -133,29 +1159,38 @@ class TelegramAPI:
         # Retry mexanizmi (getUpdates bundan mustasno)
         retries = max_retries if method != "getUpdates" else 0
 
-        for attempt in range(retries + 1):
+        attempt = 0
+        while True:
             try:
-                response = self.session.post(url, data=params, files=files, timeout=timeout)
+                if files:
+                    for f in files.values():
+                        if hasattr(f, "seek"):
+                            f.seek(0)
+                    response = self.session.post(url, data=_form_fields(params), files=files, timeout=timeout)
+                else:
+                    response = self.session.post(url, data=_json_encode(params or {}), headers=JSON_HEADERS, timeout=timeout)
+                if response.status_code == 429:
+                    # Qayta yuborishni ChatSendQueue retry_after bo'yicha rejalashtiradi
+                    return self._json_or_error(response)
                 response.raise_for_status()
-                return response.json()
+                return self._decode(method, response.content)
             except requests.exceptions.Timeout as e:
                 if attempt < retries:
-                    wait_time = 0.5 * (attempt + 1)  # 0.5s, 1s
-                    logger.debug(f"API timeout ({method}), retry {attempt + 1}/{retries + 1}")
+                    attempt += 1
+                    wait_time = 0.5 * attempt  # 0.5s, 1s
+                    logger.debug(f"API timeout ({method}), retry {attempt}/{retries + 1}")
                     time.sleep(wait_time)
                 else:
                     logger.error(f"API timeout ({method}): {e}")
                     return {"ok": False, "description": f"Timeout: {str(e)}"}
             except requests.exceptions.HTTPError as e:
                 logger.error(f"API HTTP xatolik ({method}): {e}")
-                try:
-                    return response.json()
-                except:
-                    return {"ok": False, "description": str(e)}
+                return self._json_or_error(response, e)
             except requests.exceptions.ConnectionError as e:
                 if attempt < retries:
-                    wait_time = 0.5 * (attempt + 1)
-                    logger.debug(f"API connection error ({method}), retry {attempt + 1}/{retries + 1}")
+                    attempt += 1
+                    wait_time = 0.5 * attempt
+                    logger.debug(f"API connection error ({method}), retry {attempt}/{retries + 1}")
                     time.sleep(wait_time)
                 else:
                     logger.error(f"API connection error ({method}): {e}")
@@ -164,18 +1199,31 @@ class TelegramAPI:
                 logger.error(f"API kutilmagan xatolik ({method}): {e}")
                 return {"ok": False, "description": str(e)}
 
-        return {"ok": False, "description": "Unknown error"}
+    @staticmethod
+    def _decode(method, body):
+        result = _json_decode(body)
+        if method == "getUpdates" and isinstance(result, dict):
+            # Xom javob saqlanadi (capture/replay qayta kodlamasdan yozishi uchun)
+            result["raw"] = body
+        return result
+
+    @staticmethod
+    def _json_or_error(response, error=None):
+        try:
+            return _json_decode(response.content)
+        except Exception:
+            return {"ok": False, "error_code": response.status_code, "description": str(error or response.reason)}
 
-    def send_message(self, chat_id, text, reply_markup=None):
+    def send_message(self, chat_id, text, reply_markup=None, block=False):
         params = {
             "chat_id": chat_id,
             "text": text,
             "parse_mode": "HTML"
         }
         if reply_markup:
-            params["reply_markup"] = json.dumps(reply_markup)
+            params["reply_markup"] = _markup_json(reply_markup)
 
-        result = self.call("sendMessage", params)
+        result = self.call("sendMessage", params, block=block)
 
         # Only log critical errors (call method already logs retries)
         if not result.get("ok"):
@@ -183,58 +1231,1415 @@ class TelegramAPI:
 
         return result
 
-class FirestoreDB:
+    def close(self, timeout=30):
+        self.sends.close(timeout)
+
+class _AsyncConnectionPool:
+    """HTTP/1.1 keep-alive ulanishlar pooli (asyncio streams asosida)"""
+    def __init__(self, host, port, use_ssl, max_size=20, idle_timeout=60):
+        self.host = host
+        self.port = port
+        self.ssl_context = ssl.create_default_context() if use_ssl else None
+        self.idle_timeout = idle_timeout
+        self._idle = deque()   # (reader, writer, last_used)
+        self._slots = asyncio.Semaphore(max_size)
+
+    async def _connect(self):
+        # Pooldan tirik ulanishni olish, bo'lmasa yangisini ochish
+        now = time.monotonic()
+        while self._idle:
+            reader, writer, last_used = self._idle.pop()
+            if now - last_used < self.idle_timeout and not writer.is_closing() and not reader.at_eof():
+                return reader, writer, True
+            writer.close()
+        reader, writer = await asyncio.open_connection(
+            self.host, self.port, ssl=self.ssl_context,
+            server_hostname=self.host if self.ssl_context else None
+        )
+        return reader, writer, False
+
+    async def request(self, method, path, body=b"", headers=None):
+        async with self._slots:
+            for attempt in range(2):
+                reader, writer, reused = await self._connect()
+                keep = False
+                try:
+                    head = [f"{method} {path} HTTP/1.1", f"Host: {self.host}", f"Content-Length: {len(body)}"]
+                    head += [f"{k}: {v}" for k, v in (headers or {}).items()]
+                    writer.write(("\r\n".join(head) + "\r\n\r\n").encode("latin-1") + body)
+                    await writer.drain()
+                    status, resp_headers, data, keep = await self._read_response(reader)
+                    return status, resp_headers, data
+                except (asyncio.IncompleteReadError, ConnectionResetError, BrokenPipeError):
+                    # Server eski keep-alive ulanishni yopgan bo'lishi mumkin - yangisi bilan bir marta urinamiz
+                    if reused and attempt == 0:
+                        continue
+                    raise
+                finally:
+                    if keep:
+                        self._idle.append((reader, writer, time.monotonic()))
+                    else:
+                        writer.close()
+
+    async def _read_response(self, reader):
+        status_line = await reader.readuntil(b"\r\n")
+        parts = status_line.decode("latin-1").split(" ", 2)
+        status = int(parts[1])
+        headers = {}
+        while True:
+            line = await reader.readuntil(b"\r\n")
+            if line == b"\r\n":
+                break
+            name, _, value = line.decode("latin-1").partition(":")
+            headers[name.strip().lower()] = value.strip()
+
+        keep = headers.get("connection", "").lower() != "close"
+        if headers.get("transfer-encoding", "").lower() == "chunked":
+            chunks = []
+            while True:
+                size = int((await reader.readuntil(b"\r\n")).split(b";", 1)[0], 16)
+                if size == 0:
+                    # Trailer'lar bo'sh qatorgacha
+                    while await reader.readuntil(b"\r\n") != b"\r\n":
+                        pass
+                    break
+                chunks.append(await reader.readexactly(size))
+                await reader.readexactly(2)
+            data = b"".join(chunks)
+        elif "content-length" in headers:
+            data = await reader.readexactly(int(headers["content-length"]))
+        else:
+            data = await reader.read()
+            keep = False
+        return status, headers, data, keep
+
+    async def close(self):
+        while self._idle:
+            _, writer, _ = self._idle.pop()
+            writer.close()
+
+
+def _encode_multipart(params, files):
+    """multipart/form-data tanasini yig'ish (fayl yuborish uchun)"""
+    boundary = uuid.uuid4().hex
+    out = []
+    for name, value in _form_fields(params).items():
+        out.append(
+            f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"\r\n\r\n'.encode()
+            + str(value).encode() + b"\r\n"
+        )
+    for name, f in (files or {}).items():
+        content = f.read() if hasattr(f, "read") else f
+        filename = os.path.basename(getattr(f, "name", name))
+        out.append(
+            f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"; filename="{filename}"\r\n'
+            f'Content-Type: application/octet-stream\r\n\r\n'.encode() + content + b"\r\n"
+        )
+    out.append(f"--{boundary}--\r\n".encode())
+    return b"".join(out), f"multipart/form-data; boundary={boundary}"
+
+
+class AsyncTelegramAPI:
+    """asyncio asosidagi Telegram API klienti.
+
+    TelegramAPI bilan bir xil call/send_message interfeysi, lekin coroutine sifatida:
+    bitta event loop'da ko'plab so'rovlar parallel ketadi, timeout'lar bekor qilinadi
+    va retry kutishlari thread'ni bloklamaydi.
+    """
+    def __init__(self, token, api_base_url=None, pool_size=20, rate_limiter=None):
+        base = urllib.parse.urlsplit(api_base_url or Config.API_BASE_URL)
+        self.limiter = rate_limiter or Config.rate_limiter()
+        use_ssl = base.scheme == "https"
+        port = base.port or (443 if use_ssl else 80)
+        self._path_prefix = f"{base.path.rstrip('/')}/bot{token}/"
+        self._pool = _AsyncConnectionPool(base.hostname, port, use_ssl, max_size=pool_size)
+
+    async def call(self, method, params=None, files=None, timeout=10, max_retries=2, throttle=True):
+        """throttle=False - limiter chetlab o'tiladi (EventLoopTelegramAPI o'z navbatidan yuboradi)"""
+        with TELEGRAM_CALL_SECONDS.time(method=method):
+            result = await self._call(method, params, files, timeout, max_retries, throttle)
+        if not result.get("ok"):
+            TELEGRAM_CALL_ERRORS.inc(method=method, code=result.get("error_code", ""))
+        return result
+
+    async def _call(self, method, params, files, timeout, max_retries, throttle):
+        # Timeout va retry qoidalari TelegramAPI.call bilan bir xil
+        if method == "getUpdates":
+            timeout = params.get("timeout", 30) + 5 if params else 35
+        elif method in ["sendMessage", "sendPhoto", "sendDocument", "editMessageText"]:
+            timeout = 20
+        retries = max_retries if method != "getUpdates" else 0
+
+        if files:
+            body, content_type = _encode_multipart(params, files)
+        else:
+            body = _json_encode(params or {})
+            content_type = "application/json"
+        headers = {"Content-Type": content_type, "Connection": "keep-alive"}
+
+        limited = throttle and method in RATE_LIMITED_METHODS
+        chat_id = params.get("chat_id") if limited and params else None
+
+        attempt = 0
+        while True:
+            if limited:
+                # Kutish loop'ni bloklamaydi; xabar tashlab yuborilmaydi
+                wait = self.limiter.reserve(chat_id)
+                if wait > 0:
+                    await asyncio.sleep(wait)
+            try:
+                status, _, data = await asyncio.wait_for(
+                    self._pool.request("POST", self._path_prefix + method, body, headers), timeout
+                )
+                try:
+                    result = TelegramAPI._decode(method, data)
+                except ValueError:
+                    result = {"ok": False, "error_code": status, "description": f"HTTP {status}"}
+                if status == 429 and limited:
+                    retry_after = _retry_after(result)
+                    self.limiter.penalize(chat_id, retry_after)
+                    logger.warning(f"API 429 ({method}), {retry_after:.0f}s dan keyin qayta yuboriladi")
+                    continue
+                if status >= 400:
+                    logger.error(f"API HTTP xatolik ({method}): {status} {result.get('description')}")
+                return result
+            except asyncio.TimeoutError as e:
+                if attempt < retries:
+                    attempt += 1
+                    logger.debug(f"API timeout ({method}), retry {attempt}/{retries + 1}")
+                    await asyncio.sleep(0.5 * attempt)
+                else:
+                    logger.error(f"API timeout ({method}): {e}")
+                    return {"ok": False, "description": f"Timeout: {str(e)}"}
+            except (OSError, asyncio.IncompleteReadError) as e:
+                if attempt < retries:
+                    attempt += 1
+                    logger.debug(f"API connection error ({method}), retry {attempt}/{retries + 1}")
+                    await asyncio.sleep(0.5 * attempt)
+                else:
+                    logger.error(f"API connection error ({method}): {e}")
+                    return {"ok": False, "description": f"Connection error: {str(e)}"}
+            except Exception as e:
+                logger.error(f"API kutilmagan xatolik ({method}): {e}")
+                return {"ok": False, "description": str(e)}
+
+    async def send_message(self, chat_id, text, reply_markup=None):
+        params = {
+            "chat_id": chat_id,
+            "text": text,
+            "parse_mode": "HTML"
+        }
+        if reply_markup:
+            params["reply_markup"] = _markup_json(reply_markup)
+
+        result = await self.call("sendMessage", params)
+        if not result.get("ok"):
+            logger.debug(f"send_message failed: {result.get('description')}")
+        return result
+
+    async def call_many(self, calls):
+        """Bir nechta (method, params) chaqiruvni pool orqali bir vaqtda yuborish"""
+        return await asyncio.gather(*(self.call(method, params) for method, params in calls))
+
+    async def close(self):
+        await self._pool.close()
+
+
+class EventLoopTelegramAPI:
+    """AsyncTelegramAPI uchun sinxron ko'prik.
+
+    Alohida thread'da event loop ishlaydi; BotLogic worker'lari oddiy call()/send_message()
+    chaqiradi, barcha HTTP I/O va retry kutishlari esa shu loop'da bajariladi.
+    Bu bilan yuzlab suhbatlar bitta jarayonda, umumiy ulanishlar pooli orqali ishlaydi.
+    """
+    def __init__(self, token, api_base_url=None, pool_size=50):
+        self.loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._run_loop, name="telegram-io", daemon=True)
+        self._thread.start()
+        self.aio = self._run(self._create(token, api_base_url, pool_size))
+        self.limiter = self.aio.limiter
+        # Limit kutishi loop'da emas, ChatSendQueue'da - worker thread'i bloklanmaydi
+        self.sends = ChatSendQueue(self.limiter, self._send, workers=Config.SEND_WORKERS, name="telegram-send")
+
+    def _run_loop(self):
+        asyncio.set_event_loop(self.loop)
+        self.loop.run_forever()
+
+    async def _create(self, token, api_base_url, pool_size):
+        # Semaphore va boshqa primitivlar shu loop ichida yaratiladi
+        return AsyncTelegramAPI(token, api_base_url, pool_size=pool_size)
+
+    def _run(self, coro):
+        if threading.current_thread() is self._thread:
+            raise RuntimeError("EventLoopTelegramAPI event loop thread'idan chaqirilmasin, AsyncTelegramAPI'dan foydalaning")
+        return asyncio.run_coroutine_threadsafe(coro, self.loop).result()
+
+    def _traced(self, name, call):
+        # I/O event loop thread'ida ketadi, span esa chaqiruvchi worker'ning trace'iga yoziladi
+        with TRACER.span(name) as span:
+            result = call()
+            if span is not None and isinstance(result, dict):
+                if result.get("queued"):
+                    span["outcome"] = "queued"
+                elif not result.get("ok"):
+                    span["outcome"] = f"error {result.get('error_code', '')}".strip()
+            return result
+
+    def _send(self, method, params, files, timeout, max_retries):
+        return self._run(self.aio.call(method, params, files=files, timeout=timeout, max_retries=max_retries, throttle=False))
+
+    def call(self, method, params=None, files=None, timeout=10, max_retries=2, block=False):
+        """TelegramAPI.call bilan bir xil: limitga tushgan xabar navbatga qo'yiladi"""
+        if method in RATE_LIMITED_METHODS:
+            chat_id = params.get("chat_id") if params else None
+            job = (method, params, files, timeout, max_retries)
+            return self._traced(f"api.{method}", lambda: self.sends.call(chat_id, job, block))
+        return self._traced(f"api.{method}", lambda: self._send(method, params, files, timeout, max_retries))
+
+    def send_message(self, chat_id, text, reply_markup=None, block=False):
+        params = {"chat_id": chat_id, "text": text, "parse_mode": "HTML"}
+        if reply_markup:
+            params["reply_markup"] = _markup_json(reply_markup)
+        result = self.call("sendMessage", params, block=block)
+        if not result.get("ok"):
+            logger.debug(f"send_message failed: {result.get('description')}")
+        return result
+
+    def call_many(self, calls):
+        return self._traced(f"api.call_many[{len(calls)}]", lambda: self._run(self.aio.call_many(calls)))
+
+    def close(self, timeout=30):
+        self.sends.close(timeout)
+        self._run(self.aio.close())
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self._thread.join(timeout=5)
+
+# Qidiruv uchun transliteratsiya: o'zbek (kirill) va rus harflari lotinga
+_TRANSLIT = str.maketrans({
+    "а": "a", "б": "b", "в": "v", "г": "g", "д": "d", "е": "e", "ё": "yo", "ж": "j",
+    "з": "z", "и": "i", "й": "y", "к": "k", "л": "l", "м": "m", "н": "n", "о": "o",
+    "п": "p", "р": "r", "с": "s", "т": "t", "у": "u", "ф": "f", "х": "x", "ц": "ts",
+    "ч": "ch", "ш": "sh", "щ": "sh", "ъ": "", "ы": "i", "ь": "", "э": "e", "ю": "yu",
+    "я": "ya", "ў": "o", "қ": "q", "ғ": "g", "ҳ": "h",
+    # Tutuq belgisi variantlari (o'qituvchi / oʻqituvchi / o`qituvchi) olib tashlanadi
+    "'": "", "ʻ": "", "ʼ": "", "‘": "", "’": "", "`": "",
+})
+
+
+def _normalize_search_text(text):
+    """Kichik harf, lotin yozuvi, faqat harf/raqam va bitta bo'sh joy"""
+    text = str(text or "").lower().translate(_TRANSLIT)
+    return " ".join("".join(ch if ch.isalnum() else " " for ch in text).split())
+
+
+def _search_tokens(text):
+    """Lavozim matni uchun indeks termlari: so'zlar va ularning 3+ harfli prefikslari"""
+    terms = set()
+    for word in _normalize_search_text(text).split():
+        if len(word) < 2:
+            continue
+        terms.add(word)
+        for i in range(3, len(word)):
+            terms.add(word[:i])
+    return sorted(terms)
+
+
+def _stats_day(ts=None):
+    """Statistika kuni (O'zbekiston vaqti, UTC+5) - stats_daily hujjat id'si"""
+    if ts is None:
+        ts = datetime.utcnow()
+    elif getattr(ts, "tzinfo", None) is not None:
+        ts = ts.replace(tzinfo=None) - ts.utcoffset()
+    return (ts + timedelta(hours=5)).strftime("%Y-%m-%d")
+
+
+def _stats_key(position):
+    return str(position or "Noma'lum")
+
+
+class PositionNgramIndex:
+    """Lavozimlar bo'yicha xotiradagi trigram indeksi (substring qidiruv uchun).
+
+    Trigram -> ariza id'lari to'plami. Qidiruvda so'rov trigramlari kesishmasi olinadi,
+    keyin normallashtirilgan matnda substring tekshiriladi - butun kolleksiya skan qilinmaydi.
+    """
     def __init__(self):
-        self.db = None
+        self._grams = {}
+        self._docs = {}    # doc_id -> (normallashtirilgan lavozim, timestamp)
+        self._lock = threading.Lock()
+        self.ready = False
+
+    @staticmethod
+    def _trigrams(text):
+        padded = f" {text} "
+        return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+    def add(self, doc_id, position, ts):
+        text = _normalize_search_text(position)
+        with self._lock:
+            self._remove_locked(doc_id)
+            self._docs[doc_id] = (text, ts)
+            for gram in self._trigrams(text):
+                self._grams.setdefault(gram, set()).add(doc_id)
+
+    def remove(self, doc_id):
+        with self._lock:
+            self._remove_locked(doc_id)
+
+    def _remove_locked(self, doc_id):
+        entry = self._docs.pop(doc_id, None)
+        if not entry:
+            return
+        for gram in self._trigrams(entry[0]):
+            ids = self._grams.get(gram)
+            if ids:
+                ids.discard(doc_id)
+                if not ids:
+                    del self._grams[gram]
+
+    def search(self, query_text, limit=50):
+        q = _normalize_search_text(query_text)
+        if not q:
+            return []
+        with self._lock:
+            if len(q) < 3:
+                candidates = self._docs.keys()
+            else:
+                grams = sorted(self._trigrams(q) - {f" {q[:2]}", f"{q[-2:]} "}, key=lambda g: len(self._grams.get(g, ())))
+                if not grams or grams[0] not in self._grams:
+                    return []
+                candidates = set(self._grams[grams[0]])
+                for gram in grams[1:]:
+                    candidates &= self._grams.get(gram, set())
+                    if not candidates:
+                        return []
+            hits = [(self._docs[d][1], d) for d in candidates if q in self._docs[d][0]]
+        hits.sort(reverse=True)
+        return [doc_id for _, doc_id in hits[:limit]]
+
+class LocalStore:
+    """Lokal SQLite (WAL rejimi) ombori.
+
+    State journal: har bir state o'zgarishi arzon append sifatida yoziladi, bot qayta
+    ishga tushganda oxirgi holatlar cache'ga qayta yuklanadi. Oraliq qadamlar
+    (name/phone/position/exp) Firestore'ga yozilmasa ham crash'da yo'qolmaydi.
+    """
+    def __init__(self, path, compact_every=5000):
+        self.path = path
+        self.compact_every = compact_every
+        self._lock = threading.Lock()
+        self._appends = 0
+        self.conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS state_journal ("
+            "seq INTEGER PRIMARY KEY AUTOINCREMENT, user_id TEXT NOT NULL, state TEXT, ts REAL NOT NULL)"
+        )
+        self.conn.execute("CREATE INDEX IF NOT EXISTS state_journal_user ON state_journal (user_id, seq)")
+        # Outbox: foydalanuvchiga javob qaytarilgandan keyin bajariladigan ishlar
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS outbox ("
+            "id INTEGER PRIMARY KEY AUTOINCREMENT, kind TEXT NOT NULL, key TEXT NOT NULL, payload TEXT NOT NULL, "
+            "status TEXT NOT NULL DEFAULT 'pending', attempts INTEGER NOT NULL DEFAULT 0, next_at REAL NOT NULL, "
+            "created_at REAL NOT NULL, last_error TEXT, UNIQUE (kind, key))"
+        )
+        self.conn.execute("CREATE INDEX IF NOT EXISTS outbox_due ON outbox (status, next_at)")
+        # Yetkazilgan ishlar (idempotency kaliti - ariza id'si), dublikat yubormaslik uchun
+        self.conn.execute("CREATE TABLE IF NOT EXISTS delivered (key TEXT PRIMARY KEY, ts REAL NOT NULL)")
+        # Foydalanuvchi tillari: xotiradagi cache'dan keyingi ikkinchi daraja (Firestore o'qishisiz)
+        self.conn.execute("CREATE TABLE IF NOT EXISTS user_langs (user_id TEXT PRIMARY KEY, lang TEXT NOT NULL) WITHOUT ROWID")
+
+    def record_state(self, user_id, state):
+        payload = json.dumps(state, ensure_ascii=False) if state is not None else None
+        with self._lock:
+            self.conn.execute(
+                "INSERT INTO state_journal (user_id, state, ts) VALUES (?, ?, ?)",
+                (str(user_id), payload, time.time())
+            )
+            self._appends += 1
+            if self._appends >= self.compact_every:
+                self._compact_locked()
+
+    def latest_state(self, user_id, max_age=None):
+        """Foydalanuvchining oxirgi yozilgan holati: (True, state) yoki (False, None)"""
+        with self._lock:
+            row = self.conn.execute(
+                "SELECT state, ts FROM state_journal WHERE user_id = ? ORDER BY seq DESC LIMIT 1",
+                (str(user_id),)
+            ).fetchone()
+        if not row or (max_age and time.time() - row[1] > max_age):
+            return False, None
+        return True, json.loads(row[0]) if row[0] is not None else None
+
+    def replay_states(self, max_age=None):
+        """Har bir foydalanuvchining oxirgi (None bo'lmagan) holati, eskidan yangiga"""
+        cutoff = time.time() - max_age if max_age else 0
+        with self._lock:
+            rows = self.conn.execute(
+                "SELECT user_id, state FROM state_journal WHERE seq IN "
+                "(SELECT MAX(seq) FROM state_journal GROUP BY user_id) "
+                "AND state IS NOT NULL AND ts >= ? ORDER BY seq",
+                (cutoff,)
+            ).fetchall()
+        return [(user_id, json.loads(state)) for user_id, state in rows]
+
+    def outbox_add(self, jobs):
+        """(kind, key, payload) ishlarini bitta tranzaksiyada yozish; (kind, key) takrorlansa e'tiborsiz.
+
+        Qaytaradi: haqiqatan qo'shilgan ishlar soni.
+        """
+        now = time.time()
+        with self._lock:
+            before = self.conn.total_changes
+            self.conn.execute("BEGIN")
+            try:
+                self.conn.executemany(
+                    "INSERT OR IGNORE INTO outbox (kind, key, payload, next_at, created_at) VALUES (?, ?, ?, ?, ?)",
+                    [(kind, str(key), json.dumps(payload, ensure_ascii=False), now, now) for kind, key, payload in jobs]
+                )
+                self.conn.execute("COMMIT")
+            except Exception:
+                self.conn.execute("ROLLBACK")
+                raise
+            return self.conn.total_changes - before
+
+    def outbox_due(self, limit=50):
+        """Vaqti kelgan ishlar: [(id, kind, key, payload, attempts)]"""
+        with self._lock:
+            rows = self.conn.execute(
+                "SELECT id, kind, key, payload, attempts FROM outbox "
+                "WHERE status = 'pending' AND next_at <= ? ORDER BY next_at LIMIT ?",
+                (time.time(), limit)
+            ).fetchall()
+        return [(job_id, kind, key, json.loads(payload), attempts) for job_id, kind, key, payload, attempts in rows]
+
+    def outbox_next_at(self):
+        with self._lock:
+            row = self.conn.execute("SELECT MIN(next_at) FROM outbox WHERE status = 'pending'").fetchone()
+        return row[0]
+
+    def outbox_done(self, job_id):
+        with self._lock:
+            self.conn.execute("DELETE FROM outbox WHERE id = ?", (job_id,))
+
+    def outbox_retry(self, job_id, attempts, next_at, error=None, dead=False):
+        with self._lock:
+            self.conn.execute(
+                "UPDATE outbox SET attempts = ?, next_at = ?, last_error = ?, status = ? WHERE id = ?",
+                (attempts, next_at, error, "dead" if dead else "pending", job_id)
+            )
+
+    def outbox_revive(self):
+        """Qayta urinish vaqti kelgan "dead" ishlarni pending'ga qaytarish; {kind: soni}"""
+        now = time.time()
+        with self._lock:
+            self.conn.execute("BEGIN")
+            try:
+                rows = self.conn.execute(
+                    "SELECT kind, COUNT(*) FROM outbox WHERE status = 'dead' AND next_at <= ? GROUP BY kind", (now,)
+                ).fetchall()
+                if rows:
+                    self.conn.execute(
+                        "UPDATE outbox SET status = 'pending', attempts = 0 WHERE status = 'dead' AND next_at <= ?", (now,)
+                    )
+                self.conn.execute("COMMIT")
+            except Exception:
+                self.conn.execute("ROLLBACK")
+                raise
+        return dict(rows)
+
+    def get_lang(self, user_id):
+        with self._lock:
+            row = self.conn.execute("SELECT lang FROM user_langs WHERE user_id = ?", (str(user_id),)).fetchone()
+        return row[0] if row else None
+
+    def set_lang(self, user_id, lang):
+        with self._lock:
+            self.conn.execute("INSERT OR REPLACE INTO user_langs (user_id, lang) VALUES (?, ?)", (str(user_id), lang))
+
+    def delete_lang(self, user_id):
+        with self._lock:
+            self.conn.execute("DELETE FROM user_langs WHERE user_id = ?", (str(user_id),))
+
+    def is_delivered(self, key):
+        with self._lock:
+            return self.conn.execute("SELECT 1 FROM delivered WHERE key = ?", (str(key),)).fetchone() is not None
+
+    def mark_delivered(self, key):
+        with self._lock:
+            self.conn.execute("INSERT OR REPLACE INTO delivered (key, ts) VALUES (?, ?)", (str(key), time.time()))
+
+    def outbox_counts(self):
+        with self._lock:
+            rows = self.conn.execute("SELECT status, COUNT(*) FROM outbox GROUP BY status").fetchall()
+        return dict(rows)
+
+    def compact(self, max_age=None):
+        with self._lock:
+            self._compact_locked(max_age)
+
+    def _compact_locked(self, max_age=None):
+        # Har bir foydalanuvchi uchun faqat oxirgi yozuv qoladi; eskirganlari o'chiriladi
+        self.conn.execute("BEGIN")
+        self.conn.execute(
+            "DELETE FROM state_journal WHERE seq NOT IN (SELECT MAX(seq) FROM state_journal GROUP BY user_id)"
+        )
+        if max_age:
+            # Yaqinda tugagan (None) holatlar qoladi - "state yo'q" javobi ham Firestore'siz topiladi
+            self.conn.execute("DELETE FROM state_journal WHERE ts < ?", (time.time() - max_age,))
+        else:
+            self.conn.execute("DELETE FROM state_journal WHERE state IS NULL")
+        self.conn.execute("DELETE FROM delivered WHERE ts < ?", (time.time() - 30 * 86400,))
+        self.conn.execute("COMMIT")
+        self.conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        self._appends = 0
+
+    def close(self):
+        with self._lock:
+            self.conn.close()
+
+class Outbox:
+    """Foydalanuvchiga javob qaytarilgandan keyin bajariladigan ishlar navbati (at-least-once).
+
+    Ish avval LocalStore.outbox jadvaliga yoziladi (lokal durable), so'ng fon worker'lari
+    uni parallel bajaradi. Handler False qaytarsa yoki xato bersa, ish eksponensial
+    backoff bilan qayta uriniladi; max_attempts'dan keyin on_dead(payload) chaqiriladi
+    (True - ish boshqa yo'l bilan bajarildi), aks holda "dead" holatida qoladi va
+    dead_retry_after soniyadan keyin urinishlar qaytadan boshlanadi (0 - hech qachon).
+    LocalStore berilmasa navbat faqat xotirada (SQLite :memory:) saqlanadi.
+    """
+    def __init__(self, store=None, workers=4, max_attempts=10, base_delay=1.0, max_delay=300, poll_interval=1.0,
+                 dead_retry_after=3600):
+        if store is None:
+            logger.warning("Outbox xotirada: restart bo'lsa bajarilmagan ishlar yo'qoladi (LOCAL_DB_PATH sozlang)")
+            store = LocalStore(":memory:")
+        self.store = store
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.poll_interval = poll_interval
+        self.dead_retry_after = dead_retry_after
+        self._revive_at = 0.0
+        self._handlers = {}
+        self._dead_handlers = {}
+        self._running = set()
+        self._cond = threading.Condition()
+        self._closed = False
+        self._drain_until = None
+        self._workers = []
+        for i in range(workers):
+            t = threading.Thread(target=self._worker, name=f"outbox-{i}", daemon=True)
+            t.start()
+            self._workers.append(t)
+        METRICS.gauge("bot_outbox_pending", "Outbox jobs waiting to run", lambda: self.stats().get("pending", 0))
+        METRICS.gauge("bot_outbox_dead", "Outbox jobs that exhausted retries", lambda: self.stats().get("dead", 0))
+
+    def register(self, kind, handler, on_dead=None):
+        """handler(payload) -> True (bajarildi) yoki False (keyinroq qayta urinish).
+
+        on_dead(payload) urinishlar tugaganda chaqiriladi; True qaytarsa ish o'chiriladi.
+        """
+        self._handlers[kind] = handler
+        if on_dead is not None:
+            self._dead_handlers[kind] = on_dead
+
+    def enqueue(self, *jobs):
+        """(kind, key, payload) ishlarini atomik yozish va worker'larni uyg'otish; qo'shilganlar sonini qaytaradi"""
+        added = self.store.outbox_add(jobs)
+        with self._cond:
+            self._cond.notify_all()
+        return added
+
+    def _claim(self):
+        with self._cond:
+            while True:
+                if self._closed and (self._drain_until is None or time.monotonic() > self._drain_until):
+                    return None
+                if self.dead_retry_after and time.monotonic() >= self._revive_at:
+                    self._revive_at = time.monotonic() + min(60, self.dead_retry_after)
+                    self._revive_dead()
+                for job in self.store.outbox_due():
+                    if job[0] not in self._running and job[1] in self._handlers:
+                        self._running.add(job[0])
+                        return job
+                if self._closed and not self._running:
+                    # Drain: vaqti kelgan ish qolmadi
+                    return None
+                next_at = self.store.outbox_next_at()
+                wait = self.poll_interval if next_at is None else min(max(next_at - time.time(), 0.01), self.poll_interval)
+                self._cond.wait(wait)
+
+    def _worker(self):
+        while True:
+            job = self._claim()
+            if job is None:
+                return
+            job_id, kind, key, payload, attempts = job
+            error = None
+            with TRACER.trace(f"outbox.{kind}", key=key, attempt=attempts + 1):
+                try:
+                    ok = self._handlers[kind](payload)
+                except Exception as e:
+                    ok, error = False, str(e)
+                    logger.exception(f"Outbox ishi xatosi ({kind} {key}): {e}")
+            try:
+                if ok:
+                    OUTBOX_JOBS.inc(kind=kind, outcome="ok")
+                    self.store.outbox_done(job_id)
+                else:
+                    attempts += 1
+                    dead = attempts >= self.max_attempts
+                    OUTBOX_JOBS.inc(kind=kind, outcome="dead" if dead else "retry")
+                    delay = min(self.max_delay, self.base_delay * 2 ** (attempts - 1))
+                    # Jitter: bir vaqtda qulagan ishlar bir vaqtda qaytmasin
+                    delay *= 0.5 + random.random() / 2
+                    if dead:
+                        # "dead" ish dead_retry_after'dan keyin _revive_dead orqali qaytadi
+                        delay = self.dead_retry_after
+                    self.store.outbox_retry(job_id, attempts, time.time() + delay, error, dead=dead)
+                    if dead:
+                        logger.error(f"Outbox ishi {attempts} urinishdan keyin bajarilmadi ({kind} {key})")
+                        if self._settle_dead(kind, key, payload):
+                            self.store.outbox_done(job_id)
+                    else:
+                        logger.warning(f"Outbox ishi bajarilmadi ({kind} {key}), {delay:.1f}s dan keyin qayta uriniladi")
+            finally:
+                with self._cond:
+                    self._running.discard(job_id)
+                    self._cond.notify_all()
+
+    def _revive_dead(self):
+        try:
+            revived = self.store.outbox_revive()
+        except Exception as e:
+            logger.error(f"Outbox dead ishlari qaytarilmadi: {e}")
+            return
+        for kind, count in revived.items():
+            OUTBOX_REVIVED.inc(count, kind=kind)
+            logger.warning(f"Outbox: {count} ta dead {kind} ishi qayta navbatga qo'yildi")
+
+    def _settle_dead(self, kind, key, payload):
+        on_dead = self._dead_handlers.get(kind)
+        if on_dead is None:
+            return False
+        try:
+            return bool(on_dead(payload))
+        except Exception as e:
+            logger.exception(f"Outbox on_dead xatosi ({kind} {key}): {e}")
+            return False
+
+    def stats(self):
+        counts = self.store.outbox_counts()
+        with self._cond:
+            counts["running"] = len(self._running)
+        return counts
+
+    def close(self, timeout=10):
+        """Vaqti kelgan ishlarni timeout ichida tugatib, worker'larni to'xtatish.
+
+        Qolgan ishlar lokal bazada saqlanadi va keyingi ishga tushishda bajariladi.
+        """
+        with self._cond:
+            self._closed = True
+            self._drain_until = time.monotonic() + timeout
+            self._cond.notify_all()
+        for t in self._workers:
+            t.join(timeout=timeout + 1)
+
+
+class UpdateCapture:
+    """Kelgan update'larni gzip JSONL fayllarga yozish (tools/replay.py uchun).
+
+    Har bir qator: {"t": qabul vaqti, "body": getUpdates javobi} yoki webhook uchun
+    {"t": ..., "update": update}. Xom javob qayta kodlanmasdan yoziladi. Fayl
+    max_bytes (siqilmagan) dan oshganda yangisi ochiladi, eng eskilari o'chiriladi.
+    Fayllarda foydalanuvchi ma'lumotlari (telefon, ism) bor - faqat diagnostika uchun.
+    """
+    PREFIX = "updates-"
+    SUFFIX = ".jsonl.gz"
+
+    def __init__(self, directory, max_bytes=64 * 1024 * 1024, max_files=20, flush_interval=5.0):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.max_files = max_files
+        self.flush_interval = flush_interval
+        self._lock = threading.Lock()
+        self._file = None
+        self._written = 0
+        self._flushed_at = 0.0
+        os.makedirs(directory, exist_ok=True)
+
+    def write_batch(self, raw_body):
+        """getUpdates javobini (bytes) yozish"""
+        self._write(b'{"t":%.3f,"body":%s}\n' % (time.time(), raw_body.replace(b"\n", b" ")))
+
+    def write_update(self, update):
+        self._write(b'{"t":%.3f,"update":%s}\n' % (time.time(), _json_encode(update)))
+
+    def _write(self, line):
+        with self._lock:
+            try:
+                if self._file is None or self._written >= self.max_bytes:
+                    self._rotate()
+                self._file.write(line)
+                self._written += len(line)
+                now = time.monotonic()
+                if now - self._flushed_at >= self.flush_interval:
+                    # Yozilayotgan fayl ham replay'da o'qilishi uchun
+                    self._file.flush()
+                    self._flushed_at = now
+            except OSError as e:
+                logger.error(f"Update capture yozishda xatolik: {e}")
+
+    def _rotate(self):
+        if self._file is not None:
+            self._file.close()
+        name = f"{self.PREFIX}{datetime.now().strftime('%Y%m%d-%H%M%S-%f')}{self.SUFFIX}"
+        self._file = gzip.open(os.path.join(self.directory, name), "wb", compresslevel=6)
+        self._written = 0
+        files = self.files(self.directory)
+        for old in files[:max(0, len(files) - self.max_files)]:
+            try:
+                os.remove(old)
+            except OSError:
+                pass
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+    @classmethod
+    def files(cls, directory):
+        """Katalogdagi capture fayllari (eskisidan yangisiga)"""
+        return sorted(
+            os.path.join(directory, name) for name in os.listdir(directory)
+            if name.startswith(cls.PREFIX) and name.endswith(cls.SUFFIX)
+        )
+
+    @staticmethod
+    def read(path):
+        """(qabul vaqti, [update, ...]) juftliklari; yozilayotgan faylning uzilgan oxiri tashlab ketiladi"""
+        with gzip.open(path, "rb") as f:
+            try:
+                for line in f:
+                    try:
+                        entry = _json_decode(line)
+                    except ValueError:
+                        break
+                    if "update" in entry:
+                        yield entry["t"], [entry["update"]]
+                    else:
+                        yield entry["t"], (entry.get("body") or {}).get("result") or []
+            except EOFError:
+                return
+
+
+def chat_partition(update, partitions):
+    """Update qaysi worker jarayoniga tegishli (0..partitions-1): bitta chat doim bitta jarayonda"""
+    key = ChatDispatcher.chat_key(update)
+    if key is None:
+        key = update.get("update_id") or 0
+    if isinstance(key, int):
+        return key % partitions
+    return zlib.crc32(str(key).encode()) % partitions
+
+
+class StateBackend:
+    """Jarayonlar orasida umumiy user state/til ombori (STATE_BACKEND).
+
+    Qiymatlar JSON ko'rinishida saqlanadi; None ham qiymat (masalan, state yo'q).
+    set() yozadi va boshqa jarayonlarga invalidatsiya yuboradi: ular subscribe()
+    callback'i (origin, namespace, key) orqali lokal cache'dan kalitni o'chiradi.
+    """
+    def get(self, namespace, key):
+        """Qiymat yoki _MISSING"""
+        raise NotImplementedError
+
+    def set(self, namespace, key, value, ttl, origin):
+        raise NotImplementedError
+
+    def add(self, namespace, key, value, ttl):
+        """Kalit yo'q bo'lsagina yozish (invalidatsiyasiz) - o'qilgan qiymatni ulashish uchun"""
+        raise NotImplementedError
+
+    def subscribe(self, callback):
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+
+class MemoryStateBackend(StateBackend):
+    """Bitta jarayon ichidagi implementatsiya (test va bitta jarayonli rejim uchun)"""
+
+    def __init__(self):
+        self._data = {}     # (namespace, key) -> (json, expires_at)
+        self._lock = threading.Lock()
+        self._subscribers = []
+
+    def get(self, namespace, key):
+        with self._lock:
+            entry = self._data.get((namespace, key))
+            if entry is None:
+                return _MISSING
+            if entry[1] <= time.monotonic():
+                del self._data[(namespace, key)]
+                return _MISSING
+        return _json_decode(entry[0])
+
+    def set(self, namespace, key, value, ttl, origin):
+        with self._lock:
+            self._data[(namespace, key)] = (_json_encode(value), time.monotonic() + ttl)
+            subscribers = list(self._subscribers)
+        for callback in subscribers:
+            callback(origin, namespace, key)
+
+    def add(self, namespace, key, value, ttl):
+        with self._lock:
+            entry = self._data.get((namespace, key))
+            if entry is None or entry[1] <= time.monotonic():
+                self._data[(namespace, key)] = (_json_encode(value), time.monotonic() + ttl)
+
+    def subscribe(self, callback):
+        with self._lock:
+            self._subscribers.append(callback)
+
+
+class RespError(Exception):
+    pass
+
+
+class _RespConnection:
+    """Redis protokoli (RESP2) ustidagi oddiy sinxron ulanish"""
+
+    def __init__(self, host, port, timeout):
+        self.sock = socket.create_connection((host, port), timeout=timeout)
+        self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.reader = self.sock.makefile("rb")
+
+    @staticmethod
+    def encode(args):
+        out = [b"*%d\r\n" % len(args)]
+        for arg in args:
+            if not isinstance(arg, bytes):
+                arg = str(arg).encode()
+            out.append(b"$%d\r\n%s\r\n" % (len(arg), arg))
+        return b"".join(out)
+
+    def send(self, *commands):
+        self.sock.sendall(b"".join(self.encode(args) for args in commands))
+
+    def read(self):
+        line = self.reader.readline()
+        if not line:
+            raise ConnectionError("Redis ulanishi uzildi")
+        kind, payload = line[:1], line[1:-2]
+        if kind == b"+":
+            return payload.decode()
+        if kind == b"-":
+            raise RespError(payload.decode())
+        if kind == b":":
+            return int(payload)
+        if kind == b"$":
+            length = int(payload)
+            if length < 0:
+                return None
+            data = self.reader.read(length + 2)
+            return data[:-2]
+        if kind == b"*":
+            length = int(payload)
+            return None if length < 0 else [self.read() for _ in range(length)]
+        raise RespError(f"Noma'lum RESP javobi: {line!r}")
+
+    def execute(self, *commands):
+        """Buyruqlarni bitta paketda yuborib, javoblarini qaytarish (pipeline)"""
+        self.send(*commands)
+        return [self.read() for _ in commands]
+
+    def close(self):
+        try:
+            self.sock.close()
+        except OSError:
+            pass
+
+
+class RedisStateBackend(StateBackend):
+    """Redis (yoki tools/resp_server.py) asosidagi umumiy ombor; invalidatsiya PUBLISH/SUBSCRIBE orqali"""
+
+    def __init__(self, url="redis://127.0.0.1:6379/0", prefix="tgbot", timeout=5, pool_size=16):
+        parsed = urllib.parse.urlparse(url)
+        self.host = parsed.hostname or "127.0.0.1"
+        self.port = parsed.port or 6379
+        self.password = parsed.password
+        self.database = int(parsed.path.strip("/") or 0)
+        self.prefix = prefix
+        self.timeout = timeout
+        self.pool_size = pool_size
+        self.channel = f"{prefix}:invalidate"
+        self._pool = []
+        self._pool_lock = threading.Lock()
+        self._closed = False
+        self._subscriber = None
+
+    def _connect(self, timeout=None):
+        conn = _RespConnection(self.host, self.port, timeout or self.timeout)
+        try:
+            if self.password:
+                conn.execute(("AUTH", self.password))
+            if self.database:
+                conn.execute(("SELECT", self.database))
+        except Exception:
+            conn.close()
+            raise
+        return conn
+
+    def _execute(self, *commands):
+        with self._pool_lock:
+            conn = self._pool.pop() if self._pool else None
+        if conn is None:
+            conn = self._connect()
+        try:
+            replies = conn.execute(*commands)
+        except Exception:
+            # Javob o'rtasida uzilgan ulanish qayta ishlatilmaydi
+            conn.close()
+            raise
+        with self._pool_lock:
+            if len(self._pool) < self.pool_size and not self._closed:
+                self._pool.append(conn)
+                conn = None
+        if conn is not None:
+            conn.close()
+        return replies
+
+    def _key(self, namespace, key):
+        return f"{self.prefix}:{namespace}:{key}"
+
+    def get(self, namespace, key):
+        value = self._execute(("GET", self._key(namespace, key)))[0]
+        return _MISSING if value is None else _json_decode(value)
+
+    def set(self, namespace, key, value, ttl, origin):
+        self._execute(
+            ("SET", self._key(namespace, key), _json_encode(value), "EX", max(1, int(ttl))),
+            ("PUBLISH", self.channel, f"{origin}|{namespace}|{key}"),
+        )
+
+    def add(self, namespace, key, value, ttl):
+        self._execute(("SET", self._key(namespace, key), _json_encode(value), "EX", max(1, int(ttl)), "NX"))
+
+    def subscribe(self, callback):
+        self._subscriber = threading.Thread(target=self._listen, args=(callback,), name="state-invalidation", daemon=True)
+        self._subscriber.start()
+
+    def _listen(self, callback):
+        retry = 0
+        while not self._closed:
+            conn = None
+            try:
+                # Obuna ulanishi javobsiz uzoq turadi - timeout'siz
+                conn = self._connect()
+                conn.sock.settimeout(None)
+                conn.send(("SUBSCRIBE", self.channel))
+                retry = 0
+                while not self._closed:
+                    reply = conn.read()
+                    if isinstance(reply, list) and reply and reply[0] == b"message":
+                        origin, namespace, key = reply[2].decode().split("|", 2)
+                        callback(origin, namespace, key)
+            except Exception as e:
+                if self._closed:
+                    break
+                retry += 1
+                wait = min(30, 2 ** retry) * random.uniform(0.5, 1.0)
+                logger.warning(f"State invalidatsiya obunasi uzildi ({e}), {wait:.1f}s dan keyin qayta ulanadi")
+                time.sleep(wait)
+            finally:
+                if conn is not None:
+                    conn.close()
+
+    def close(self):
+        self._closed = True
+        with self._pool_lock:
+            pool, self._pool = self._pool, []
+        for conn in pool:
+            conn.close()
+
+
+class FirestoreStateBackend(StateBackend):
+    """Firestore asosidagi umumiy ombor: shared_state kolleksiyasi.
+
+    Redis'siz ham ishlaydi, lekin eng sekini: har set() - ikkita yozuv, invalidatsiyalar
+    state_invalidations kolleksiyasini poll_interval oralig'ida so'rash orqali keladi.
+    """
+    def __init__(self, firestore_db, poll_interval=2.0, keep_seconds=600):
+        self.owner = firestore_db
+        self.poll_interval = poll_interval
+        self.keep_seconds = keep_seconds
+        self._closed = threading.Event()
+
+    def _doc(self, namespace, key):
+        return self.owner.db.collection("shared_state").document(f"{namespace}:{key}")
+
+    def get(self, namespace, key):
+        if not self.owner.db:
+            return _MISSING
+        doc = self._doc(namespace, key).get()
+        if not doc.exists:
+            return _MISSING
+        data = doc.to_dict() or {}
+        if (data.get("expires_at") or 0) <= time.time():
+            return _MISSING
+        return _json_decode(data["value"])
+
+    def set(self, namespace, key, value, ttl, origin):
+        if not self.owner.db:
+            return
+        batch = self.owner.db.batch()
+        batch.set(self._doc(namespace, key), {"value": _json_encode(value).decode(), "expires_at": time.time() + ttl})
+        batch.set(self.owner.db.collection("state_invalidations").document(), {
+            "origin": origin, "namespace": namespace, "key": key, "ts": time.time(),
+        })
+        batch.commit()
+
+    def add(self, namespace, key, value, ttl):
+        if not self.owner.db:
+            return
+        ref = self._doc(namespace, key)
+
+        @self.owner.fs.transactional
+        def _add(transaction):
+            snap = ref.get(transaction=transaction)
+            # Muddati o'tmagan qiymat bor - boshqa jarayon yozgani ustun; eskirgani ustidan yoziladi
+            if snap.exists and ((snap.to_dict() or {}).get("expires_at") or 0) > time.time():
+                return
+            transaction.set(ref, {"value": _json_encode(value).decode(), "expires_at": time.time() + ttl})
+
+        _add(self.owner.db.transaction())
+
+    def subscribe(self, callback):
+        threading.Thread(target=self._poll, args=(callback,), name="state-invalidation", daemon=True).start()
+
+    def _poll(self, callback):
+        last_ts = time.time()
+        last_cleanup = 0.0
+        while not self._closed.wait(self.poll_interval):
+            try:
+                if not self.owner.db:
+                    continue
+                invalidations = self.owner.db.collection("state_invalidations")
+                docs = invalidations.where("ts", ">", last_ts).order_by("ts").limit(500).stream()
+                for doc in docs:
+                    item = doc.to_dict()
+                    last_ts = max(last_ts, item.get("ts") or 0)
+                    callback(item.get("origin"), item.get("namespace"), item.get("key"))
+                if time.time() - last_cleanup > self.keep_seconds:
+                    last_cleanup = time.time()
+                    old = list(invalidations.where("ts", "<", time.time() - self.keep_seconds).limit(500).stream())
+                    if old:
+                        batch = self.owner.db.batch()
+                        for doc in old:
+                            batch.delete(doc.reference)
+                        batch.commit()
+            except Exception as e:
+                logger.debug(f"state_invalidations o'qish xatosi: {e}")
+
+    def close(self):
+        self._closed.set()
+
+
+def make_state_backend(spec, firestore_db=None):
+    """STATE_BACKEND qiymatidan ombor: "" - yo'q, "memory", "redis://...", "firestore" """
+    if not spec:
+        return None
+    if spec == "memory":
+        return MemoryStateBackend()
+    if spec == "firestore":
+        return FirestoreStateBackend(firestore_db)
+    if spec.startswith("redis://"):
+        return RedisStateBackend(spec)
+    raise ValueError(f"STATE_BACKEND noto'g'ri: {spec}")
+
+
+class FirestoreDB:
+    def __init__(self, local_store=None, background_init=False, client=None, fs_module=None, migrate=True):
+        # client/fs_module berilsa Firebase'ga ulanilmaydi (masalan, tools/fake_firestore.py)
+        self._client = client
+        # Firestore'ga yozadigan migratsiyalar (backfill) faqat shu bayroq yoqilgan jarayonda
+        self._migrate = migrate
+        # firebase_admin.firestore moduli (initialize() ichida lazy import qilinadi)
+        self.fs = fs_module
+        self.local = local_store
         # Use LRU cache with 1-hour TTL and max 1000 users
-        self._user_states = LRUCacheWithTTL(max_size=1000, ttl_seconds=3600)
-        self._user_langs = LRUCacheWithTTL(max_size=1000, ttl_seconds=7200)  # 2 hours for langs
-        self._write_queue = []
+        self._user_states = ShardedTTLCache(max_size=1000, ttl_seconds=3600)
+        self._user_langs = ShardedTTLCache(max_size=1000, ttl_seconds=7200)  # 2 hours for langs
+        # Lavozim bo'yicha substring qidiruv uchun ixtiyoriy trigram indeksi
+        self._ngram_index = PositionNgramIndex() if Config.SEARCH_NGRAM_INDEX else None
+        # Pagination cursor'lari: ariza id -> DocumentSnapshot (qisqa muddatli)
+        self._app_cursors = ShardedTTLCache(max_size=500, ttl_seconds=900)
+        METRICS.track_cache("user_states", self._user_states)
+        METRICS.track_cache("user_langs", self._user_langs)
+        METRICS.track_cache("app_cursors", self._app_cursors)
+        # Jarayonlar orasida umumiy state ombori (use_shared_state orqali ulanadi)
+        self.shared = None
+        self._origin = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self._shared_caches = {"state": self._user_states, "lang": self._user_langs}
+        # Write-behind navbati: (collection, doc_id) -> data (None - o'chirish).
+        # Bitta hujjatga ketma-ket yozuvlar birlashadi, faqat oxirgisi yuboriladi.
+        self._write_queue = {}
         self._queue_lock = threading.Lock()
-        self.initialize()
+        # Flusher thread va close() bir vaqtda flush qilmasin (eski snapshot yangisini bosmasin)
+        self._flush_lock = threading.Lock()
+        self._flush_event = threading.Event()
+        self._flush_interval = Config.DB_FLUSH_INTERVAL_MS / 1000
+        self._flush_max_items = Config.DB_FLUSH_MAX_ITEMS
+        self._closed = False
+        self._flusher = None
+        self._ready = threading.Event()
+        self._replay_journal()
+        if background_init:
+            # Firebase ulanishi polling bilan parallel; self.db birinchi murojaatda tayyor bo'lishini kutadi
+            threading.Thread(target=self._start, name="firestore-init", daemon=True).start()
+        else:
+            self._start()
+
+    @property
+    def db(self):
+        if not self._ready.is_set():
+            self._ready.wait()
+        return self._client
+
+    @db.setter
+    def db(self, client):
+        self._client = client
+
+    def _start(self):
+        try:
+            if self._client is None:
+                self.initialize()
+        finally:
+            self._ready.set()
+        if self._client:
+            threading.Thread(target=self._run_migrations, name="db-migrations", daemon=True).start()
+            self._flusher = threading.Thread(target=self._flush_loop, name="firestore-flusher", daemon=True)
+            self._flusher.start()
 
     def initialize(self):
         try:
+            creds_json = Config.FIREBASE_CREDS_JSON
+            if not creds_json and os.path.exists(Config.FIREBASE_CREDS_FILE):
+                with open(Config.FIREBASE_CREDS_FILE, "r") as f:
+                    creds_json = f.read()
+
+            if not creds_json:
+                logger.warning("Firebase credentials topilmadi, bot cheklangan rejimda ishlaydi")
+                return
+
+            # firebase_admin faqat kerak bo'lganda import qilinadi (ishga tushish tezroq)
+            import firebase_admin
+            from firebase_admin import credentials, firestore
+
             if not firebase_admin._apps:
-                creds_json = Config.FIREBASE_CREDS_JSON
-                if not creds_json and os.path.exists(Config.FIREBASE_CREDS_FILE):
-                    with open(Config.FIREBASE_CREDS_FILE, "r") as f:
-                        creds_json = f.read()
-                
-                if creds_json:
-                    creds_dict = json.loads(creds_json)
-                    cred = credentials.Certificate(creds_dict)
-                    firebase_admin.initialize_app(cred, {
-                        'projectId': 'alxorazmiyishbot',
-                        'storageBucket': 'alxorazmiyishbot.firebasestorage.app'
-                    })
-                    self.db = firestore.client()
-                    logger.info("Firebase muvaffaqiyatli bog'landi")
-                else:
-                    logger.warning("Firebase credentials topilmadi, bot cheklangan rejimda ishlaydi")
+                creds_dict = json.loads(creds_json)
+                cred = credentials.Certificate(creds_dict)
+                firebase_admin.initialize_app(cred, {
+                    'projectId': 'alxorazmiyishbot',
+                    'storageBucket': 'alxorazmiyishbot.firebasestorage.app'
+                })
+            self.fs = firestore
+            self.db = firestore.client()
+            logger.info("Firebase muvaffaqiyatli bog'landi")
         except Exception as e:
             logger.error(f"Firebase initialization error: {e}")
 
-    def save_application(self, user_id, data, file_id, f_type):
+    def use_shared_state(self, backend):
+        """Umumiy state omborini ulash; boshqa jarayonlar yozgan kalitlar lokal cache'dan o'chiriladi"""
+        self.shared = backend
+        backend.subscribe(self._on_invalidate)
+
+    def _on_invalidate(self, origin, namespace, key):
+        if origin == self._origin:
+            return
+        cache = self._shared_caches.get(namespace)
+        if cache is not None:
+            cache.delete(key)
+        if namespace == "lang" and self.local:
+            # Lokal til jadvali TTL'siz: umumiy kalit muddati o'tgach eski til qaytmasligi uchun
+            try:
+                self.local.delete_lang(key)
+            except Exception as e:
+                logger.debug(f"Lokal til o'chirish xatosi: {e}")
+
+    def _shared_get(self, namespace, key):
+        if self.shared is None:
+            return _MISSING
+        try:
+            return self.shared.get(namespace, key)
+        except Exception as e:
+            logger.debug(f"Umumiy state o'qish xatosi: {e}")
+            return _MISSING
+
+    def _shared_set(self, namespace, key, value):
+        if self.shared is None:
+            return
+        try:
+            self.shared.set(namespace, key, value, self._shared_caches[namespace].ttl_seconds, self._origin)
+        except Exception as e:
+            logger.warning(f"Umumiy state yozish xatosi ({namespace}:{key}): {e}")
+
+    def _shared_add(self, namespace, key, value):
+        if self.shared is None:
+            return
+        try:
+            self.shared.add(namespace, key, value, self._shared_caches[namespace].ttl_seconds)
+        except Exception as e:
+            logger.debug(f"Umumiy state yozish xatosi ({namespace}:{key}): {e}")
+
+    def _replay_journal(self):
+        """Lokal journal'dan oxirgi state'larni cache'ga qayta yuklash (restart'dan keyin)"""
+        if not self.local:
+            return
+        try:
+            self.local.compact(max_age=self._user_states.ttl_seconds)
+            states = self.local.replay_states(max_age=self._user_states.ttl_seconds)
+            for user_id, state in states:
+                self._user_states.set(user_id, state)
+            if states:
+                logger.info(f"State journal'dan {len(states)} ta holat tiklandi")
+        except Exception as e:
+            logger.error(f"State journal replay xatosi: {e}")
+
+    def _enqueue_write(self, collection, doc_id, data):
+        """Yozuvni write-behind navbatiga qo'yish (so'rov yo'lida tarmoq chaqiruvi yo'q)"""
+        with self._queue_lock:
+            self._write_queue[(collection, doc_id)] = data
+            size = len(self._write_queue)
+        if size >= self._flush_max_items:
+            self._flush_event.set()
+
+    def _pending_write(self, collection, doc_id):
+        """Hali Firestore'ga yuborilmagan yozuv: (True, data) yoki (False, None)"""
+        with self._queue_lock:
+            key = (collection, doc_id)
+            if key in self._write_queue:
+                return True, self._write_queue[key]
+        return False, None
+
+    def _flush_loop(self):
+        while not self._closed:
+            self._flush_event.wait(self._flush_interval)
+            self._flush_event.clear()
+            self.flush()
+
+    def flush(self):
+        """Navbatdagi yozuvlarni Firestore batched write orqali yuborish"""
+        if not self.db:
+            return True
+        with self._flush_lock:
+            return self._flush_locked()
+
+    def _flush_locked(self):
+        with self._queue_lock:
+            if not self._write_queue:
+                return True
+            pending, self._write_queue = self._write_queue, {}
+
+        items = list(pending.items())
+        ok = True
+        # Firestore batch'ida 500 tadan ko'p operatsiya bo'lishi mumkin emas
+        for i in range(0, len(items), 500):
+            chunk = items[i:i + 500]
+            try:
+                batch = self.db.batch()
+                for (collection, doc_id), data in chunk:
+                    ref = self.db.collection(collection).document(doc_id)
+                    if data is None:
+                        batch.delete(ref)
+                    else:
+                        batch.set(ref, data)
+                with DB_OP_SECONDS.time(op="write_behind_commit"):
+                    batch.commit()
+            except Exception as e:
+                ok = False
+                logger.error(f"Firestore batch write xatosi ({len(chunk)} ta yozuv): {e}")
+                # Yangiroq yozuv kelmagan bo'lsa, keyingi flush'da qayta urinamiz
+                with self._queue_lock:
+                    for key, data in chunk:
+                        self._write_queue.setdefault(key, data)
+        return ok
+
+    def close(self, timeout=10):
+        """Flusher'ni to'xtatib, navbatdagi barcha yozuvlarni yuborish"""
+        self._closed = True
+        self._flush_event.set()
+        if self._flusher:
+            self._flusher.join(timeout=timeout)
+        for _ in range(3):
+            if self.flush():
+                break
+            time.sleep(1)
+        with self._queue_lock:
+            lost = len(self._write_queue)
+        if lost:
+            logger.error(f"{lost} ta yozuv Firestore'ga yuborilmadi")
+
+    @_timed_db_op
+    def save_application(self, user_id, data, file_id, f_type, doc_id=None, submitted_at=None, max_retries=3):
+        """Arizani saqlash. doc_id oldindan berilsa, qayta urinish dublikat yaratmaydi."""
         if not self.db: return False
 
         # Retry mexanizmi (3 marta urinish)
-        max_retries = 3
         for attempt in range(max_retries):
             try:
-                doc_ref = self.db.collection("applications").document()
-                doc_ref.set({
+                doc_ref = self.db.collection("applications").document(doc_id)
+                position = data.get("position")
+                day = _stats_day(datetime.utcfromtimestamp(submitted_at) if submitted_at else None)
+                # Ariza va kunlik statistika hisoblagichi bitta atomik batch'da yoziladi
+                batch = self.db.batch()
+                application = {
                     "user_id": user_id,
                     "name": data.get("name"),
                     "phone": data.get("phone"),
-                    "position": data.get("position"),
+                    "position": position,
+                    "position_tokens": _search_tokens(position),
                     "experience": data.get("exp"),
                     "cv_file_id": file_id,
                     "cv_type": f_type,
-                    "timestamp": firestore.SERVER_TIMESTAMP
-                })
+                    "stats_day": day,
+                    "timestamp": self.fs.SERVER_TIMESTAMP
+                }
+                if doc_id:
+                    # Hujjat allaqachon bo'lsa batch butunlay rad etiladi (statistika ikki marta oshmaydi)
+                    batch.create(doc_ref, application)
+                    # HR xabari ariza bilan bir atomik yozuvda: ariza saqlangan bo'lsa, xabar ham navbatda
+                    batch.set(self.db.collection("hr_outbox").document(doc_id), {
+                        "app_id": doc_id,
+                        "user_id": user_id,
+                        "data": data,
+                        "file_id": file_id,
+                        "f_type": f_type,
+                        "status": "pending",
+                        "created_at": self.fs.SERVER_TIMESTAMP,
+                    })
+                else:
+                    batch.set(doc_ref, application)
+                batch.set(self.db.collection("stats_daily").document(day), {
+                    "day": day,
+                    "total": self.fs.Increment(1),
+                    "positions": {_stats_key(position): self.fs.Increment(1)},
+                }, merge=True)
+                batch.commit()
+                if self._ngram_index:
+                    self._ngram_index.add(doc_ref.id, data.get("position"), time.time())
                 return True
             except Exception as e:
+                if doc_id and getattr(e, "code", None) == 409:
+                    # Oldingi urinish yozilgan, lekin javobi yo'qolgan
+                    logger.info(f"Ariza allaqachon saqlangan: {doc_id}")
+                    return True
                 logger.error(f"Firestore save error (urinish {attempt + 1}/{max_retries}): {e}")
                 if attempt < max_retries - 1:
                     time.sleep(1 * (attempt + 1))  # Exponential backoff: 1s, 2s, 3s
@@ -242,98 +2647,243 @@ class FirestoreDB:
                     return False
         return False
 
+    @_timed_db_op
+    def get_pending_hr_notifications(self, min_age=120, limit=50):
+        """hr_outbox'dagi hali yuborilmagan, min_age soniyadan eski xabarlar va lease'i tugagan yuborishlar"""
+        if not self.db: return []
+        try:
+            cutoff = datetime.utcnow() - timedelta(seconds=min_age)
+            collection = self.db.collection("hr_outbox")
+            pending = []
+            for doc in collection.where("status", "==", "pending").limit(limit).stream():
+                item = doc.to_dict()
+                created_at = item.get("created_at")
+                if created_at is not None and getattr(created_at, "tzinfo", None) is not None:
+                    created_at = created_at.replace(tzinfo=None) - created_at.utcoffset()
+                if created_at is None or created_at <= cutoff:
+                    pending.append(item)
+            # Yuborayotgan jarayon lease muddatida tugatmagan (qulagan yoki hali backoff'da)
+            now = time.time()
+            for doc in collection.where("status", "==", "sending").limit(limit).stream():
+                item = doc.to_dict()
+                if (item.get("lease_until") or 0) <= now:
+                    pending.append(item)
+            return pending
+        except Exception as e:
+            logger.error(f"Firestore hr_outbox o'qishda xatolik: {e}")
+            return []
+
+    @_timed_db_op
+    def claim_hr_notification(self, app_id, lease_seconds):
+        """hr_outbox/{app_id} ni shu jarayon yuborishi uchun tranzaksiyada band qilish.
+
+        "claimed" - yuborish mumkin, "sent" - allaqachon yuborilgan, "busy" - boshqa jarayonning
+        lease'i amalda, "missing" - ariza hali saqlanmagan, None - Firestore xatosi.
+        """
+        if not self.db: return None
+        ref = self.db.collection("hr_outbox").document(app_id)
+        try:
+            @self.fs.transactional
+            def _claim(transaction):
+                snap = ref.get(transaction=transaction)
+                if not snap.exists:
+                    return "missing"
+                item = snap.to_dict() or {}
+                if item.get("status") == "sent":
+                    return "sent"
+                now = time.time()
+                if item.get("status") == "sending" and item.get("owner") != self._origin \
+                        and (item.get("lease_until") or 0) > now:
+                    return "busy"
+                transaction.update(ref, {"status": "sending", "owner": self._origin, "lease_until": now + lease_seconds})
+                return "claimed"
+
+            return _claim(self.db.transaction())
+        except Exception as e:
+            logger.error(f"hr_outbox band qilinmadi ({app_id}): {e}")
+            return None
+
+    @_timed_db_op
+    def mark_hr_notification_sent(self, app_id):
+        if not self.db: return False
+        try:
+            self.db.collection("hr_outbox").document(app_id).update({
+                "status": "sent",
+                "sent_at": self.fs.SERVER_TIMESTAMP,
+            })
+            return True
+        except Exception as e:
+            # Ariza hali saqlanmagan bo'lishi mumkin - keyingi sweep'da belgilanadi
+            logger.debug(f"hr_outbox belgilanmadi ({app_id}): {e}")
+            return False
+
+    @_timed_db_op
     def get_user_state(self, user_id):
         user_id_str = str(user_id)
 
-        # Try cache first
-        cached = self._user_states.get(user_id_str)
-        if cached is not None:
+        # Try cache first (None ham keshlangan javob: foydalanuvchida state yo'q)
+        cached = self._user_states.get(user_id_str, _MISSING)
+        if cached is not _MISSING:
             return cached
 
+        # Umumiy ombor (boshqa jarayon yozgan bo'lishi mumkin)
+        state = self._shared_get("state", user_id_str)
+        if state is not _MISSING:
+            self._user_states.set(user_id_str, state)
+            return state
+
+        # Lokal journal (cache'dan chiqib ketgan oraliq holatlar shu yerda)
+        if self.local:
+            try:
+                found, state = self.local.latest_state(user_id_str, max_age=self._user_states.ttl_seconds)
+                if found:
+                    self._user_states.set(user_id_str, state)
+                    self._shared_add("state", user_id_str, state)
+                    return state
+            except Exception as e:
+                logger.debug(f"State journal o'qish xatosi: {e}")
+
         # Fallback to Firestore
         if not self.db: return None
+        queued, state = self._pending_write("user_states", user_id_str)
+        if queued:
+            return state
         try:
             doc = self.db.collection("user_states").document(user_id_str).get()
             state = doc.to_dict() if doc.exists else None
             self._user_states.set(user_id_str, state)
+            self._shared_add("state", user_id_str, state)
             return state
         except Exception as e:
             logger.error(f"Error getting user state: {e}")
             return None
 
+    @_timed_db_op
     def set_user_state(self, user_id, state):
         user_id_str = str(user_id)
 
         # Update cache immediately
         self._user_states.set(user_id_str, state)
+        # Oraliq qadamlar ham umumiy omborga: chat boshqa jarayonga tushsa ham flow davom etadi
+        self._shared_set("state", user_id_str, state)
+
+        # Har bir o'tish lokal journal'ga yoziladi (crash'dan keyin tiklash uchun)
+        if self.local:
+            try:
+                self.local.record_state(user_id_str, state)
+            except Exception as e:
+                logger.debug(f"State journal yozish xatosi: {e}")
 
-        # Write to Firestore asynchronously (best effort)
-        # Only critical states need immediate persistence
+        # Firestore'ga yozish write-behind navbati orqali (batch bilan)
+        # Only critical states need persistence
         if not self.db: return
 
-        try:
-            if state is None:
-                self.db.collection("user_states").document(user_id_str).delete()
-            else:
-                # Only persist critical states immediately (final steps)
-                # Intermediate states are cached and can be lost on crash
-                if state.get("step") in ["cv", None] or state.get("mode") == "admin":
-                    self.db.collection("user_states").document(user_id_str).set(state)
-        except Exception as e:
-            # Don't log every error, just debug level
-            logger.debug(f"State write skipped: {e}")
+        if state is None:
+            self._enqueue_write("user_states", user_id_str, None)
+        # Only persist critical states (final steps)
+        # Intermediate states are cached and journaled locally
+        elif state.get("step") in ["cv", None] or state.get("mode") == "admin":
+            self._enqueue_write("user_states", user_id_str, state)
+
+    def cached_user_state(self, user_id):
+        """Faqat cache'dagi state (disk/tarmoqsiz); noma'lum bo'lsa _MISSING"""
+        return self._user_states.get(str(user_id), _MISSING)
 
+    def cached_user_lang(self, user_id):
+        """Faqat cache'dagi til (disk/tarmoqsiz); noma'lum bo'lsa _MISSING, til tanlanmagan bo'lsa None"""
+        return self._user_langs.get(str(user_id), _MISSING)
+
+    @_timed_db_op
     def get_user_lang(self, user_id):
         user_id_str = str(user_id)
 
-        # Try cache first
-        cached = self._user_langs.get(user_id_str)
-        if cached is not None:
-            return cached
+        # Try cache first (None ham keshlangan javob: foydalanuvchi til tanlamagan)
+        cached = self._user_langs.get(user_id_str, _MISSING)
+        if cached is not _MISSING:
+            return cached or "uz"
+
+        lang = self._shared_get("lang", user_id_str)
+        if lang is not _MISSING and lang:
+            self._user_langs.set(user_id_str, lang)
+            return lang
+
+        # Ikkinchi daraja: lokal diskdagi user_id -> til jadvali
+        if self.local:
+            try:
+                lang = self.local.get_lang(user_id_str)
+                if lang:
+                    self._user_langs.set(user_id_str, lang)
+                    self._shared_add("lang", user_id_str, lang)
+                    return lang
+            except Exception as e:
+                logger.debug(f"Lokal til o'qish xatosi: {e}")
 
         # Fallback to Firestore
         if not self.db: return "uz"
+        queued, data = self._pending_write("user_langs", user_id_str)
+        if queued and data:
+            return data.get("lang", "uz")
         try:
             doc = self.db.collection("user_langs").document(user_id_str).get()
-            lang = doc.to_dict().get("lang", "uz") if doc.exists else "uz"
+            lang = (doc.to_dict() or {}).get("lang") if doc.exists else None
+            # Til tanlamagan foydalanuvchi uchun None keshlanadi (negativ cache, TTL bilan)
             self._user_langs.set(user_id_str, lang)
-            return lang
+            if lang:
+                self._shared_add("lang", user_id_str, lang)
+                if self.local:
+                    self.local.set_lang(user_id_str, lang)
+            return lang or "uz"
         except Exception as e:
             logger.debug(f"Error getting user lang: {e}")
             return "uz"
 
+    @_timed_db_op
     def set_user_lang(self, user_id, lang):
         user_id_str = str(user_id)
 
         # Update cache immediately
         self._user_langs.set(user_id_str, lang)
+        self._shared_set("lang", user_id_str, lang)
+        if self.local:
+            try:
+                self.local.set_lang(user_id_str, lang)
+            except Exception as e:
+                logger.debug(f"Lokal til yozish xatosi: {e}")
 
-        # Persist to Firestore (language is important, always save)
+        # Persist to Firestore (language is important, always save) - write-behind navbati orqali
         if not self.db: return
-        try:
-            self.db.collection("user_langs").document(user_id_str).set({"lang": lang})
-        except Exception as e:
-            logger.debug(f"Lang write error: {e}")
+        self._enqueue_write("user_langs", user_id_str, {"lang": lang})
+
+    @_timed_db_op
+    def get_recent_applications(self, limit=10, start_after=None):
+        """Arizalarni sahifalab olish (cursor pagination).
 
-    def get_recent_applications(self, limit=10, offset=0):
+        start_after - oldingi sahifaning oxirgi arizasi id'si. Har bir sahifa faqat
+        `limit` ta hujjat o'qiydi (offset'dagi kabi oldingi sahifalar qayta o'qilmaydi).
+        """
         if not self.db:
             return []
         try:
-            # Firestore'da haqiqiy offset qimmat bo'lishi mumkin, 
-            # lekin bu hajmdagi bot uchun limit(offset+limit) qilib keyin slice qilish yetarli
-            query = self.db.collection("applications").order_by("timestamp", direction=firestore.Query.DESCENDING).limit(offset + limit)
-            docs = query.stream()
-            items = []
-            for i, doc in enumerate(docs):
-                if i < offset:
-                    continue
-                data = doc.to_dict() or {}
-                items.append({"id": doc.id, **data})
-            return items
+            collection = self.db.collection("applications")
+            query = collection.order_by("timestamp", direction=self.fs.Query.DESCENDING)
+            if start_after:
+                # Cursor snapshot'i avval cache'dan, bo'lmasa bitta o'qish bilan olinadi
+                snapshot = self._app_cursors.get(start_after)
+                if snapshot is None:
+                    snapshot = collection.document(str(start_after)).get()
+                    if not snapshot.exists:
+                        return []
+                # (timestamp, id) bo'yicha davom ettirish - client id bo'yicha tartibni o'zi qo'shadi
+                query = query.start_after(snapshot)
+            docs = list(query.limit(limit).stream())
+            if docs:
+                self._app_cursors.set(docs[-1].id, docs[-1])
+            return [{"id": doc.id, **(doc.to_dict() or {})} for doc in docs]
         except Exception as e:
             logger.error(f"Error getting recent applications: {e}")
             return []
 
+    @_timed_db_op
     def get_application(self, doc_id):
         if not self.db:
             return None
@@ -347,71 +2897,255 @@ class FirestoreDB:
             logger.error(f"Error getting application: {e}")
             return None
 
+    @_timed_db_op
     def delete_application(self, doc_id):
-        """Delete an application from Firestore"""
+        """Delete an application from Firestore (va kunlik statistikadan ayirish)"""
         if not self.db:
             return False
         try:
-            self.db.collection("applications").document(str(doc_id)).delete()
+            ref = self.db.collection("applications").document(str(doc_id))
+            stats = self.db.collection("stats_daily")
+
+            @self.fs.transactional
+            def _delete(transaction):
+                snap = ref.get(transaction=transaction)
+                data = (snap.to_dict() or {}) if snap.exists else {}
+                transaction.delete(ref)
+                # stats_day bo'lmasa ariza hisoblagichlarga qo'shilmagan (masalan, juda eski)
+                day = data.get("stats_day")
+                if day:
+                    transaction.set(stats.document(day), {
+                        "total": self.fs.Increment(-1),
+                        "positions": {_stats_key(data.get("position")): self.fs.Increment(-1)},
+                    }, merge=True)
+
+            _delete(self.db.transaction())
+            if self._ngram_index:
+                self._ngram_index.remove(str(doc_id))
             logger.info(f"Application deleted: {doc_id}")
             return True
         except Exception as e:
             logger.error(f"Error deleting application: {e}")
             return False
 
-    def search_applications_by_position(self, query_text, limit=50, scan_limit=300):
+    @_timed_db_op
+    def search_applications_by_position(self, query_text, limit=50):
+        """Lavozim bo'yicha qidiruv.
+
+        Trigram indeksi yoqilgan va tayyor bo'lsa - substring qidiruv xotirada; aks holda
+        `position_tokens` massivi bo'yicha array_contains so'rovi (kirill/lotin farqsiz).
+        Firestore'da (position_tokens array-contains, timestamp desc) composite index kerak.
+        """
         if not self.db:
             return []
-        q = (query_text or "").strip().lower()
-        if not q:
+        terms = _normalize_search_text(query_text).split()
+        if not terms:
             return []
         try:
-            query = self.db.collection("applications").order_by("timestamp", direction=firestore.Query.DESCENDING).limit(scan_limit)
-            docs = query.stream()
+            if self._ngram_index and self._ngram_index.ready:
+                ids = self._ngram_index.search(query_text, limit=limit)
+                refs = [self.db.collection("applications").document(doc_id) for doc_id in ids]
+                docs = {doc.id: doc for doc in self.db.get_all(refs) if doc.exists}
+                return [{"id": doc_id, **(docs[doc_id].to_dict() or {})} for doc_id in ids if doc_id in docs]
+
+            # Eng uzun (eng tanlovchan) so'z bo'yicha indeksdan olamiz, qolganlarini tekshiramiz
+            key = max(terms, key=len)
+            rest = [t for t in terms if t != key]
+            query = (
+                self.db.collection("applications")
+                .where("position_tokens", "array_contains", key)
+                .order_by("timestamp", direction=self.fs.Query.DESCENDING)
+            )
+            page_size = 100 if rest else limit
             items = []
-            for doc in docs:
-                data = doc.to_dict() or {}
-                position = str(data.get("position") or "")
-                if q in position.lower():
-                    items.append({"id": doc.id, **data})
-                if len(items) >= limit:
+            last = None
+            while True:
+                page = query.start_after(last) if last is not None else query
+                docs = list(page.limit(page_size).stream())
+                for doc in docs:
+                    data = doc.to_dict() or {}
+                    words = _normalize_search_text(data.get("position")).split()
+                    if all(any(w.startswith(t) for w in words) for t in rest):
+                        items.append({"id": doc.id, **data})
+                        if len(items) >= limit:
+                            break
+                if len(items) >= limit or len(docs) < page_size:
                     break
+                last = docs[-1]
             return items
         except Exception as e:
             logger.error(f"Error searching applications: {e}")
             return []
 
-    def get_position_stats(self, days=30, limit=1000):
+    def _claim_migration(self, name, lease_seconds=600):
+        """meta/migrations'da migratsiyani tranzaksiyada band qilish: "claimed", "done" yoki "busy".
+
+        Lease tugaguncha boshqa jarayon (replika, worker) shu migratsiyani boshlamaydi.
+        """
+        ref = self.db.collection("meta").document("migrations")
+
+        @self.fs.transactional
+        def _claim(transaction):
+            snap = ref.get(transaction=transaction)
+            item = (snap.to_dict() or {}) if snap.exists else {}
+            if item.get(name):
+                return "done"
+            lease = item.get(f"{name}_lease") or {}
+            now = time.time()
+            if lease.get("owner") not in (None, self._origin) and (lease.get("until") or 0) > now:
+                return "busy"
+            transaction.set(ref, {f"{name}_lease": {"owner": self._origin, "until": now + lease_seconds}}, merge=True)
+            return "claimed"
+
+        return _claim(self.db.transaction())
+
+    def build_search_index(self, backfill=True):
+        """Eski arizalarga position_tokens qo'shish va (yoqilgan bo'lsa) trigram indeksini qurish.
+
+        Backfill bir marta va bitta jarayonda bajariladi (meta/migrations'da band qilinadi);
+        trigram indeksi har jarayonning xotirasida quriladi.
+        """
+        if not self.db:
+            return
+        try:
+            migrations = self.db.collection("meta").document("migrations")
+            done = not backfill or self._claim_migration("search_tokens_v1") != "claimed"
+            if done and not self._ngram_index:
+                return
+
+            batch = self.db.batch()
+            pending = 0
+            updated = 0
+            for doc in self.db.collection("applications").stream():
+                data = doc.to_dict() or {}
+                if self._ngram_index:
+                    ts = data.get("timestamp")
+                    self._ngram_index.add(doc.id, data.get("position"), ts.timestamp() if hasattr(ts, "timestamp") else 0)
+                if not done and "position_tokens" not in data:
+                    batch.update(doc.reference, {"position_tokens": _search_tokens(data.get("position"))})
+                    pending += 1
+                    updated += 1
+                    if pending >= 400:
+                        batch.commit()
+                        batch = self.db.batch()
+                        pending = 0
+            if pending:
+                batch.commit()
+            if not done:
+                migrations.set({"search_tokens_v1": True}, merge=True)
+                logger.info(f"Qidiruv indeksi: {updated} ta eski arizaga position_tokens qo'shildi")
+            if self._ngram_index:
+                self._ngram_index.ready = True
+        except Exception as e:
+            logger.error(f"Qidiruv indeksini qurishda xatolik: {e}")
+
+    @_timed_db_op
+    def get_position_stats(self, days=30):
+        """Oxirgi `days` kunlik statistika: kunlik hisoblagich hujjatlaridan (ko'pi bilan `days` ta o'qish)"""
         if not self.db:
             return {}
-        start = datetime.utcnow() - timedelta(days=days)
         try:
-            query = (
-                self.db.collection("applications")
-                .where("timestamp", ">=", start)
-                .order_by("timestamp", direction=firestore.Query.DESCENDING)
-                .limit(limit)
-            )
-            docs = query.stream()
+            collection = self.db.collection("stats_daily")
+            today = datetime.utcnow() + timedelta(hours=5)
+            refs = [collection.document((today - timedelta(days=i)).strftime("%Y-%m-%d")) for i in range(days)]
             stats = {}
             total = 0
-            for doc in docs:
-                data = doc.to_dict() or {}
-                position = str(data.get("position") or "Noma'lum")
-                stats[position] = stats.get(position, 0) + 1
-                total += 1
+            for snap in self.db.get_all(refs):
+                if not snap.exists:
+                    continue
+                data = snap.to_dict() or {}
+                total += int(data.get("total") or 0)
+                for position, count in (data.get("positions") or {}).items():
+                    stats[position] = stats.get(position, 0) + int(count or 0)
+            stats = {position: count for position, count in stats.items() if count > 0}
             stats["_total"] = total
             return stats
         except Exception as e:
             logger.error(f"Error getting stats: {e}")
             return {}
 
+    def backfill_position_stats(self):
+        """Hisoblagichlar paydo bo'lishidan oldingi arizalarni kunlik statistikaga qo'shish (bir marta)"""
+        if not self.db:
+            return
+        try:
+            if self._claim_migration("position_stats_v1") != "claimed":
+                return
+
+            by_day = {}
+            for doc in self.db.collection("applications").stream():
+                data = doc.to_dict() or {}
+                if data.get("stats_day"):
+                    continue
+                ts = data.get("timestamp")
+                if not hasattr(ts, "strftime"):
+                    continue
+                by_day.setdefault(_stats_day(ts), []).append((doc.reference, _stats_key(data.get("position"))))
+
+            counted = 0
+            for day, items in by_day.items():
+                for i in range(0, len(items), 400):
+                    counted += self._count_stats_chunk(day, items[i:i + 400])
+            self.db.collection("meta").document("migrations").set({"position_stats_v1": True}, merge=True)
+            if counted:
+                logger.info(f"Statistika: {counted} ta eski ariza kunlik hisoblagichlarga qo'shildi")
+        except Exception as e:
+            logger.error(f"Statistikani to'ldirishda xatolik: {e}")
+
+    def _count_stats_chunk(self, day, chunk):
+        """Bitta kunning hisoblagichi va aynan shu hisobga kirgan arizalarning stats_day belgisi.
+
+        Tranzaksiyada arizalar qayta o'qiladi va faqat hali belgilanmaganlari sanaladi: yarim
+        yo'lda xato yoki lease tugab boshqa jarayon ham sanasa, ariza ikki marta qo'shilmaydi.
+        """
+        stats_ref = self.db.collection("stats_daily").document(day)
+
+        @self.fs.transactional
+        def _count(transaction):
+            snaps = self.db.get_all([ref for ref, _ in chunk], transaction=transaction)
+            unset = {snap.reference.path for snap in snaps if snap.exists and not (snap.to_dict() or {}).get("stats_day")}
+            fresh = [(ref, key) for ref, key in chunk if ref.path in unset]
+            if not fresh:
+                return 0
+            positions = {}
+            for _, key in fresh:
+                positions[key] = positions.get(key, 0) + 1
+            transaction.set(stats_ref, {
+                "day": day,
+                "total": self.fs.Increment(len(fresh)),
+                "positions": {k: self.fs.Increment(v) for k, v in positions.items()},
+            }, merge=True)
+            for ref, _ in fresh:
+                transaction.update(ref, {"stats_day": day})
+            return len(fresh)
+
+        return _count(self.db.transaction())
+
+    def _run_migrations(self):
+        # Trigram indeksi har jarayonda; Firestore backfill'lari faqat migrate=True jarayonda
+        self.build_search_index(backfill=self._migrate)
+        if self._migrate:
+            self.backfill_position_stats()
+
+# Bot qo'llab-quvvatlaydigan tillar
+LANGS = ("uz", "uz_cyrl", "ru", "en")
+
+
 class BotLogic:
-    def __init__(self, api, db):
+    def __init__(self, api, db, outbox=None):
         self.api = api
         self.db = db
+        # Ariza saqlash va HR xabari foydalanuvchiga javobdan keyin, parallel bajariladi
+        self.outbox = outbox or Outbox(getattr(db, "local", None), workers=Config.OUTBOX_WORKERS,
+                                       dead_retry_after=Config.OUTBOX_DEAD_RETRY_SEC)
+        self.outbox.register("save_application", self._outbox_save_application,
+                             on_dead=self._outbox_save_application_dead)
+        self.outbox.register("hr_notify", self._outbox_hr_notify, on_dead=self._outbox_hr_notify_dead)
         # Reverse lookup cache for O(1) action detection
         self._action_lookup = {}
+        # Arizalar ro'yxati sahifalari: (chat_id, sahifa) -> shu sahifa cursor'i
+        self._page_cursors = ShardedTTLCache(max_size=1000, ttl_seconds=1800)
+        METRICS.track_cache("page_cursors", self._page_cursors)
         self.positions = {
             "uz": [
                 ["🏢 Boshqaruv", "👨‍🏫 O'qituvchi"],
@@ -690,6 +3424,9 @@ class BotLogic:
 
         # Build reverse lookup dictionary for O(1) action detection
         self._build_action_lookup()
+        self._routes = self._build_routes()
+        # Doimiy matnlar va klaviaturalar bir marta tayyorlanadi
+        self._build_keyboards()
 
     def _build_action_lookup(self):
         """Build reverse lookup for fast action detection (O(1) instead of O(n))"""
@@ -698,12 +3435,98 @@ class BotLogic:
                 if text and isinstance(text, str):
                     self._action_lookup[text] = action_key
 
+    # Welcome menyusidagi til tugmalari
+    WELCOME_LANGS = {"🇺🇿 O'zbek (Lotin)": "uz", "🇺🇿 Ўзбек (Кирил)": "uz_cyrl", "🇷🇺 Русский": "ru", "🇬🇧 English": "en"}
+
+    def _build_routes(self):
+        """Matn -> (yo'nalish, qiymat, javob): state o'qilmasdan ishlanadigan buyruq va menyular.
+
+        Keyingi yozuv oldingisini bosadi: /start va /stop eng ustun, keyin til tanlash
+        menyusi, keyin _action_lookup'dagi actionlar.
+        """
+        routes = {}
+        for text, action in self._action_lookup.items():
+            if action in ("lang_uz", "lang_uz_cyrl", "lang_en", "lang_ru"):
+                routes[text] = ("set_lang", action[len("lang_"):], "msg_lang_changed")
+            elif action == "menu_lang":
+                routes[text] = (action, None, None)
+            elif action in ("menu_about", "menu_contact", "menu_location"):
+                routes[text] = ("info", f"msg_{action[len('menu_'):]}", None)
+        for text, lang in self.WELCOME_LANGS.items():
+            routes[text] = ("set_lang", lang, "msg_welcome")
+        routes["/stop"] = ("stop", None, None)
+        for text in ("/start", "/menu", "Menu"):
+            routes[text] = ("start", None, None)
+        return routes
+
     def _label(self, key, lang):
+        text = self._label_texts.get((key, lang))
+        return text if text is not None else self._render_label(key, lang)
+
+    def _render_label(self, key, lang):
         return self.labels.get(key, {}).get(lang) or self.labels.get(key, {}).get("uz") or key
 
+    def _build_keyboards(self):
+        """Matnlar va doimiy klaviaturalarni (menu, til, is_hr) bo'yicha oldindan JSON'ga aylantirish.
+
+        Hot path'da send_message doimiy ma'lumotni qayta kodlamaydi (RawJSON to'g'ridan-to'g'ri ketadi).
+        """
+        self._label_texts = {(key, lang): self._render_label(key, lang) for key in self.labels for lang in LANGS}
+
+        def raw(markup):
+            return RawJSON(json.dumps(markup))
+
+        self._keyboards = {("welcome_lang",): raw(self._build_welcome_lang_menu()),
+                           ("remove",): raw({"remove_keyboard": True})}
+        for lang in LANGS:
+            cancel_row = [{"text": self._label("cancel", lang)}]
+            self._keyboards.update({
+                ("main", lang, False): raw(self._build_main_menu(lang, False)),
+                ("main", lang, True): raw(self._build_main_menu(lang, True)),
+                ("lang", lang): raw(self._build_lang_menu(lang)),
+                ("admin", lang): raw(self._build_admin_menu(lang)),
+                ("contact", lang): raw({
+                    "keyboard": [
+                        [{"text": self._label("send_contact", lang), "request_contact": True}],
+                        cancel_row
+                    ],
+                    "resize_keyboard": True,
+                    "one_time_keyboard": True
+                }),
+                ("positions", lang): raw({
+                    "keyboard": [[{"text": p} for p in row] for row in self.positions.get(lang, self.positions["uz"])]
+                                + [cancel_row],
+                    "resize_keyboard": True
+                }),
+                ("cancel", lang): raw({"keyboard": [cancel_row], "resize_keyboard": True}),
+                ("skip_cancel", lang): raw({
+                    "keyboard": [[{"text": self._label("skip", lang)}], cancel_row],
+                    "resize_keyboard": True, "one_time_keyboard": True
+                }),
+            })
+
+    def _keyboard(self, name, lang=None, *extra):
+        # Noma'lum til uchun o'zbekcha variant (_label bilan bir xil)
+        key = (name,) if lang is None else (name, lang) + extra
+        markup = self._keyboards.get(key)
+        if markup is None and lang is not None:
+            markup = self._keyboards[(name, "uz") + extra]
+        return markup
+
     def _main_menu(self, lang, chat_id=None):
         is_hr = str(chat_id) == str(Config.HR_CHAT_ID) if chat_id and Config.HR_CHAT_ID else False
-        
+        return self._keyboard("main", lang, is_hr)
+
+    def _lang_menu(self, lang):
+        return self._keyboard("lang", lang)
+
+    def _welcome_lang_menu(self):
+        return self._keyboard("welcome_lang")
+
+    def _admin_menu(self, lang="uz"):
+        return self._keyboard("admin", lang)
+
+    def _build_main_menu(self, lang, is_hr):
         # 1. Bo'sh ish o'rinlar (to'liq qator)
         # 2. Manzilimiz | Biz haqimizda
         # 3. Biz bilan bog'lanish (to'liq qator)
@@ -725,7 +3548,7 @@ class BotLogic:
             "resize_keyboard": True
         }
 
-    def _lang_menu(self, lang):
+    def _build_lang_menu(self, lang):
         return {
             "keyboard": [
                 [{"text": self._label("lang_uz", lang)}, {"text": self._label("lang_uz_cyrl", lang)}],
@@ -735,7 +3558,7 @@ class BotLogic:
             "resize_keyboard": True
         }
 
-    def _welcome_lang_menu(self):
+    def _build_welcome_lang_menu(self):
         """Birinchi marta bot ishga tushganda til tanlash menusi (creative)"""
         return {
             "keyboard": [
@@ -748,7 +3571,7 @@ class BotLogic:
             "one_time_keyboard": True
         }
 
-    def _admin_menu(self, lang="uz"):
+    def _build_admin_menu(self, lang="uz"):
         return {
             "keyboard": [
                 [{"text": self._label("admin_apps", lang)}],
@@ -764,7 +3587,64 @@ class BotLogic:
         if not text: return None
         return self._action_lookup.get(text)
 
+    # State'ni o'zgartirmaydigan, doimiy matnli javoblar: yuklama paytida birinchi bo'lib chetlatiladi.
+    # "back" yo'q: uning matnlari admin_back bilan bir xil va _action_lookup'da admin_back'ga tushadi
+    STATIC_ACTIONS = frozenset({"menu_about", "menu_contact", "menu_location", "menu_lang"})
+
+    def update_priority(self, update):
+        """ChatDispatcher uchun: "low" - statik menyu javoblari, qolgani "normal" """
+        message = update.get("message")
+        if message and self._action_from_text(message.get("text")) in self.STATIC_ACTIONS \
+                and str(message["chat"]["id"]) != str(Config.HR_CHAT_ID):
+            return "low"
+        return "normal"
+
+    def _static_answer(self, message):
+        """Faqat cache'dagi til va state bilan doimiy javob: (chat_id, text, markup) yoki None.
+
+        Natija _handle_update bilan bir xil. Cache'da til (about/contact/location uchun
+        state ham) bo'lmasa None: answer_fast False qaytaradi va ChatDispatcher update'ni
+        chat navbatining boshiga qaytaradi.
+        """
+        chat_id = message["chat"]["id"]
+        if str(chat_id) == str(Config.HR_CHAT_ID):
+            return None
+        action = self._action_from_text(message.get("text"))
+        if action not in self.STATIC_ACTIONS:
+            return None
+        user_id = message["from"]["id"]
+        lang = self.db.cached_user_lang(user_id)
+        if lang is _MISSING:
+            return None
+        # Keshlangan "til tanlanmagan" - get_user_lang kabi standart til
+        lang = lang or "uz"
+        if action == "menu_lang":
+            return chat_id, self._label("msg_select_lang", lang), self._lang_menu(lang)
+        # about/contact/location faqat state yo'q bo'lsa (flow ichida shu matn javob sifatida olinadi)
+        state = self.db.cached_user_state(user_id)
+        if state is _MISSING or state:
+            return None
+        return chat_id, self._label(f"msg_{action[len('menu_'):]}", lang), self._main_menu(lang, chat_id)
+
+    def answer_fast(self, update):
+        """Dispatcher to'lganda chetlatilgan update: keshdan javob berilsa True, aks holda False (navbatga qaytadi)"""
+        message = update.get("message")
+        answer = self._static_answer(message) if message else None
+        if answer is None:
+            return False
+        # handle_update bilan bir xil root trace: yuklama paytida ham /traces va span'lar to'liq
+        with TRACER.trace("handle_update", update_id=update.get("update_id"), kind="message",
+                          chat_id=answer[0], fast_path=True):
+            self.api.send_message(*answer)
+        return True
+
     def handle_update(self, update):
+        kind = next((k for k in update if k != "update_id"), "unknown")
+        with TRACER.trace("handle_update", update_id=update.get("update_id"), kind=kind,
+                          chat_id=ChatDispatcher.chat_key(update)):
+            self._handle_update(update)
+
+    def _handle_update(self, update):
         # Callback query handling for pagination
         callback_query = update.get("callback_query")
         if callback_query:
@@ -779,96 +3659,74 @@ class BotLogic:
         text = message.get("text", "")
         contact = message.get("contact")
         
-        lang = self.db.get_user_lang(user_id)
-        state = self.db.get_user_state(user_id)
         is_hr_chat = str(chat_id) == str(Config.HR_CHAT_ID)
+        # state faqat kerak bo'lganda o'qiladi (_MISSING - hali o'qilmagan)
+        state = _MISSING
 
         if is_hr_chat:
+            state = self.db.get_user_state(user_id)
             admin_handled = self._handle_admin(update, chat_id, user_id, text, state)
             if admin_handled:
                 return
 
-        if text in ["/start", "/menu"] or text == "Menu":
-            self.db.set_user_state(user_id, None)
-
-            # Agar foydalanuvchi yangi bo'lsa (til tanlamagan), til tanlash menusini ko'rsatish
-            if not lang:
-                # Har uchala tilda til tanlash so'rovi (creative)
-                welcome_msg = (
-                    "🌟 <b>Al-Xorazmiy xususiy maktabi</b> 🏫\n\n"
-                    "🌍 <i>Iltimos, tilni tanlang:</i>\n"
-                    "🌍 <i>Пожалуйста, выберите язык:</i>\n"
-                    "🌍 <i>Please select a language:</i>"
-                )
-                self.api.send_message(chat_id, welcome_msg, self._welcome_lang_menu())
+        # Buyruq va statik menyular state o'qilmasdan ishlanadi (til odatda cache'da)
+        route = self._routes.get(text)
+        if route is not None:
+            kind, value, reply = route
+            if kind == "set_lang":
+                # Til tanlash (welcome menyusi yoki til menyusi)
+                self.db.set_user_lang(user_id, value)
+                self.api.send_message(chat_id, self._label(reply, value), self._main_menu(value, chat_id))
                 return
 
-            # Agar til tanlangan bo'lsa, asosiy menyuni ko'rsatish
-            self.api.send_message(chat_id, self._label("msg_welcome", lang), self._main_menu(lang, chat_id))
-            return
-
-        if text == "/stop":
-            self.db.set_user_state(user_id, None)
-            # Klaviaturani olib tashlash
-            remove_kb = {"remove_keyboard": True}
-            self.api.send_message(chat_id, self._label("msg_stopped", lang if lang else "uz"), remove_kb)
-            return
-        
-        # Welcome lang menu'dan til tanlash (creative shaklda)
-        if text in ["🇺🇿 O'zbek (Lotin)", "🇺🇿 Ўзбек (Кирил)", "🇷🇺 Русский", "🇬🇧 English"]:
-            if text == "🇺🇿 O'zbek (Lotin)":
-                new_lang = "uz"
-            elif text == "🇺🇿 Ўзбек (Кирил)":
-                new_lang = "uz_cyrl"
-            elif text == "🇷🇺 Русский":
-                new_lang = "ru"
-            else:  # English
-                new_lang = "en"
-
-            self.db.set_user_lang(user_id, new_lang)
-            # Til tanlangandan keyin xush kelibsiz xabarini ko'rsatish
-            self.api.send_message(chat_id, self._label("msg_welcome", new_lang), self._main_menu(new_lang, chat_id))
-            return
-
-        action = self._action_from_text(text)
-
-        if action == "menu_lang":
-            self.api.send_message(chat_id, self._label("msg_select_lang", lang), self._lang_menu(lang))
-            return
-
-        if action in ["lang_uz", "lang_uz_cyrl", "lang_en", "lang_ru"]:
-            if action == "lang_uz":
-                new_lang = "uz"
-            elif action == "lang_uz_cyrl":
-                new_lang = "uz_cyrl"
-            elif action == "lang_en":
-                new_lang = "en"
-            else:
-                new_lang = "ru"
-            self.db.set_user_lang(user_id, new_lang)
-            self.api.send_message(chat_id, self._label("msg_lang_changed", new_lang), self._main_menu(new_lang, chat_id))
-            return
-
-        if action == "back":
-            self.api.send_message(chat_id, "Menu:", self._main_menu(lang, chat_id))
-            return
+            lang = self.db.get_user_lang(user_id)
+
+            if kind == "start":
+                self.db.set_user_state(user_id, None)
+
+                # Agar foydalanuvchi yangi bo'lsa (til tanlamagan), til tanlash menusini ko'rsatish
+                if not lang:
+                    # Har uchala tilda til tanlash so'rovi (creative)
+                    welcome_msg = (
+                        "🌟 <b>Al-Xorazmiy xususiy maktabi</b> 🏫\n\n"
+                        "🌍 <i>Iltimos, tilni tanlang:</i>\n"
+                        "🌍 <i>Пожалуйста, выберите язык:</i>\n"
+                        "🌍 <i>Please select a language:</i>"
+                    )
+                    self.api.send_message(chat_id, welcome_msg, self._welcome_lang_menu())
+                    return
+
+                # Agar til tanlangan bo'lsa, asosiy menyuni ko'rsatish
+                self.api.send_message(chat_id, self._label("msg_welcome", lang), self._main_menu(lang, chat_id))
+                return
 
-        if not state:
-            if action == "menu_about":
-                self.api.send_message(chat_id, self._label("msg_about", lang), self._main_menu(lang, chat_id))
+            if kind == "stop":
+                self.db.set_user_state(user_id, None)
+                # Klaviaturani olib tashlash
+                self.api.send_message(chat_id, self._label("msg_stopped", lang if lang else "uz"), self._keyboard("remove"))
                 return
 
-            if action == "menu_contact":
-                self.api.send_message(chat_id, self._label("msg_contact", lang), self._main_menu(lang, chat_id))
+            if kind == "menu_lang":
+                self.api.send_message(chat_id, self._label("msg_select_lang", lang), self._lang_menu(lang))
                 return
 
-            if action == "menu_location":
-                self.api.send_message(chat_id, self._label("msg_location", lang), self._main_menu(lang, chat_id))
+            # about/contact/location - faqat state yo'q bo'lsa (flow ichida shu matn javob sifatida olinadi)
+            if state is _MISSING:
+                state = self.db.get_user_state(user_id)
+            if not state:
+                self.api.send_message(chat_id, self._label(value, lang), self._main_menu(lang, chat_id))
                 return
+        else:
+            lang = self.db.get_user_lang(user_id)
+
+        if state is _MISSING:
+            state = self.db.get_user_state(user_id)
+        action = self._action_from_text(text)
 
+        if not state:
             if action == "menu_jobs":
                 self.db.set_user_state(user_id, {"step": "name", "data": {}, "mode": "job"})
-                self.api.send_message(chat_id, self._label("msg_ask_name", lang), {"remove_keyboard": True})
+                self.api.send_message(chat_id, self._label("msg_ask_name", lang), self._keyboard("remove"))
                 return
             
             # Agar hech qanday action bo'lmasa va state yo'q bo'lsa
@@ -894,15 +3752,7 @@ class BotLogic:
                 state["step"] = "phone"
                 state["data"] = data
                 self.db.set_user_state(user_id, state)
-                markup = {
-                    "keyboard": [
-                        [{"text": self._label("send_contact", lang), "request_contact": True}],
-                        [{"text": self._label("cancel", lang)}]
-                    ],
-                    "resize_keyboard": True,
-                    "one_time_keyboard": True
-                }
-                self.api.send_message(chat_id, self._label("msg_ask_phone", lang), markup)
+                self.api.send_message(chat_id, self._label("msg_ask_phone", lang), self._keyboard("contact", lang))
             else:
                 self.api.send_message(chat_id, f"{self._label('msg_invalid_name', lang)}\n\n{self._label('cancel', lang)}: '{self._label('cancel', lang)}'")
         
@@ -913,10 +3763,7 @@ class BotLogic:
                 state["step"] = "position"
                 state["data"] = data
                 self.db.set_user_state(user_id, state)
-                kb = [[{"text": p} for p in row] for row in self.positions.get(lang, self.positions["uz"])]
-                kb.append([{"text": self._label("cancel", lang)}])
-                markup = {"keyboard": kb, "resize_keyboard": True}
-                self.api.send_message(chat_id, self._label("msg_ask_position", lang), markup)
+                self.api.send_message(chat_id, self._label("msg_ask_position", lang), self._keyboard("positions", lang))
             else:
                 self.api.send_message(chat_id, self._label("msg_invalid_phone", lang))
 
@@ -940,8 +3787,7 @@ class BotLogic:
             elif lang == "ru":
                 msg = f"Вы выбрали раздел <b>{text}</b>.\n\nТеперь введите конкретную должность или специализацию (Например: Учитель математики, Главный бухгалтер и т. д.):"
 
-            markup = {"keyboard": [[{"text": self._label("cancel", lang)}]], "resize_keyboard": True}
-            self.api.send_message(chat_id, msg, markup)
+            self.api.send_message(chat_id, msg, self._keyboard("cancel", lang))
 
         elif step == "position_manual":
             if len(text) > 2:
@@ -959,8 +3805,7 @@ class BotLogic:
                 state["step"] = "exp"
                 state["data"] = data
                 self.db.set_user_state(user_id, state)
-                markup = {"keyboard": [[{"text": self._label("cancel", lang)}]], "resize_keyboard": True}
-                self.api.send_message(chat_id, self._label("msg_ask_exp", lang), markup)
+                self.api.send_message(chat_id, self._label("msg_ask_exp", lang), self._keyboard("cancel", lang))
             else:
                 self.api.send_message(chat_id, self._label("msg_ask_position_manual", lang))
 
@@ -970,11 +3815,7 @@ class BotLogic:
                 state["step"] = "cv"
                 state["data"] = data
                 self.db.set_user_state(user_id, state)
-                markup = {
-                    "keyboard": [[{"text": self._label("skip", lang)}], [{"text": self._label("cancel", lang)}]],
-                    "resize_keyboard": True, "one_time_keyboard": True
-                }
-                self.api.send_message(chat_id, self._label("msg_ask_cv", lang), markup)
+                self.api.send_message(chat_id, self._label("msg_ask_cv", lang), self._keyboard("skip_cancel", lang))
             else:
                 self.api.send_message(chat_id, self._label("msg_invalid_exp", lang))
 
@@ -994,12 +3835,21 @@ class BotLogic:
                 self.api.send_message(chat_id, self._label("msg_invalid_cv", lang))
                 return
 
-            # Firebase va HR ga yuborish
-            saved = self.db.save_application(user_id, data, cv_file_id, cv_type)
-            self._send_to_hr(user_id, data, cv_file_id, cv_type, saved)
-            
-            self.api.send_message(chat_id, self._label("msg_applied", lang), self._main_menu(lang, chat_id))
-            self.db.set_user_state(user_id, None)
+            # Ariza avval lokal outbox'ga yoziladi; Firebase'ga saqlash fonda, HR xabari saqlangandan keyin
+            with TRACER.span("step.cv_submit"):
+                app_id = uuid.uuid4().hex[:20]
+                payload = {
+                    "app_id": app_id,
+                    "user_id": user_id,
+                    "data": data,
+                    "file_id": cv_file_id,
+                    "f_type": cv_type,
+                    "submitted_at": time.time(),
+                }
+                self.outbox.enqueue(("save_application", app_id, payload))
+
+                self.api.send_message(chat_id, self._label("msg_applied", lang), self._main_menu(lang, chat_id))
+                self.db.set_user_state(user_id, None)
 
     def _handle_admin(self, update, chat_id, user_id, text, state):
         t = (text or "").strip()
@@ -1045,7 +3895,7 @@ class BotLogic:
             return True
 
         if t == self._label("admin_apps", lang):
-            self._send_recent_applications(chat_id, offset=0, lang=lang)
+            self._send_recent_applications(chat_id, page=0, lang=lang)
             self.db.set_user_state(user_id, {"mode": "admin", "step": "menu"})
             return True
 
@@ -1065,7 +3915,7 @@ class BotLogic:
             return True
 
         if state.get("step") == "search_position":
-            results = self.db.search_applications_by_position(t, limit=50, scan_limit=300)
+            results = self.db.search_applications_by_position(t, limit=50)
             if not self.db.db:
                 self.api.send_message(chat_id, self._label("admin_firebase_error", lang), self._admin_menu(lang))
                 self.db.set_user_state(user_id, {"mode": "admin", "step": "menu"})
@@ -1108,8 +3958,13 @@ class BotLogic:
             # Delete the navigation message to avoid clutter
             self.api.call("deleteMessage", {"chat_id": chat_id, "message_id": msg_id})
 
-            offset = int(data.split("_")[1])
-            self._send_recent_applications(chat_id, offset=offset, lang=lang)
+            # page_<sahifa>_<cursor>; eski "page_<offset>" tugmalari birinchi sahifani ochadi
+            parts = data.split("_", 2)
+            if len(parts) == 3 and parts[1].isdigit():
+                page, cursor = int(parts[1]), parts[2] or None
+            else:
+                page, cursor = 0, None
+            self._send_recent_applications(chat_id, page=page, cursor=cursor, lang=lang)
 
         elif data.startswith("delete_"):
             # Handle application deletion
@@ -1166,7 +4021,7 @@ class BotLogic:
                 "parse_mode": "HTML"
             }
             if reply_markup:
-                params["reply_markup"] = json.dumps(reply_markup)
+                params["reply_markup"] = _markup_json(reply_markup)
             self.api.call("editMessageText", params)
             return
 
@@ -1180,43 +4035,51 @@ class BotLogic:
         if buf:
             self.api.send_message(chat_id, buf, reply_markup)
 
-    def _send_recent_applications(self, chat_id, offset=0, limit=10, lang="uz", edit_msg_id=None):
+    def _send_recent_applications(self, chat_id, page=0, cursor=None, limit=10, lang="uz", edit_msg_id=None):
         if not self.db.db:
             self.api.send_message(chat_id, self._label("admin_firebase_error", lang), self._admin_menu(lang))
             return
         
-        items = self.db.get_recent_applications(limit=limit, offset=offset)
+        items = self.db.get_recent_applications(limit=limit, start_after=cursor)
         if not items:
-            if offset == 0:
+            if page == 0:
                 self.api.send_message(chat_id, self._label("admin_no_apps", lang), self._admin_menu(lang))
             else:
-                # If no items on this page (e.g. deleted), go back
-                self._send_recent_applications(chat_id, offset=max(0, offset-limit), limit=limit, lang=lang)
+                # If no items on this page (e.g. deleted), go back to the first page
+                self._send_recent_applications(chat_id, page=0, limit=limit, lang=lang)
             return
 
         # Send header for the batch
-        if offset == 0 and not edit_msg_id:
+        if page == 0 and not edit_msg_id:
             self.api.send_message(chat_id, f"<b>{self._label('admin_apps', lang)}</b>", self._admin_menu(lang))
 
         # Send each application as a separate detailed message
-        for i, item in enumerate(items, start=offset+1):
+        for i, item in enumerate(items, start=page * limit + 1):
+            # Burst'lar TelegramAPI ichidagi rate limiter orqali tekislanadi
             self._send_single_application(chat_id, item, index=i, lang=lang)
-            # No sleep needed - Telegram handles rate limiting automatically
 
-        # Pagination navigation message
+        # Shu sahifaning cursor'ini eslab qolamiz - "Oldingi" tugmasi uchun kerak bo'ladi
+        self._page_cursors.set((chat_id, page), cursor or "")
+
+        # Pagination navigation message (callback_data: page_<sahifa>_<cursor>)
         kb = []
         nav_row = []
-        if offset > 0:
-            nav_row.append({"text": "⬅️ Oldingi", "callback_data": f"page_{max(0, offset-limit)}"})
+        if page > 0:
+            prev_cursor = self._page_cursors.get((chat_id, page - 1))
+            if prev_cursor is None:
+                # Cursor eskirgan - birinchi sahifaga qaytamiz
+                nav_row.append({"text": "⬅️ Oldingi", "callback_data": "page_0_"})
+            else:
+                nav_row.append({"text": "⬅️ Oldingi", "callback_data": f"page_{page - 1}_{prev_cursor}"})
         
         # Check if there might be more (simple heuristic: if we got 'limit' items, assume there's more)
         if len(items) == limit:
-            nav_row.append({"text": "Keyingi ➡️", "callback_data": f"page_{offset+limit}"})
+            nav_row.append({"text": "Keyingi ➡️", "callback_data": f"page_{page + 1}_{items[-1]['id']}"})
         
         if nav_row:
             kb.append(nav_row)
             markup = {"inline_keyboard": kb}
-            self.api.send_message(chat_id, f"<i>Sahifa: {offset//limit + 1}</i>", markup)
+            self.api.send_message(chat_id, f"<i>Sahifa: {page + 1}</i>", markup)
 
     def _send_single_application(self, chat_id, item, index, lang="uz"):
         ts = self._fmt_ts(item.get("timestamp"))
@@ -1265,7 +4128,6 @@ class BotLogic:
         self.api.send_message(chat_id, f"<b>{title}</b>", self._admin_menu(lang))
         for i, item in enumerate(items, start=1):
             self._send_single_application(chat_id, item, index=i, lang=lang)
-            # No sleep needed - Telegram API handles rate limiting
 
     def _send_application_details(self, chat_id, doc_id, lang="uz"):
         if not self.db.db:
@@ -1313,7 +4175,7 @@ class BotLogic:
                 param_key: cv_file_id, 
                 "caption": report, 
                 "parse_mode": "HTML",
-                "reply_markup": json.dumps(self._admin_menu(lang))
+                "reply_markup": self._admin_menu(lang)
             })
         else:
             self.api.send_message(chat_id, report, self._admin_menu(lang))
@@ -1328,7 +4190,7 @@ class BotLogic:
                    ("📊 Analyzing data, please wait..." if lang == "en" else "📊 Данные анализируются, пожалуйста, подождите...")
         self.api.send_message(chat_id, wait_msg)
         
-        stats = self.db.get_position_stats(days=days, limit=1000)
+        stats = self.db.get_position_stats(days=days)
         total = stats.pop("_total", 0) if stats else 0
         
         if not stats or total == 0:
@@ -1406,10 +4268,91 @@ class BotLogic:
         # Xalqaro format uchun 12 gacha raqam (masalan: 998901234567)
         return 9 <= len(digits) <= 15
 
+    def _outbox_save_application(self, job):
+        if not self.db.db:
+            # Firebase hali ulanmagan (fon init yoki uzilish) - outbox backoff bilan qayta urinadi
+            logger.warning(f"Firebase ulanmagan, ariza keyinroq saqlanadi: {job['app_id']}")
+            return False
+        # Qayta urinishlar outbox backoff'i orqali
+        saved = self.db.save_application(
+            job["user_id"], job["data"], job["file_id"], job["f_type"],
+            doc_id=job["app_id"], submitted_at=job["submitted_at"], max_retries=1
+        )
+        if not saved:
+            return False
+        # HR xabari faqat ariza (va hr_outbox/{app_id}) saqlangandan keyin navbatga qo'yiladi.
+        # Shu orada jarayon qulasa, hujjat "pending" qoladi va sweep_hr_outbox uni qaytaradi
+        self.outbox.enqueue(("hr_notify", job["app_id"], job))
+        return True
+
+    def _outbox_save_application_dead(self, job):
+        """Ariza saqlanmadi (Firestore uzoq ishlamayapti): HR uni baribir oladi, saqlash keyin qayta uriniladi"""
+        self.outbox.enqueue(("hr_notify", job["app_id"], {**job, "unsaved": True}))
+        return False
+
+    def _outbox_hr_notify(self, job):
+        app_id = job["app_id"]
+        if not self.db.db or job.get("unsaved"):
+            # Firestore'da hujjat yo'q - faqat lokal belgi bilan
+            return self._deliver_to_hr(job)
+        # Idempotency ariza id'si bo'yicha Firestore'da: hr_outbox/{app_id} band qilingan bo'lsa
+        # boshqa replika/jarayon lease tugaguncha shu xabarni yubormaydi
+        claim = self.db.claim_hr_notification(app_id, Config.HR_OUTBOX_LEASE_SEC)
+        if claim in ("sent", "busy"):
+            return True
+        if claim != "claimed":
+            # Firestore xatosi - qayta urinish; urinishlar tugasa _outbox_hr_notify_dead claim'siz yuboradi
+            return False
+        if not self._deliver_to_hr(job):
+            return False
+        return self.db.mark_hr_notification_sent(app_id)
+
+    def _outbox_hr_notify_dead(self, job):
+        """hr_outbox band qilinmadi (Firestore ishlamayapti yoki hujjat yo'q): HR xabarni baribir oladi"""
+        logger.warning(f"hr_outbox band qilinmadi, HR xabari claim'siz yuboriladi: {job['app_id']}")
+        return self._deliver_to_hr(job)
+
+    def _deliver_to_hr(self, job):
+        """Lokal delivered belgisi bilan: yuborilgan, lekin "sent" yozilmay qolgan xabar qayta yuborilmaydi"""
+        store = self.outbox.store
+        if store.is_delivered(job["app_id"]):
+            return True
+        if not self._send_to_hr(job["user_id"], job["data"], job["file_id"], job["f_type"], not job.get("unsaved")):
+            return False
+        store.mark_delivered(job["app_id"])
+        return True
+
+    def sweep_hr_outbox(self, min_age=120):
+        """Firestore hr_outbox'da yuborilmay qolgan xabarlarni lokal outbox'ga qaytarish.
+
+        Lokal navbat yo'qolgan (boshqa server, o'chirilgan disk) yoki yuboruvchining lease'i
+        tugagan holatlar uchun. Qayta yuborish baribir claim_hr_notification'dan o'tadi.
+        """
+        requeued = 0
+        for item in self.db.get_pending_hr_notifications(min_age=min_age):
+            app_id = item.get("app_id")
+            if not app_id:
+                continue
+            if self.outbox.store.is_delivered(app_id):
+                self.db.mark_hr_notification_sent(app_id)
+                continue
+            # Lokal navbatda (yoki "dead" holatida) bo'lsa qo'shilmaydi va sanalmaydi
+            requeued += self.outbox.enqueue(("hr_notify", app_id, {
+                "app_id": app_id,
+                "user_id": item.get("user_id"),
+                "data": item.get("data") or {},
+                "file_id": item.get("file_id"),
+                "f_type": item.get("f_type"),
+            }))
+        if requeued:
+            logger.info(f"hr_outbox: {requeued} ta yuborilmagan HR xabari navbatga qaytarildi")
+        return requeued
+
     def _send_to_hr(self, user_id, data, file_id, f_type, saved_to_firebase):
+        """HR chatiga ariza xabarini yuborish; True - yuborildi (yoki yuboriladigan joy yo'q)"""
         if not Config.HR_CHAT_ID:
             logger.warning("HR_CHAT_ID sozlanmagan, ariza yuborilmadi")
-            return
+            return True
 
         report = (
             f"<b>Yangi ariza</b>\n\n"
@@ -1418,6 +4361,8 @@ class BotLogic:
             f"💼 Lavozim: {data.get('position')}\n"
             f"📝 Tajriba: {data.get('exp')}"
         )
+        if saved_to_firebase is False:
+            report += "\n\n⚠️ Ariza bazaga hali saqlanmadi"
 
         try:
             if file_id:
@@ -1429,19 +4374,99 @@ class BotLogic:
                     "caption": report,
                     "parse_mode": "HTML"
                 }
-                self.api.call(method, params)
+                # Outbox natijani kutadi (rate limit navbatida bo'lsa ham)
+                result = self.api.call(method, params, block=True)
+                if result.get("error_code") == 400:
+                    # Fayl yuborib bo'lmadi (masalan, file_id eskirgan) - HR ariza matnini baribir ko'rsin
+                    logger.warning(f"HR ga fayl yuborilmadi, faqat matn yuboriladi: {result.get('description')}")
+                    result = self.api.send_message(Config.HR_CHAT_ID, report + "\n\n⚠️ CV fayli yuborilmadi", block=True)
             else:
-                self.api.send_message(Config.HR_CHAT_ID, report)
+                result = self.api.send_message(Config.HR_CHAT_ID, report, block=True)
+            return bool(result.get("ok"))
         except Exception as e:
             logger.error(f"HR ga yuborishda xatolik: {e}")
+            return False
+
+def run_health_check(dispatcher=None, capture=None):
+    """Render uchun health check endpointini ishga tushirish.
+
+    Webhook rejimida shu Flask ilovasi Telegram update'larini ham qabul qiladi.
+    """
+    from flask import Flask, Response, request
 
-def run_health_check():
-    """Render uchun health check endpointini ishga tushirish"""
     app = Flask(__name__)
 
+    def diagnostics(view):
+        """/metrics, /traces, /stats: chat_id va ichki holat ko'rinadi - token yoki localhost talab qilinadi"""
+        @functools.wraps(view)
+        def guarded(*args, **kwargs):
+            if Config.DIAGNOSTICS_TOKEN:
+                auth = request.headers.get("Authorization", "")
+                token = auth[len("Bearer "):] if auth.startswith("Bearer ") else ""
+                if not hmac.compare_digest(token.encode(), Config.DIAGNOSTICS_TOKEN.encode()):
+                    return "Forbidden", 403
+            elif request.remote_addr not in ("127.0.0.1", "::1"):
+                return "Forbidden", 403
+            return view(*args, **kwargs)
+        return guarded
+
     @app.route('/')
     def health_check():
-        return "Bot is running!", 200
+        # Liveness: to'la navbat restart sababi emas, yuklama faqat sarlavhada ko'rsatiladi
+        headers = {"X-Bot-Saturation": f"{dispatcher.saturation():.3f}"} if dispatcher is not None else {}
+        return "Bot is running!", 200, headers
+
+    @app.route('/ready')
+    def readiness():
+        """Readiness: navbat to'la bo'lsa 503 (load balancer yangi so'rov yubormasin)"""
+        saturation = dispatcher.saturation() if dispatcher is not None else 0.0
+        return {"ready": saturation < 1.0, "saturation": round(saturation, 3)}, 200 if saturation < 1.0 else 503
+
+    @app.route('/metrics')
+    @diagnostics
+    def metrics():
+        return Response(METRICS.render(), mimetype="text/plain; version=0.0.4")
+
+    @app.route('/traces')
+    @diagnostics
+    def slow_traces():
+        limit = request.args.get("limit", type=int)
+        return {**TRACER.stats(), "traces": TRACER.slow_traces(limit)}, 200
+
+    if dispatcher is not None:
+        @app.route('/stats')
+        @diagnostics
+        def dispatcher_stats():
+            return dispatcher.stats(), 200
+
+    if Config.BOT_MODE == "webhook" and dispatcher is not None:
+        # Telegram qayta yuborgan update'larni ikki marta qayta ishlamaslik uchun
+        seen_updates = ShardedTTLCache(max_size=5000, ttl_seconds=600)
+
+        @app.route(Config.WEBHOOK_PATH, methods=['POST'])
+        def telegram_webhook():
+            secret = request.headers.get("X-Telegram-Bot-Api-Secret-Token", "")
+            if not hmac.compare_digest(secret.encode(), (Config.WEBHOOK_SECRET or "").encode()):
+                logger.warning("Webhook: noto'g'ri secret token")
+                return "Forbidden", 403
+
+            update = request.get_json(silent=True)
+            if not isinstance(update, dict):
+                return "Bad Request", 400
+
+            update_id = update.get("update_id")
+            if update_id is not None and seen_updates.get(update_id):
+                return "OK", 200
+
+            # Telegram'ga darhol javob qaytaramiz, update chat navbatida qayta ishlanadi.
+            # Navbat to'la bo'lsa 503 - Telegram update'ni keyinroq qayta yuboradi
+            if not dispatcher.submit(update, block=False):
+                return "Busy", 503
+            if update_id is not None:
+                seen_updates.set(update_id, True)
+            if capture is not None:
+                capture.write_update(update)
+            return "OK", 200
 
     port = int(os.environ.get("PORT", 10000))
     # Flask loglarini kamaytirish
@@ -1449,101 +4474,506 @@ def run_health_check():
     log = logging.getLogger('werkzeug')
     log.setLevel(logging.ERROR)
     
-    app.run(host='0.0.0.0', port=port)
+    app.run(host='0.0.0.0', port=port, threaded=True)
+
+# Bot profili (ishga tushishda Telegram'ga o'rnatiladi)
+BOT_COMMANDS = [
+    {"command": "start", "description": "Botni ishga tushirish"},
+    {"command": "menu", "description": "Asosiy menyu"},
+    {"command": "stop", "description": "Botni to'xtatish"},
+    {"command": "admin", "description": "Admin panel (faqat adminlar)"}
+]
+
+BOT_DESCRIPTION = (
+    "🏫 Al-Xorazmiy xususiy maktabiga xush kelibsiz!\n\n"
+    "✨ Bu bot orqali:\n"
+    "📚 Maktab haqida ma'lumot\n"
+    "📍 Manzil va aloqa\n"
+    "💼 Bo'sh ish o'rinlariga ariza topshirish\n\n"
+    "🌍 4 tilda xizmat\n\n"
+    "START bosing va tilni tanlang! 👇"
+)
+
+BOT_SHORT_DESCRIPTION = (
+    "Al-Xorazmiy maktabi ishga qabul boti. "
+    "Ma'lumot va ariza topshirish."
+)
+
+# Bot faqat shu update turlarini qayta ishlaydi (qolganlari Telegram'dan umuman kelmaydi)
+ALLOWED_UPDATES = ["message", "callback_query"]
+
+LOGO_FILES = ["logo.png", "logo.jpg", "logo.jpeg", "school_logo.png", "school_logo.jpg"]
+
+
+def _bot_profile_calls():
+    """Ishga tushishda bajariladigan sozlash chaqiruvlari: (nom, method, params, logo_path)"""
+    calls = []
+    if Config.BOT_MODE == "webhook":
+        # Bir nechta replika bitta URL (load balancer) ortida ishlaydi
+        calls.append(("webhook", "setWebhook", {
+            "url": Config.WEBHOOK_URL,
+            "secret_token": Config.WEBHOOK_SECRET,
+            "allowed_updates": ALLOWED_UPDATES,
+        }, None))
+    else:
+        # Webhookni o'chirish (polling rejimida ishlash uchun)
+        calls.append(("webhook", "deleteWebhook", {"drop_pending_updates": True}, None))
+    calls.append(("commands", "setMyCommands", {"commands": BOT_COMMANDS}, None))
+    calls.append(("description", "setMyDescription", {"description": BOT_DESCRIPTION}, None))
+    calls.append(("short_description", "setMyShortDescription", {"description": BOT_SHORT_DESCRIPTION}, None))
+
+    logo_path = next((f for f in LOGO_FILES if os.path.exists(f)), None)
+    if logo_path:
+        calls.append(("logo", "setMyProfilePhoto", {}, logo_path))
+    else:
+        logger.info("Logo fayli topilmadi. Bot profil rasmini o'rnatish uchun logo.png yoki logo.jpg faylini qo'shing.")
+    return calls
+
+
+def _profile_digest(method, params, logo_path):
+    h = hashlib.sha256()
+    # Boshqa bot tokeni bilan ishga tushganda hammasi qayta o'rnatiladi
+    h.update(hashlib.sha256((Config.TOKEN or "").encode()).digest())
+    h.update(method.encode())
+    h.update(json.dumps(params, sort_keys=True).encode())
+    if logo_path:
+        with open(logo_path, "rb") as f:
+            h.update(f.read())
+    return h.hexdigest()
+
+
+def setup_bot_profile(api, manifest_path=None, wait=False):
+    """Bot profilini sozlash: o'zgarmagan sozlamalar o'tkazib yuboriladi, qolganlari fonda parallel.
+
+    Har bir sozlamaning kontent hash'i lokal manifest faylida saqlanadi. Manifestni
+    o'chirish hammasini qayta o'rnatishga majbur qiladi. setWebhook/deleteWebhook
+    manifestga kirmaydi va har safar yuboriladi (Telegram tomonida o'zgargan bo'lishi mumkin).
+    """
+    manifest_path = manifest_path or Config.PROFILE_MANIFEST_PATH
+    manifest = {}
+    try:
+        with open(manifest_path, "r", encoding="utf-8") as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        pass
+
+    # Eski manifestlarda webhook yozuvi bo'lishi mumkin
+    manifest.pop("webhook", None)
+
+    pending = []
+    skipped = 0
+    for name, method, params, logo_path in _bot_profile_calls():
+        if name == "webhook":
+            # Idempotent chaqiruv: replika har ishga tushishda webhook holatini tiklaydi
+            pending.append((name, method, params, logo_path, None))
+            continue
+        try:
+            digest = _profile_digest(method, params, logo_path)
+        except OSError as e:
+            logger.error(f"Bot profil sozlamasini o'qishda xatolik ({name}): {e}")
+            continue
+        if manifest.get(name) != digest:
+            pending.append((name, method, params, logo_path, digest))
+        else:
+            skipped += 1
+
+    if skipped:
+        logger.info(f"Bot profili: {skipped} ta o'zgarmagan sozlama o'tkazib yuborildi")
+
+    def apply(item):
+        name, method, params, logo_path, digest = item
+        try:
+            if logo_path:
+                with open(logo_path, "rb") as photo:
+                    result = api.call(method, params, files={"photo": photo})
+            else:
+                result = api.call(method, params)
+        except Exception as e:
+            result = {"ok": False, "description": str(e)}
+        return name, method, digest, result
+
+    def run():
+        with ThreadPoolExecutor(max_workers=len(pending), thread_name_prefix="bot-profile") as pool:
+            results = list(pool.map(apply, pending))
+        for name, method, digest, result in results:
+            if result.get("ok"):
+                if digest:
+                    manifest[name] = digest
+                logger.info(f"Bot sozlamasi o'rnatildi: {method}")
+            else:
+                logger.warning(f"Bot sozlamasi o'rnatilmadi ({method}): {result.get('description')}")
+        try:
+            tmp_path = f"{manifest_path}.tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(manifest, f, indent=2)
+            os.replace(tmp_path, manifest_path)
+        except OSError as e:
+            logger.error(f"Bot profil manifestini yozishda xatolik: {e}")
+
+    thread = threading.Thread(target=run, name="bot-profile", daemon=True)
+    thread.start()
+    if wait:
+        thread.join()
+    return thread
+
+class AdaptivePoller:
+    """getUpdates parametrlarini oxirgi update oqimiga moslash.
+
+    Oqim (EWMA, update/s) tez bo'lsa limit kattaroq va timeout qisqa - oqim to'xtaganini
+    tez sezadi; jim paytda to'liq long poll. Batch limitga yetsa (backlog) keyingi so'rov
+    maksimal limit va timeout=0 bilan. Xatolarda jitter'li eksponensial kutish, 429 da retry_after.
+    """
+    def __init__(self, min_limit=10, max_limit=100, idle_timeout=30, busy_timeout=5, busy_rate=2.0,
+                 smoothing=0.3, base_delay=1.0, max_delay=60):
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.idle_timeout = idle_timeout
+        self.busy_timeout = busy_timeout
+        self.busy_rate = busy_rate
+        self.smoothing = smoothing
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.rate = 0.0
+        # Ishga tushganda to'plangan update'lar bo'lishi mumkin
+        self.limit = max_limit
+        self.timeout = 0
+        self.failures = 0
+        self._last_at = None
+
+    def params(self, offset):
+        return {"offset": offset, "limit": self.limit, "timeout": self.timeout, "allowed_updates": ALLOWED_UPDATES}
+
+    def record(self, count):
+        """Muvaffaqiyatli getUpdates natijasi: oqim bahosini va keyingi parametrlarni yangilash"""
+        now = time.monotonic()
+        if self._last_at is not None:
+            instant = count / max(now - self._last_at, 0.05)
+            self.rate += self.smoothing * (instant - self.rate)
+        self._last_at = now
+        self.failures = 0
+        if count >= self.limit:
+            self.limit, self.timeout = self.max_limit, 0
+            return
+        # Ikki soniyalik oqim bitta so'rovga sig'adi
+        self.limit = max(self.min_limit, min(self.max_limit, int(self.rate * 2) + self.min_limit))
+        self.timeout = self.busy_timeout if self.rate >= self.busy_rate else self.idle_timeout
+
+    def failed(self, result=None):
+        """Keyingi urinishgacha kutish (soniya)"""
+        self.failures += 1
+        if result is not None and result.get("error_code") == 429:
+            return _retry_after(result)
+        delay = min(self.max_delay, self.base_delay * 2 ** (self.failures - 1))
+        # Jitter: bir nechta replika bir vaqtda qayta urinmasin
+        return delay * (0.5 + random.random() / 2)
+
+
+def _worker_db_path(path, index):
+    """Har bir worker jarayoni uchun alohida lokal baza: bot_local.db -> bot_local.w0.db"""
+    root, ext = os.path.splitext(path)
+    return f"{root}.w{index}{ext}"
+
+
+def _create_api():
+    return EventLoopTelegramAPI(Config.TOKEN) if Config.ASYNC_API else TelegramAPI(Config.TOKEN)
+
+
+def _create_components(local_db_path, migrate=True):
+    """TelegramAPI, LocalStore, FirestoreDB (umumiy state ombori bilan) va BotLogic"""
+    api = _create_api()
+    local_store = LocalStore(local_db_path) if local_db_path else None
+    db = FirestoreDB(local_store=local_store, background_init=True, migrate=migrate)
+    shared_state = make_state_backend(Config.STATE_BACKEND, db)
+    if shared_state is not None:
+        db.use_shared_state(shared_state)
+    return api, local_store, db, shared_state, BotLogic(api, db)
+
+
+def _close_components(api, local_store, db, shared_state, bot):
+    # Vaqti kelgan outbox ishlarini tugatish (qolganlari lokal bazada keyingi safar bajariladi)
+    bot.outbox.close()
+    # Navbatdagi state/til yozuvlarini Firestore'ga yuborish
+    db.close()
+    if local_store:
+        local_store.close()
+    if shared_state is not None:
+        shared_state.close()
+    # Limit navbatidagi xabarlarni yuborib bo'lish
+    api.close()
+
+
+def _create_dispatcher(bot, max_pending=None, name="dispatcher"):
+    return ChatDispatcher(bot.handle_update, max_workers=Config.WORKERS, name=name,
+                          max_pending=Config.QUEUE_SIZE if max_pending is None else max_pending,
+                          priority=bot.update_priority, on_shed=bot.answer_fast)
+
+
+def _start_hr_outbox_sweeper(bot, stop_event):
+    """hr_outbox'da yuborilmay qolgan HR xabarlarini davriy qayta navbatga qo'yuvchi thread"""
+    if Config.HR_OUTBOX_SWEEP_SEC <= 0:
+        return None
+
+    def hr_outbox_sweeper():
+        while not stop_event.wait(Config.HR_OUTBOX_SWEEP_SEC):
+            try:
+                bot.sweep_hr_outbox()
+            except Exception as e:
+                logger.error(f"hr_outbox sweep xatosi: {e}")
+
+    thread = threading.Thread(target=hr_outbox_sweeper, name="hr-outbox-sweeper", daemon=True)
+    thread.start()
+    return thread
+
+
+def _worker_process_main(index, updates, max_pending):
+    """Worker jarayoni: o'z navbatidagi update'larni o'z BotLogic'i bilan qayta ishlaydi"""
+    # To'xtatishni asosiy jarayon boshqaradi: navbat oxiriga None qo'yiladi
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_IGN)
+    local_db_path = _worker_db_path(Config.LOCAL_DB_PATH, index) if Config.LOCAL_DB_PATH else None
+    # Migratsiyalar faqat 0-worker'da (qolganlari bir xil hujjatlarni qayta ishlamasin)
+    components = _create_components(local_db_path, migrate=index == 0)
+    # Jarayon ichidagi navbat ham chegaralangan: to'lsa submit() kutadi va navbatdan olinmaydi
+    dispatcher = _create_dispatcher(components[-1], max_pending=max_pending, name=f"worker-{index}")
+    parent = multiprocessing.parent_process()
+    stop_sweeper = threading.Event()
+    if index == 0:
+        # Sweeper HR xabarlari yuboriladigan va yetkazilgani yoziladigan jarayonda ishlaydi
+        _start_hr_outbox_sweeper(components[-1], stop_sweeper)
+    logger.info(f"Worker jarayoni {index} ishga tushdi (pid {os.getpid()})")
+    try:
+        while True:
+            try:
+                update = updates.get(timeout=1)
+            except queue.Empty:
+                if parent is not None and not parent.is_alive():
+                    logger.error(f"Worker {index}: asosiy jarayon to'xtagan, chiqilmoqda")
+                    break
+                continue
+            if update is None:
+                break
+            dispatcher.submit(update)
+    finally:
+        stop_sweeper.set()
+        dispatcher.shutdown(wait=True)
+        _close_components(*components)
+        logger.info(f"Worker jarayoni {index} yakunlandi")
+
+
+class ProcessDispatcher:
+    """Update'larni chat_id xeshi bo'yicha worker jarayonlariga taqsimlash (BOT_WORKER_PROCESSES).
+
+    Har jarayonda o'z TelegramAPI, FirestoreDB va ChatDispatcher'i bor; bitta chat doim
+    bitta jarayonga tushadi (tartib saqlanadi). Jarayon navbati to'lsa submit() kutadi va
+    polling to'xtab turadi (backpressure). shutdown() navbatdagi hamma update'lar
+    ishlanishini kutadi. ChatDispatcher bilan bir xil submit/stats/shutdown interfeysi.
+
+    Ack yo'q: jarayon kutilmaganda to'xtasa, u navbatdan olib o'z ChatDispatcher'iga
+    qo'ygan (hali ishlanmagan) update'lar yo'qoladi - getUpdates offset'i ulardan o'tib
+    bo'lgan. HR xabarlari bundan himoyalangan (lokal outbox va Firestore hr_outbox).
+    """
+    check_interval = 5
+
+    def __init__(self, processes, queue_size=1000, name="workers"):
+        self.processes = processes
+        self.queue_size = queue_size
+        # spawn: asosiy jarayondagi thread'lar (health server, flusher) fork bilan buzilmaydi
+        self._ctx = multiprocessing.get_context("spawn")
+        self._queues = [self._ctx.Queue(maxsize=queue_size) for _ in range(processes)]
+        self._procs = [None] * processes
+        self._lock = threading.Lock()
+        self._closed = False
+        self._submitted = [0] * processes
+        self._blocked = 0
+        self._blocked_seconds = 0.0
+        self._restarts = 0
+        self._checked_at = time.monotonic()
+
+        for index in range(processes):
+            self._start(index)
+            METRICS.gauge("bot_worker_queue_depth", "Updates waiting in a worker process queue",
+                          lambda index=index: self._queues[index].qsize(), dispatcher=name, worker=str(index))
+        METRICS.gauge("bot_worker_blocked_seconds_total", "Seconds the fetcher waited on full worker queues",
+                      lambda: self._blocked_seconds, "counter", dispatcher=name)
+
+    def _start(self, index):
+        proc = self._ctx.Process(target=_worker_process_main, args=(index, self._queues[index], self.queue_size),
+                                 name=f"bot-worker-{index}")
+        proc.start()
+        self._procs[index] = proc
+
+    def _check_workers(self):
+        """Kutilmaganda to'xtagan jarayonni qayta ishga tushirish.
+
+        multiprocessing navbatida qolgan update'larni yangi jarayon oladi; eski jarayon
+        navbatdan olib ulgurgan, lekin ishlamagan update'lar qayta yuborilmaydi.
+        """
+        self._checked_at = time.monotonic()
+        with self._lock:
+            if self._closed:
+                return
+            for index, proc in enumerate(self._procs):
+                if not proc.is_alive():
+                    logger.error(f"Worker jarayoni {index} to'xtagan (exitcode {proc.exitcode}), qayta ishga tushirilmoqda")
+                    self._restarts += 1
+                    self._start(index)
+
+    def submit(self, update, block=True):
+        if self._closed:
+            logger.warning("Dispatcher to'xtatilgan, update qabul qilinmadi")
+            return False
+        index = chat_partition(update, self.processes)
+        updates = self._queues[index]
+        try:
+            updates.put_nowait(update)
+        except queue.Full:
+            if not block:
+                return False
+            # Backpressure: worker navbati bo'shaguncha fetcher kutadi
+            started = time.monotonic()
+            while True:
+                try:
+                    updates.put(update, timeout=1)
+                    break
+                except queue.Full:
+                    self._check_workers()
+            waited = time.monotonic() - started
+            if waited >= 1:
+                logger.warning(f"Worker {index} navbati to'la ({self.queue_size}), polling {waited:.1f}s kutdi")
+            with self._lock:
+                self._blocked += 1
+                self._blocked_seconds += waited
+        with self._lock:
+            self._submitted[index] += 1
+        if time.monotonic() - self._checked_at >= self.check_interval:
+            self._check_workers()
+        return True
+
+    def submit_many(self, updates):
+        for update in updates:
+            if not self.submit(update):
+                return False
+        return True
+
+    def saturation(self):
+        """Eng to'la worker navbatining ulushi (0..1)"""
+        return min(1.0, max(q.qsize() for q in self._queues) / self.queue_size)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "processes": self.processes,
+                "queue_size": self.queue_size,
+                "saturation": round(self.saturation(), 3),
+                "queue_depth": [q.qsize() for q in self._queues],
+                "alive": sum(1 for proc in self._procs if proc.is_alive()),
+                "submitted": list(self._submitted),
+                "blocked": self._blocked,
+                "blocked_seconds": round(self._blocked_seconds, 3),
+                "restarts": self._restarts,
+            }
+
+    def shutdown(self, wait=True, timeout=60):
+        """Har jarayon navbati oxiriga to'xtash belgisi; wait=True bo'lsa hammasi ishlanguncha kutish"""
+        with self._lock:
+            self._closed = True
+        for index, updates in enumerate(self._queues):
+            try:
+                updates.put(None, timeout=timeout)
+            except queue.Full:
+                logger.error(f"Worker {index} navbati bo'shamadi, jarayon to'xtatiladi")
+                self._procs[index].terminate()
+        if not wait:
+            return
+        deadline = time.monotonic() + timeout
+        for index, proc in enumerate(self._procs):
+            proc.join(max(0.1, deadline - time.monotonic()))
+            if proc.is_alive():
+                logger.error(f"Worker jarayoni {index} {timeout}s ichida yakunlanmadi, to'xtatilmoqda")
+                proc.terminate()
+                proc.join(5)
+
 
 def run_polling():
     if not Config.validate():
         sys.exit(1)
 
+    if Config.WORKER_PROCESSES > 0:
+        # Bitta fetcher, update'lar chat_id bo'yicha worker jarayonlariga (GIL cheklovisiz).
+        # Asosiy jarayonda faqat TelegramAPI: Firestore, outbox, migratsiyalar va hr_outbox
+        # sweeper worker'larda (migratsiya va sweeper - 0-worker'da)
+        components = None
+        api, bot = _create_api(), None
+        if Config.WORKER_PROCESSES > 1 and Config.STATE_BACKEND in ("", "memory"):
+            logger.warning("Bir nechta worker jarayoni umumiy STATE_BACKEND'siz ishlamoqda: "
+                           "admin state'i (HR chat va shaxsiy chat) jarayonlar orasida mos kelmasligi mumkin")
+        dispatcher = ProcessDispatcher(Config.WORKER_PROCESSES, queue_size=Config.WORKER_QUEUE_SIZE)
+        logger.info(f"{Config.WORKER_PROCESSES} ta worker jarayoni ishga tushirildi")
+    else:
+        components = _create_components(Config.LOCAL_DB_PATH)
+        api, local_store, db, shared_state, bot = components
+        if shared_state is not None:
+            logger.info(f"Umumiy state ombori: {Config.STATE_BACKEND.split('@')[-1]}")
+        # Update'lar chat_id bo'yicha tartiblanib, worker'lar orasida parallel ishlanadi
+        dispatcher = _create_dispatcher(bot)
+
+    capture = None
+    if Config.CAPTURE_DIR:
+        capture = UpdateCapture(Config.CAPTURE_DIR, max_bytes=int(Config.CAPTURE_MAX_MB * 1024 * 1024),
+                                max_files=Config.CAPTURE_MAX_FILES)
+        logger.info(f"Update capture yoqilgan: {Config.CAPTURE_DIR}")
+
     # Health check serverini alohida thread'da ishga tushirish
-    health_thread = threading.Thread(target=run_health_check, daemon=True)
+    # (webhook rejimida update'lar ham shu server orqali keladi)
+    health_thread = threading.Thread(target=run_health_check, args=(dispatcher, capture), daemon=True)
     health_thread.start()
     logger.info("Health check serveri ishga tushdi.")
 
-    api = TelegramAPI(Config.TOKEN)
-    db = FirestoreDB()
-    bot = BotLogic(api, db)
-
     offset = 0
-    logger.info("Bot ishga tushdi. Yangilanishlar kutilmoqda (polling)...")
 
-    # Webhookni o'chirish (polling rejimida ishlash uchun)
-    api.call("deleteWebhook", {"drop_pending_updates": True})
-
-    # Bot komandalarini o'rnatish
-    commands = [
-        {"command": "start", "description": "Botni ishga tushirish"},
-        {"command": "menu", "description": "Asosiy menyu"},
-        {"command": "stop", "description": "Botni to'xtatish"},
-        {"command": "admin", "description": "Admin panel (faqat adminlar)"}
-    ]
-    result = api.call("setMyCommands", {"commands": commands})
-    if result.get("ok"):
-        logger.info("Bot komandalari o'rnatildi")
-    else:
-        logger.warning(f"Bot komandalari o'rnatilmadi: {result.get('description')}")
-
-    # Bot description va short description o'rnatish
-    description = (
-        "🏫 Al-Xorazmiy xususiy maktabiga xush kelibsiz!\n\n"
-        "✨ Bu bot orqali:\n"
-        "📚 Maktab haqida ma'lumot\n"
-        "📍 Manzil va aloqa\n"
-        "💼 Bo'sh ish o'rinlariga ariza topshirish\n\n"
-        "🌍 4 tilda xizmat\n\n"
-        "START bosing va tilni tanlang! 👇"
-    )
-
-    short_description = (
-        "Al-Xorazmiy maktabi ishga qabul boti. "
-        "Ma'lumot va ariza topshirish."
-    )
-
-    api.call("setMyDescription", {"description": description})
-    api.call("setMyShortDescription", {"description": short_description})
-    logger.info("Bot description o'rnatildi")
-
-    # Bot profil rasmini o'rnatish (logo)
-    import os
-    logo_files = ["logo.png", "logo.jpg", "logo.jpeg", "school_logo.png", "school_logo.jpg"]
-    logo_path = None
-
-    for logo_file in logo_files:
-        if os.path.exists(logo_file):
-            logo_path = logo_file
-            break
+    # Webhook, komandalar, description va logo - faqat o'zgarganlari, fon rejimida parallel
+    setup_bot_profile(api)
+    poller = AdaptivePoller(max_limit=Config.POLL_LIMIT, idle_timeout=Config.POLL_TIMEOUT)
 
-    if logo_path:
-        try:
-            with open(logo_path, "rb") as photo:
-                files = {"photo": photo}
-                result = api.call("setMyProfilePhoto", files=files)
-                if result.get("ok"):
-                    logger.info(f"Bot profil rasmi o'rnatildi: {logo_path}")
-                else:
-                    logger.warning(f"Bot profil rasmi o'rnatilmadi: {result.get('description')}")
-        except Exception as e:
-            logger.error(f"Bot profil rasmini o'rnatishda xatolik: {e}")
+    if Config.BOT_MODE == "webhook":
+        logger.info(f"Bot ishga tushdi. Update'lar webhook orqali qabul qilinadi: {Config.WEBHOOK_URL}")
     else:
-        logger.info("Logo fayli topilmadi. Bot profil rasmini o'rnatish uchun logo.png yoki logo.jpg faylini qo'shing.")
+        logger.info("Bot ishga tushdi. Yangilanishlar kutilmoqda (polling)...")
 
-    # Kichik botlar uchun 5 worker yetarli
-    executor = ThreadPoolExecutor(max_workers=5)
-    retry_count = 0
     shutdown_flag = threading.Event()
 
+    # offset oxirgi marta qachon siljigani (polling to'xtab qolganini ko'rish uchun)
+    poll_state = {"offset_at": time.monotonic()}
+    if Config.BOT_MODE == "polling":
+        METRICS.gauge("bot_poll_offset", "Current getUpdates offset", lambda: offset)
+        METRICS.gauge("bot_poll_offset_age_seconds", "Seconds since the getUpdates offset last advanced",
+                      lambda: time.monotonic() - poll_state["offset_at"])
+        METRICS.gauge("bot_poll_update_rate", "Smoothed incoming update rate (updates/s)", lambda: poller.rate)
+        METRICS.gauge("bot_poll_limit", "Current getUpdates limit", lambda: poller.limit)
+        METRICS.gauge("bot_poll_timeout_seconds", "Current getUpdates long-poll timeout", lambda: poller.timeout)
+
     # Graceful shutdown handler
     def shutdown_handler(signum, frame):
+        # Worker'lar va Firestore write-behind navbati finally blokida to'liq yakunlanadi
         logger.info("To'xtatish signali qabul qilindi, bot to'xtatilmoqda...")
         shutdown_flag.set()
 
     signal.signal(signal.SIGINT, shutdown_handler)
     signal.signal(signal.SIGTERM, shutdown_handler)
 
+    if bot is not None:
+        # Worker rejimida sweeper 0-worker jarayonida ishlaydi (yetkazilganlar o'sha lokal bazada)
+        _start_hr_outbox_sweeper(bot, shutdown_flag)
+
     try:
-        while not shutdown_flag.is_set():
+        if Config.BOT_MODE == "webhook":
+            # Update'lar Flask webhook orqali keladi, asosiy thread faqat signalni kutadi
+            while not shutdown_flag.wait(1):
+                pass
+
+        while Config.BOT_MODE == "polling" and not shutdown_flag.is_set():
             try:
-                result = api.call("getUpdates", {"timeout": 30, "offset": offset})
+                result = api.call("getUpdates", poller.params(offset))
 
                 if not result.get("ok"):
                     error_code = result.get("error_code")
@@ -1552,36 +4982,46 @@ def run_polling():
                     if error_code == 409: # Conflict
                         logger.warning("Conflict aniqlandi, webhook o'chirilmoqda...")
                         api.call("deleteWebhook", {"drop_pending_updates": True})
-                        time.sleep(2)
                     elif error_code == 401: # Unauthorized
                         logger.error("TOKEN noto'g'ri!")
                         break
                     else:
                         logger.error(f"Polling xatosi: {description}")
-                        time.sleep(2)
+                    shutdown_flag.wait(poller.failed(result))
                     continue
 
                 updates = result.get("result") or []
+                poller.record(len(updates))
+                GET_UPDATES_BATCH.observe(len(updates))
+                if capture is not None and updates:
+                    raw = result.get("raw")
+                    capture.write_batch(raw if raw is not None else _json_encode({"ok": True, "result": updates}))
+                if updates:
+                    poll_state["offset_at"] = time.monotonic()
                 for upd in updates:
                     update_id = upd.get("update_id")
                     if isinstance(update_id, int):
                         offset = update_id + 1
 
-                    # Update'ni alohida thread'da qayta ishlash
-                    executor.submit(bot.handle_update, upd)
-
-                retry_count = 0
+                # Butun batch bir vaqtda chat navbatlariga
+                if updates:
+                    dispatcher.submit_many(updates)
             except requests.exceptions.ConnectionError:
-                retry_count += 1
-                wait_time = min(retry_count * 2, 30)
-                logger.warning(f"Internet aloqasi yo'q. {wait_time} soniyadan keyin qayta uriniladi...")
-                time.sleep(wait_time)
+                wait_time = poller.failed()
+                logger.warning(f"Internet aloqasi yo'q. {wait_time:.1f} soniyadan keyin qayta uriniladi...")
+                shutdown_flag.wait(wait_time)
             except Exception as e:
                 logger.exception(f"Kutilmagan xatolik: {e}")
-                time.sleep(2)
+                shutdown_flag.wait(poller.failed())
     finally:
         logger.info("Bot to'xtatilmoqda, barcha threadlar yakunlanmoqda...")
-        executor.shutdown(wait=True, cancel_futures=False)
+        dispatcher.shutdown(wait=True)
+        if components is not None:
+            _close_components(*components)
+        else:
+            api.close()
+        if capture is not None:
+            capture.close()
         logger.info("Barcha threadlar yakunlandi.")
 
 if __name__ == "__main__":
@@ -0,0 +1,109 @@
+"""ShardedTTLCache: TTL, eviction, sweep va parallel foydalanish.
+
+    python -m pytest tests/
+"""
+import os
+import sys
+import threading
+import unittest
+from unittest import mock
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import telegram_bot as tb  # noqa: E402
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+class ShardedTTLCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.clock = Clock()
+        patcher = mock.patch.object(tb, "_monotonic", self.clock)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_get_set_and_stored_none(self):
+        cache = tb.ShardedTTLCache(max_size=10, ttl_seconds=60)
+        cache.set("a", 1)
+        cache.set("none", None)
+        self.assertEqual(cache.get("a"), 1)
+        self.assertIsNone(cache.get("none", tb._MISSING))
+        self.assertIs(cache.get("missing", tb._MISSING), tb._MISSING)
+        cache.delete("a")
+        self.assertIsNone(cache.get("a"))
+        self.assertEqual((cache.hits, cache.misses), (2, 2))
+
+    def test_entries_expire_after_ttl(self):
+        cache = tb.ShardedTTLCache(max_size=10, ttl_seconds=60)
+        cache.set("a", 1)
+        self.clock.now += 59
+        self.assertEqual(cache.get("a"), 1)
+        self.clock.now += 2
+        self.assertIs(cache.get("a", tb._MISSING), tb._MISSING)
+        self.assertEqual(len(cache), 0)
+
+    def test_full_shard_evicts_oldest_write(self):
+        cache = tb.ShardedTTLCache(max_size=3, ttl_seconds=60, shards=1)
+        for key in "abc":
+            cache.set(key, key)
+        # Qayta yozish joy talab qilmaydi va yozuvni eng yangisiga aylantiradi
+        cache.set("a", "a2")
+        cache.set("d", "d")
+        self.assertEqual(len(cache), 3)
+        self.assertIsNone(cache.get("b"))
+        self.assertEqual([cache.get(k) for k in "acd"], ["a2", "c", "d"])
+
+    def test_eviction_drops_expired_entries_first(self):
+        cache = tb.ShardedTTLCache(max_size=3, ttl_seconds=10, shards=1)
+        cache.set("a", 1)
+        cache.set("b", 2)
+        self.clock.now += 5
+        cache.set("c", 3)
+        self.clock.now += 6
+        cache.set("d", 4)
+        # a va b muddati o'tgan - ikkalasi chiqadi, c qoladi
+        self.assertEqual(len(cache), 2)
+        self.assertEqual((cache.get("c"), cache.get("d")), (3, 4))
+
+    def test_sweep_removes_only_expired(self):
+        cache = tb.ShardedTTLCache(max_size=100, ttl_seconds=10)
+        for i in range(20):
+            cache.set(i, i)
+        self.clock.now += 5
+        for i in range(20, 30):
+            cache.set(i, i)
+        self.clock.now += 6
+        self.assertEqual(cache.sweep(), 20)
+        self.assertEqual(len(cache), 10)
+        self.assertEqual(cache.sweep(), 0)
+
+    def test_shard_count_is_power_of_two_within_size(self):
+        self.assertEqual(len(tb.ShardedTTLCache(max_size=5, shards=16)._shards), 4)
+        self.assertEqual(len(tb.ShardedTTLCache(max_size=1000, shards=10)._shards), 8)
+
+    def test_concurrent_use_stays_bounded(self):
+        cache = tb.ShardedTTLCache(max_size=64, ttl_seconds=60)
+
+        def worker(offset):
+            for i in range(2000):
+                cache.set((offset, i % 100), i)
+                cache.get((offset, (i * 7) % 100))
+
+        threads = [threading.Thread(target=worker, args=(n,)) for n in range(8)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        shards = len(cache._shards)
+        self.assertLessEqual(len(cache), shards * -(-64 // shards))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,253 @@
+"""ChatDispatcher: chat bo'yicha FIFO tartib, parallellik va to'lganda chetlatish.
+
+    python -m pytest tests/
+"""
+import os
+import random
+import sys
+import threading
+import time
+import unittest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, "tools"))
+sys.path.insert(0, ROOT)
+
+import fake_firestore  # noqa: E402
+import telegram_bot as tb  # noqa: E402
+from fake_telegram import FakeTelegram  # noqa: E402
+
+
+def message(chat_id, seq, text="x"):
+    return {"update_id": seq, "message": {"message_id": seq, "chat": {"id": chat_id}, "from": {"id": chat_id},
+                                          "text": text}}
+
+
+def wait_for(predicate, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if predicate():
+            return True
+        time.sleep(0.01)
+    return bool(predicate())
+
+
+def observed(histogram, **labels):
+    """Histogram seriyasidagi kuzatuvlar soni"""
+    series = histogram._series.get(tuple(sorted(labels.items())))
+    return series[-1] if series else 0
+
+
+class Recorder:
+    """Handler: (chat_id, update_id) tartibini va bir chatda parallel ishlash bor-yo'qligini yozadi"""
+
+    def __init__(self, delay=0.0):
+        self.delay = delay
+        self.calls = []
+        self.active = {}
+        self.overlap = False
+        self.lock = threading.Lock()
+
+    def __call__(self, update):
+        chat = tb.ChatDispatcher.chat_key(update)
+        with self.lock:
+            if self.active.get(chat):
+                self.overlap = True
+            self.active[chat] = True
+        if self.delay:
+            time.sleep(random.random() * self.delay)
+        with self.lock:
+            self.active[chat] = False
+            self.calls.append((chat, update["update_id"]))
+
+    def per_chat(self):
+        order = {}
+        for chat, seq in self.calls:
+            order.setdefault(chat, []).append(seq)
+        return order
+
+
+class ChatOrderingTest(unittest.TestCase):
+    def make(self, handler, **kwargs):
+        dispatcher = tb.ChatDispatcher(handler, name=f"test-{id(self)}", **kwargs)
+        self.addCleanup(dispatcher.shutdown, False)
+        return dispatcher
+
+    def test_updates_of_one_chat_run_in_order_and_never_overlap(self):
+        recorder = Recorder(delay=0.002)
+        dispatcher = self.make(recorder, max_workers=8)
+        updates = [message(chat, seq) for seq in range(200) for chat in [seq % 10]]
+        dispatcher.submit_many(updates)
+        dispatcher.shutdown(wait=True)
+        self.assertFalse(recorder.overlap)
+        self.assertEqual(len(recorder.calls), 200)
+        for chat, seqs in recorder.per_chat().items():
+            self.assertEqual(seqs, sorted(seqs), chat)
+
+    def test_slow_chat_does_not_block_other_chats(self):
+        release = threading.Event()
+        done = []
+
+        def handler(update):
+            if update["message"]["chat"]["id"] == 1:
+                release.wait(5)
+            done.append(update["update_id"])
+
+        dispatcher = self.make(handler, max_workers=2)
+        dispatcher.submit(message(1, 1))
+        for seq in range(2, 12):
+            dispatcher.submit(message(2, seq))
+        deadline = time.monotonic() + 5
+        while len(done) < 10 and time.monotonic() < deadline:
+            time.sleep(0.01)
+        self.assertEqual(done, list(range(2, 12)))
+        release.set()
+        dispatcher.shutdown(wait=True)
+        self.assertEqual(done[-1], 1)
+
+    def test_failing_update_does_not_stop_its_chat(self):
+        recorder = Recorder()
+
+        def handler(update):
+            if update["update_id"] == 2:
+                raise RuntimeError("boom")
+            recorder(update)
+
+        dispatcher = self.make(handler, max_workers=2)
+        dispatcher.submit_many([message(7, seq) for seq in range(1, 5)])
+        dispatcher.shutdown(wait=True)
+        self.assertEqual(recorder.per_chat(), {7: [1, 3, 4]})
+        stats = dispatcher.stats()
+        self.assertEqual((stats["completed"], stats["failed"], stats["queue_depth"]), (4, 1, 0))
+
+    def test_chat_key(self):
+        self.assertEqual(tb.ChatDispatcher.chat_key(message(5, 1)), 5)
+        callback = {"update_id": 1, "callback_query": {"from": {"id": 9}, "message": {"chat": {"id": -100}}}}
+        self.assertEqual(tb.ChatDispatcher.chat_key(callback), -100)
+        self.assertEqual(tb.ChatDispatcher.chat_key({"update_id": 1, "callback_query": {"from": {"id": 9}}}), 9)
+        self.assertIsNone(tb.ChatDispatcher.chat_key({"update_id": 1, "poll": {}}))
+
+    def test_shutdown_rejects_new_updates(self):
+        dispatcher = self.make(Recorder(), max_workers=1)
+        dispatcher.shutdown(wait=True)
+        self.assertFalse(dispatcher.submit(message(1, 1)))
+
+
+class SheddingTest(unittest.TestCase):
+    """max_pending=1 va bitta worker: chat 0 ning birinchi update'i gate ochilguncha worker'ni band qiladi"""
+
+    def setUp(self):
+        self.gate = threading.Event()
+        self.handled = []
+        self.shed = []
+        self.answer = True
+
+    def handler(self, update):
+        if update["update_id"] == 1:
+            self.gate.wait(5)
+        self.handled.append((tb.ChatDispatcher.chat_key(update), update["update_id"]))
+
+    def on_shed(self, update):
+        self.shed.append(update["update_id"])
+        if isinstance(self.answer, Exception):
+            raise self.answer
+        if isinstance(self.answer, threading.Event):
+            self.answer.wait(5)
+            return False
+        return self.answer
+
+    def make_full(self):
+        """Worker band, navbat to'la dispatcher"""
+        dispatcher = tb.ChatDispatcher(self.handler, max_workers=1, max_pending=1, name=f"shed-{id(self)}",
+                                       priority=lambda u: "low" if u["message"]["text"] == "low" else "normal",
+                                       on_shed=self.on_shed)
+        self.addCleanup(dispatcher.shutdown, False)
+        self.addCleanup(self.gate.set)
+        dispatcher.submit(message(0, 1))
+        self.assertTrue(wait_for(lambda: dispatcher.stats()["active"] == 1))
+        dispatcher.submit(message(0, 2))
+        self.assertEqual(dispatcher.saturation(), 1.0)
+        return dispatcher
+
+    def test_low_priority_update_is_answered_without_queueing(self):
+        dispatcher = self.make_full()
+        before = observed(tb.HANDLE_UPDATE_SECONDS, kind="message")
+        self.assertTrue(dispatcher.submit(message(5, 3, "low"), block=False))
+        self.assertTrue(wait_for(lambda: dispatcher.stats()["shed_answered"] == 1))
+        self.assertEqual(self.shed, [3])
+        # Tez javob ham odatdagi handler metrikasiga tushadi
+        self.assertEqual(observed(tb.HANDLE_UPDATE_SECONDS, kind="message"), before + 1)
+        self.gate.set()
+        dispatcher.shutdown(wait=True)
+        self.assertEqual(self.handled, [(0, 1), (0, 2)])
+
+    def test_busy_chat_is_not_shed(self):
+        dispatcher = self.make_full()
+        # Chat 0 da navbatdagi update bor: chetlatish tartibni buzardi
+        self.assertFalse(dispatcher.submit(message(0, 3, "low"), block=False))
+        self.assertFalse(dispatcher.submit(message(6, 4, "normal"), block=False))
+        self.assertEqual(dispatcher.stats()["rejected"], 2)
+        self.assertEqual(self.shed, [])
+
+    def test_unanswered_update_is_requeued_before_later_updates_of_its_chat(self):
+        self.answer = threading.Event()
+        dispatcher = self.make_full()
+        self.assertTrue(dispatcher.submit(message(5, 3, "low")))
+        self.assertTrue(wait_for(lambda: self.shed == [3]))
+        self.gate.set()
+        # Joy bo'shagach chat 5 ning keyingi update'i navbatga kiradi, lekin chetlatilgan javobini kutadi
+        dispatcher.submit(message(5, 4))
+        self.assertTrue(wait_for(lambda: len(self.handled) == 2))
+        time.sleep(0.05)
+        self.assertNotIn((5, 4), self.handled)
+        self.answer.set()
+        dispatcher.shutdown(wait=True)
+        self.assertEqual(self.handled, [(0, 1), (0, 2), (5, 3), (5, 4)])
+        stats = dispatcher.stats()
+        self.assertEqual((stats["shed_answered"], stats["shed_requeued"], stats["chats"]), (0, 1, 0))
+
+    def test_failing_shed_answer_falls_back_to_handler(self):
+        self.answer = RuntimeError("boom")
+        dispatcher = self.make_full()
+        dispatcher.submit(message(5, 3, "low"))
+        self.gate.set()
+        dispatcher.shutdown(wait=True)
+        self.assertEqual(sorted(self.handled), [(0, 1), (0, 2), (5, 3)])
+        self.assertEqual(dispatcher.stats()["shed_requeued"], 1)
+
+
+class FastAnswerTest(unittest.TestCase):
+    """BotLogic.answer_fast: keshdagi til bilan statik javob, handle_update bilan bir xil trace"""
+
+    def setUp(self):
+        self.fake = FakeTelegram().start()
+        self.addCleanup(self.fake.stop)
+        api = tb.TelegramAPI("x", api_base_url=self.fake.base_url,
+                             rate_limiter=tb.TelegramRateLimiter(1e9, 1e9, 10**6, 1e9, 10**6))
+        self.addCleanup(api.close)
+        self.db = tb.FirestoreDB(client=fake_firestore.FakeFirestore(), fs_module=fake_firestore, migrate=False)
+        self.addCleanup(self.db.close)
+        self.bot = tb.BotLogic(api, self.db)
+
+    def test_static_answer_is_traced(self):
+        self.db.set_user_lang(7, "uz")
+        self.db.set_user_state(7, None)
+        update = message(7, 1, "🏫 Biz haqimizda")
+        self.assertEqual(self.bot.update_priority(update), "low")
+        traced = tb.TRACER.stats()["traced"]
+        self.assertTrue(self.bot.answer_fast(update))
+        self.assertEqual(tb.TRACER.stats()["traced"], traced + 1)
+        self.assertEqual(len(self.fake.calls_for("sendMessage")), 1)
+
+    def test_unknown_lang_is_not_answered(self):
+        self.assertFalse(self.bot.answer_fast(message(8, 1, "🏫 Biz haqimizda")))
+        self.assertEqual(self.fake.calls_for("sendMessage"), [])
+
+    def test_back_button_goes_through_handler(self):
+        # "Orqaga" matni admin_back'ga tushadi: statik javob emas
+        self.db.set_user_lang(7, "uz")
+        self.assertEqual(self.bot.update_priority(message(7, 1, "⬅️ Orqaga")), "normal")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,185 @@
+"""FirestoreDB: cache'lar, write-behind navbati va pagination (tools/fake_firestore.py bilan).
+
+    python -m pytest tests/
+"""
+import os
+import sys
+import time
+import unittest
+from unittest import mock
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, "tools"))
+sys.path.insert(0, ROOT)
+
+import fake_firestore  # noqa: E402
+import telegram_bot as tb  # noqa: E402
+
+
+class FirestoreCase(unittest.TestCase):
+    def setUp(self):
+        self.client = fake_firestore.FakeFirestore()
+        self.db = self.make_db()
+
+    def make_db(self, local_store=None):
+        db = tb.FirestoreDB(local_store=local_store, client=self.client, fs_module=fake_firestore, migrate=False)
+        self.addCleanup(db.close)
+        return db
+
+    def reads(self):
+        return self.client.stats()["reads"]
+
+
+class NegativeCacheTest(FirestoreCase):
+    def test_unknown_lang_is_cached_as_miss(self):
+        self.assertEqual(self.db.get_user_lang(1), "uz")
+        # Keshda "uz" emas, "til tanlanmagan" belgisi
+        self.assertIsNone(self.db.cached_user_lang(1))
+        reads = self.reads()
+        self.assertEqual(self.db.get_user_lang(1), "uz")
+        self.assertEqual(self.reads(), reads)
+
+    def test_stored_lang_differs_from_miss(self):
+        self.assertIs(self.db.cached_user_lang(1), tb._MISSING)
+        self.db.set_user_lang(1, "uz")
+        self.assertEqual(self.db.cached_user_lang(1), "uz")
+        self.db.set_user_lang(2, "ru")
+        self.db.flush()
+        other = self.make_db()
+        self.assertEqual(other.get_user_lang(2), "ru")
+        self.assertEqual(other.cached_user_lang(2), "ru")
+
+    def test_missing_state_is_cached(self):
+        self.assertIsNone(self.db.get_user_state(1))
+        self.assertIsNone(self.db.cached_user_state(1))
+        reads = self.reads()
+        self.assertIsNone(self.db.get_user_state(1))
+        self.assertEqual(self.reads(), reads)
+        self.assertIs(self.db.cached_user_state(2), tb._MISSING)
+
+    def test_new_lang_replaces_cached_miss(self):
+        self.db.get_user_lang(1)
+        self.db.set_user_lang(1, "en")
+        self.assertEqual(self.db.get_user_lang(1), "en")
+
+
+class WriteBehindTest(FirestoreCase):
+    def setUp(self):
+        # Flusher o'z-o'zidan ishga tushmasin: flush faqat test chaqirganda
+        patcher = mock.patch.multiple(tb.Config, DB_FLUSH_INTERVAL_MS=60000, DB_FLUSH_MAX_ITEMS=10000)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        super().setUp()
+
+    def docs(self, collection):
+        return self.client.dump().get(collection, {})
+
+    def test_writes_to_one_doc_are_coalesced(self):
+        for i in range(50):
+            self.db.set_user_lang(i % 5, ("uz", "ru", "en")[i % 3])
+        self.assertEqual(self.client.stats()["writes"], 0)
+        self.assertTrue(self.db.flush())
+        stats = self.client.stats()
+        self.assertEqual((stats["commits"], stats["writes"]), (1, 5))
+        # Har bir hujjatda oxirgi yozuv
+        expected = {str(u): ("uz", "ru", "en")[(45 + u) % 3] for u in range(5)}
+        self.assertEqual({k: v["lang"] for k, v in self.docs("user_langs").items()}, expected)
+
+    def test_delete_replaces_queued_set(self):
+        self.db.set_user_state(1, {"step": "cv", "data": {}, "mode": "job"})
+        self.db.set_user_state(1, None)
+        self.db.flush()
+        self.assertEqual(self.client.stats()["writes"], 1)
+        self.assertNotIn("1", self.docs("user_states"))
+
+    def test_intermediate_steps_are_not_persisted(self):
+        self.db.set_user_state(1, {"step": "name", "data": {}, "mode": "job"})
+        self.db.flush()
+        self.assertEqual(self.client.stats()["writes"], 0)
+
+    def test_queued_write_is_read_back_before_flush(self):
+        state = {"step": None, "data": {}, "mode": "admin"}
+        self.db.set_user_state(1, state)
+        self.db._user_states.clear()
+        self.assertEqual(self.db.get_user_state(1), state)
+        self.assertEqual(self.reads(), 0)
+
+    def test_close_flushes_queue(self):
+        self.db.set_user_lang(1, "ru")
+        self.db.set_user_state(2, {"step": "cv", "data": {}, "mode": "job"})
+        self.db.close()
+        self.assertEqual(self.docs("user_langs"), {"1": {"lang": "ru"}})
+        self.assertEqual(self.docs("user_states")["2"]["step"], "cv")
+
+    def test_failed_commit_is_retried_without_overwriting_newer_write(self):
+        self.db.set_user_lang(1, "ru")
+        with mock.patch.object(fake_firestore.WriteBatch, "commit", side_effect=RuntimeError("unavailable")):
+            self.assertFalse(self.db.flush())
+        self.db.set_user_lang(1, "en")
+        self.db.set_user_lang(2, "uz")
+        self.assertTrue(self.db.flush())
+        self.assertEqual(self.docs("user_langs"), {"1": {"lang": "en"}, "2": {"lang": "uz"}})
+
+    def test_full_queue_wakes_flusher(self):
+        self.db._flush_max_items = 3
+        for user in range(3):
+            self.db.set_user_lang(user, "ru")
+        deadline = time.monotonic() + 5
+        while len(self.docs("user_langs")) < 3 and time.monotonic() < deadline:
+            time.sleep(0.01)
+        self.assertEqual(len(self.docs("user_langs")), 3)
+
+
+class PaginationTest(FirestoreCase):
+    def setUp(self):
+        super().setUp()
+        for i in range(25):
+            self.client.collection("applications").document(f"app{i:02d}").set({"timestamp": i, "position": "x"})
+
+    def walk(self, db, limit=10):
+        pages, cursor = [], None
+        while True:
+            page = db.get_recent_applications(limit=limit, start_after=cursor)
+            if not page:
+                return pages
+            pages.append([item["id"] for item in page])
+            cursor = page[-1]["id"]
+
+    def test_pages_cover_all_applications_newest_first(self):
+        reads = self.reads()
+        pages = self.walk(self.db)
+        self.assertEqual([len(p) for p in pages], [10, 10, 5])
+        self.assertEqual(sum(pages, []), [f"app{i:02d}" for i in range(24, -1, -1)])
+        # Cursor snapshot'lari cache'dan: faqat sahifa hujjatlari (+ bo'sh oxirgi so'rov) o'qiladi
+        self.assertEqual(self.reads() - reads, 25 + 1)
+
+    def test_deleted_anchor_from_cache_still_continues(self):
+        first = self.db.get_recent_applications(limit=10)
+        anchor = first[-1]["id"]
+        self.client.collection("applications").document(anchor).delete()
+        second = self.db.get_recent_applications(limit=10, start_after=anchor)
+        self.assertEqual([item["id"] for item in second], [f"app{i:02d}" for i in range(14, 4, -1)])
+
+    def test_deleted_anchor_without_snapshot_returns_empty_page(self):
+        self.client.collection("applications").document("app15").delete()
+        other = self.make_db()
+        self.assertEqual(other.get_recent_applications(limit=10, start_after="app15"), [])
+
+    def test_uncached_anchor_is_read_once(self):
+        other = self.make_db()
+        reads = self.reads()
+        page = other.get_recent_applications(limit=5, start_after="app10")
+        self.assertEqual([item["id"] for item in page], ["app09", "app08", "app07", "app06", "app05"])
+        self.assertEqual(self.reads() - reads, 1 + 5)
+
+    def test_equal_timestamps_are_not_skipped(self):
+        for i in range(25, 30):
+            self.client.collection("applications").document(f"app{i:02d}").set({"timestamp": 100, "position": "x"})
+        pages = self.walk(self.db, limit=3)
+        ids = sum(pages, [])
+        self.assertEqual(len(ids), 30)
+        self.assertEqual(len(set(ids)), 30)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,132 @@
+"""LocalStore state journal: oxirgi holat, restart'dan keyin replay va compaction.
+
+    python -m pytest tests/
+"""
+import os
+import sys
+import tempfile
+import unittest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, "tools"))
+sys.path.insert(0, ROOT)
+
+import fake_firestore  # noqa: E402
+import telegram_bot as tb  # noqa: E402
+
+
+def step(name):
+    return {"step": name, "data": {}, "mode": "job"}
+
+
+class JournalCase(unittest.TestCase):
+    def setUp(self):
+        self.store = self.open_store(":memory:")
+
+    def open_store(self, path, **kwargs):
+        store = tb.LocalStore(path, **kwargs)
+        self.addCleanup(store.close)
+        return store
+
+    def age(self, user_id, seconds, store=None):
+        """Foydalanuvchi yozuvlarini eskirtirish"""
+        (store or self.store).conn.execute(
+            "UPDATE state_journal SET ts = ts - ? WHERE user_id = ?", (seconds, str(user_id)))
+
+    def rows(self, store=None):
+        return (store or self.store).conn.execute("SELECT COUNT(*) FROM state_journal").fetchone()[0]
+
+
+class LatestStateTest(JournalCase):
+    def test_latest_record_wins(self):
+        self.assertEqual(self.store.latest_state(1), (False, None))
+        for name in ("name", "phone", "position"):
+            self.store.record_state(1, step(name))
+        self.assertEqual(self.store.latest_state(1), (True, step("position")))
+
+    def test_cleared_state_is_found(self):
+        # None ham javob: flow tugagan, Firestore'ga borish shart emas
+        self.store.record_state(1, step("name"))
+        self.store.record_state(1, None)
+        self.assertEqual(self.store.latest_state(1), (True, None))
+
+    def test_max_age(self):
+        self.store.record_state(1, step("name"))
+        self.age(1, 100)
+        self.assertEqual(self.store.latest_state(1, max_age=50), (False, None))
+        self.assertEqual(self.store.latest_state(1, max_age=500), (True, step("name")))
+
+
+class ReplayTest(JournalCase):
+    def test_replay_returns_latest_non_empty_state_per_user(self):
+        self.store.record_state(1, step("name"))
+        self.store.record_state(2, step("name"))
+        self.store.record_state(1, step("phone"))
+        self.store.record_state(3, step("exp"))
+        self.store.record_state(3, None)
+        # Eskidan yangiga: oxirgi yozuv tartibida
+        self.assertEqual(self.store.replay_states(), [("2", step("name")), ("1", step("phone"))])
+
+    def test_replay_skips_expired(self):
+        self.store.record_state(1, step("name"))
+        self.store.record_state(2, step("phone"))
+        self.age(1, 100)
+        self.assertEqual(self.store.replay_states(max_age=50), [("2", step("phone"))])
+
+    def test_restart_restores_cache(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        path = os.path.join(tmp.name, "local.db")
+        store = tb.LocalStore(path)
+        store.record_state(1, step("position"))
+        store.record_state(2, step("name"))
+        store.record_state(2, None)
+        store.close()
+
+        store = self.open_store(path)
+        db = tb.FirestoreDB(local_store=store, client=fake_firestore.FakeFirestore(), fs_module=fake_firestore,
+                            migrate=False)
+        self.addCleanup(db.close)
+        self.assertEqual(db.cached_user_state(1), step("position"))
+        self.assertIs(db.cached_user_state(2), tb._MISSING)
+        # Replay'ga kirmagan tugallangan flow journal'dan topiladi
+        self.assertIsNone(db.get_user_state(2))
+        self.assertEqual(db.db.stats()["reads"], 0)
+
+
+class CompactTest(JournalCase):
+    def test_compact_keeps_latest_record_per_user(self):
+        for user in range(3):
+            for name in ("name", "phone", "position"):
+                self.store.record_state(user, step(name))
+        self.store.compact()
+        self.assertEqual(self.rows(), 3)
+        self.assertEqual(self.store.replay_states(), [(str(u), step("position")) for u in range(3)])
+
+    def test_compact_with_max_age_keeps_recent_cleared_states(self):
+        self.store.record_state(1, step("name"))
+        self.store.record_state(1, None)
+        self.store.record_state(2, step("name"))
+        self.age(2, 100)
+        self.store.compact(max_age=50)
+        self.assertEqual(self.store.latest_state(1), (True, None))
+        self.assertEqual(self.store.latest_state(2), (False, None))
+
+    def test_compact_without_max_age_drops_cleared_states(self):
+        self.store.record_state(1, step("name"))
+        self.store.record_state(1, None)
+        self.store.compact()
+        self.assertEqual(self.rows(), 0)
+
+    def test_appends_trigger_compaction(self):
+        store = self.open_store(":memory:", compact_every=10)
+        for i in range(9):
+            store.record_state(1, step(str(i)))
+        self.assertEqual(self.rows(store), 9)
+        store.record_state(1, step("last"))
+        self.assertEqual(self.rows(store), 1)
+        self.assertEqual(store.latest_state(1), (True, step("last")))
+
+
+if __name__ == "__main__":
+    unittest.main()
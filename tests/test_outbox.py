@@ -0,0 +1,222 @@
+"""Outbox (backoff, dead-letter, revive) va ariza -> HR xabari oqimi.
+
+    python -m pytest tests/
+"""
+import os
+import sys
+import tempfile
+import threading
+import time
+import unittest
+from unittest import mock
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, "tools"))
+sys.path.insert(0, ROOT)
+
+import fake_firestore  # noqa: E402
+import telegram_bot as tb  # noqa: E402
+
+
+def wait_for(predicate, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if predicate():
+            return True
+        time.sleep(0.01)
+    return bool(predicate())
+
+
+def counter(metric, **labels):
+    return metric._series.get(tuple(sorted(labels.items())), 0)
+
+
+class OutboxCase(unittest.TestCase):
+    def make_outbox(self, store=None, **kwargs):
+        options = dict(workers=2, max_attempts=3, base_delay=0.05, max_delay=1, poll_interval=0.05,
+                       dead_retry_after=0)
+        options.update(kwargs)
+        outbox = tb.Outbox(store or tb.LocalStore(":memory:"), **options)
+        self.addCleanup(outbox.close, 1)
+        return outbox
+
+    def idle(self, outbox):
+        """Navbatda pending yoki bajarilayotgan ish qolmaguncha kutish"""
+        return wait_for(lambda: not outbox.stats().get("pending") and not outbox.stats()["running"])
+
+
+class OutboxTest(OutboxCase):
+    def test_job_runs_once_and_is_removed(self):
+        outbox = self.make_outbox()
+        calls = []
+        outbox.register("t_ok", lambda payload: calls.append(payload) or True)
+        self.assertEqual(outbox.enqueue(("t_ok", "k1", {"n": 1})), 1)
+        # (kind, key) takrorlansa qo'shilmaydi
+        self.assertEqual(outbox.enqueue(("t_ok", "k1", {"n": 2})), 0)
+        self.assertTrue(wait_for(lambda: calls))
+        self.assertTrue(self.idle(outbox))
+        self.assertEqual(calls, [{"n": 1}])
+        self.assertEqual(outbox.stats(), {"running": 0})
+
+    def test_failures_are_retried_with_backoff(self):
+        outbox = self.make_outbox(max_attempts=5)
+        times = []
+
+        def handler(payload):
+            times.append(time.monotonic())
+            if len(times) == 2:
+                raise RuntimeError("boom")
+            return len(times) >= 4
+
+        outbox.register("t_backoff", handler)
+        before = counter(tb.OUTBOX_JOBS, kind="t_backoff", outcome="retry")
+        outbox.enqueue(("t_backoff", "k", {}))
+        self.assertTrue(wait_for(lambda: len(times) == 4))
+        self.assertTrue(self.idle(outbox))
+        gaps = [b - a for a, b in zip(times, times[1:])]
+        # 0.05 * 2^(n-1), jitter bilan kamida yarmi
+        for n, gap in enumerate(gaps, start=1):
+            self.assertGreaterEqual(gap, 0.05 * 2 ** (n - 1) * 0.5 - 0.01, gaps)
+        self.assertEqual(counter(tb.OUTBOX_JOBS, kind="t_backoff", outcome="retry") - before, 3)
+        self.assertEqual(counter(tb.OUTBOX_JOBS, kind="t_backoff", outcome="ok"), 1)
+
+    def test_exhausted_job_is_dead_lettered(self):
+        outbox = self.make_outbox(max_attempts=2)
+        dead = []
+        outbox.register("t_dead", lambda payload: False, on_dead=lambda payload: dead.append(payload) or False)
+        outbox.enqueue(("t_dead", "k", {"n": 1}))
+        self.assertTrue(wait_for(lambda: outbox.stats().get("dead") == 1))
+        self.assertEqual(dead, [{"n": 1}])
+        self.assertEqual(counter(tb.OUTBOX_JOBS, kind="t_dead", outcome="dead"), 1)
+
+    def test_settled_dead_job_is_removed(self):
+        outbox = self.make_outbox(max_attempts=1)
+        outbox.register("t_settled", lambda payload: False, on_dead=lambda payload: True)
+        outbox.enqueue(("t_settled", "k", {}))
+        self.assertTrue(wait_for(lambda: counter(tb.OUTBOX_JOBS, kind="t_settled", outcome="dead") == 1))
+        self.assertTrue(self.idle(outbox))
+        self.assertEqual(outbox.stats(), {"running": 0})
+
+    def test_dead_job_is_revived_after_delay(self):
+        outbox = self.make_outbox(max_attempts=1, dead_retry_after=0.3)
+        calls = []
+        outbox.register("t_revive", lambda payload: calls.append(1) or len(calls) >= 2)
+        outbox.enqueue(("t_revive", "k", {}))
+        self.assertTrue(wait_for(lambda: len(calls) == 2))
+        self.assertTrue(self.idle(outbox))
+        self.assertEqual(counter(tb.OUTBOX_REVIVED, kind="t_revive"), 1)
+        self.assertEqual(outbox.stats(), {"running": 0})
+
+    def test_pending_jobs_survive_restart(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        path = os.path.join(tmp.name, "outbox.db")
+        store = tb.LocalStore(path)
+        first = tb.Outbox(store, workers=1, poll_interval=0.05)
+        first.enqueue(("t_restart", "k", {"n": 1}))
+        first.close(timeout=0.1)
+        store.close()
+
+        store = tb.LocalStore(path)
+        self.addCleanup(store.close)
+        outbox = self.make_outbox(store)
+        calls = []
+        outbox.register("t_restart", lambda payload: calls.append(payload) or True)
+        outbox.enqueue()
+        self.assertTrue(wait_for(lambda: calls == [{"n": 1}]))
+
+
+class RecordingAPI:
+    """HR xabarlarini yozib boruvchi TelegramAPI o'rnini bosuvchi"""
+
+    def __init__(self):
+        self.sent = []
+        self.lock = threading.Lock()
+
+    def send_message(self, chat_id, text, reply_markup=None, block=False):
+        with self.lock:
+            self.sent.append((chat_id, text))
+        return {"ok": True}
+
+    def call(self, method, params, block=False):
+        return self.send_message(params["chat_id"], params.get("caption") or params.get("text"))
+
+
+class HrNotifyTest(OutboxCase):
+    def setUp(self):
+        patcher = mock.patch.multiple(tb.Config, HR_CHAT_ID="-100", HR_OUTBOX_LEASE_SEC=60)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.client = fake_firestore.FakeFirestore()
+        self.db = tb.FirestoreDB(client=self.client, fs_module=fake_firestore, migrate=False)
+        self.addCleanup(self.db.close)
+        self.api = RecordingAPI()
+        self.outbox = self.make_outbox(max_attempts=2, base_delay=0.01)
+        self.bot = tb.BotLogic(self.api, self.db, outbox=self.outbox)
+
+    def submit(self, app_id="app1"):
+        job = {"app_id": app_id, "user_id": 7, "data": {"name": "Ali Valiyev", "position": "Oshpaz"},
+               "file_id": None, "f_type": None, "submitted_at": time.time()}
+        self.outbox.enqueue(("save_application", app_id, job))
+        return job
+
+    def hr_outbox(self, app_id="app1"):
+        return self.client.dump().get("hr_outbox", {}).get(app_id, {})
+
+    def test_saved_application_is_sent_once(self):
+        self.submit()
+        self.assertTrue(wait_for(lambda: self.api.sent))
+        self.assertTrue(self.idle(self.outbox))
+        self.assertEqual(len(self.api.sent), 1)
+        chat_id, text = self.api.sent[0]
+        self.assertEqual(chat_id, "-100")
+        self.assertNotIn("saqlanmadi", text)
+        self.assertEqual(self.hr_outbox()["status"], "sent")
+        self.assertIn("app1", self.client.dump()["applications"])
+
+    def test_hr_is_not_notified_before_save(self):
+        saved = threading.Event()
+        original = self.db.save_application
+
+        def slow_save(*args, **kwargs):
+            saved.wait(5)
+            return original(*args, **kwargs)
+
+        with mock.patch.object(self.db, "save_application", side_effect=slow_save):
+            self.submit()
+            time.sleep(0.2)
+            self.assertEqual(self.api.sent, [])
+            self.assertEqual(self.outbox.store.outbox_counts().get("pending"), 1)
+            saved.set()
+            self.assertTrue(wait_for(lambda: self.api.sent))
+
+    def test_unsaved_application_still_reaches_hr(self):
+        with mock.patch.object(self.db, "save_application", return_value=False):
+            self.submit()
+            self.assertTrue(wait_for(lambda: self.api.sent))
+        self.assertEqual(len(self.api.sent), 1)
+        self.assertIn("⚠️ Ariza bazaga hali saqlanmadi", self.api.sent[0][1])
+        # Saqlash ishi "dead" holatida qoladi (dead_retry_after bilan keyin qayta uriniladi)
+        self.assertEqual(self.outbox.stats().get("dead"), 1)
+
+    def test_failed_claim_falls_back_to_local_dedupe(self):
+        with mock.patch.object(self.db, "claim_hr_notification", return_value=None):
+            self.submit()
+            self.assertTrue(wait_for(lambda: self.api.sent))
+            self.assertTrue(self.idle(self.outbox))
+        self.assertEqual(len(self.api.sent), 1)
+        self.assertTrue(self.outbox.store.is_delivered("app1"))
+        # Sweep qaytarsa ham lokal belgi qayta yuborishga yo'l qo'ymaydi
+        self.assertTrue(self.bot._outbox_hr_notify_dead({"app_id": "app1"}))
+        self.assertEqual(len(self.api.sent), 1)
+
+    def test_busy_or_sent_claim_is_not_resent(self):
+        job = {"app_id": "app2", "user_id": 7, "data": {}, "file_id": None, "f_type": None}
+        for claim in ("busy", "sent"):
+            with mock.patch.object(self.db, "claim_hr_notification", return_value=claim):
+                self.assertTrue(self.bot._outbox_hr_notify(job))
+        self.assertEqual(self.api.sent, [])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,158 @@
+"""GCRA TokenBucket, TelegramRateLimiter va ChatSendQueue: tekislash, tartib va 429 qayta yuborish.
+
+    python -m pytest tests/
+"""
+import os
+import sys
+import threading
+import time
+import unittest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import telegram_bot as tb  # noqa: E402
+
+
+class TokenBucketTest(unittest.TestCase):
+    def test_burst_then_even_spacing(self):
+        bucket = tb.TokenBucket(rate=2, burst=3)
+        slots = []
+        for _ in range(6):
+            at = bucket.earliest(10.0)
+            bucket.commit(at)
+            slots.append(at)
+        # Birinchi 3 tasi darhol, keyingilari 0.5s oralig'ida
+        self.assertEqual(slots, [10.0, 10.0, 10.0, 10.5, 11.0, 11.5])
+
+    def test_idle_bucket_refills(self):
+        bucket = tb.TokenBucket(rate=1, burst=2)
+        for _ in range(2):
+            bucket.commit(bucket.earliest(0.0))
+        self.assertEqual(bucket.earliest(0.0), 1.0)
+        self.assertEqual(bucket.earliest(5.0), 5.0)
+
+    def test_block_until(self):
+        bucket = tb.TokenBucket(rate=1, burst=3)
+        bucket.block_until(20.0)
+        self.assertEqual(bucket.earliest(0.0), 20.0)
+        # Bloklashdan keyin burst qayta tiklanmaydi: bir zumda faqat bitta
+        bucket.commit(20.0)
+        self.assertEqual(bucket.earliest(0.0), 21.0)
+
+
+class TelegramRateLimiterTest(unittest.TestCase):
+    def test_private_chat_burst_and_rate(self):
+        limiter = tb.TelegramRateLimiter(global_rate=1000, chat_rate=1, chat_burst=3)
+        waits = [limiter.reserve(1) for _ in range(5)]
+        self.assertTrue(all(w <= 0.01 for w in waits[:3]), waits)
+        self.assertAlmostEqual(waits[3], 1.0, delta=0.05)
+        self.assertAlmostEqual(waits[4], 2.0, delta=0.05)
+        # Boshqa chat bu chatning navbatini kutmaydi
+        self.assertLessEqual(limiter.reserve(2), 0.01)
+
+    def test_group_chats_use_group_rate(self):
+        limiter = tb.TelegramRateLimiter(global_rate=1000, group_rate=20 / 60, group_burst=1)
+        limiter.reserve(-100)
+        self.assertAlmostEqual(limiter.reserve(-100), 3.0, delta=0.05)
+
+    def test_global_limit_spans_chats(self):
+        limiter = tb.TelegramRateLimiter(global_rate=10, chat_rate=100, chat_burst=100)
+        waits = [limiter.reserve(chat) for chat in range(12)]
+        self.assertTrue(all(w <= 0.01 for w in waits[:10]), waits)
+        self.assertAlmostEqual(waits[10], 0.1, delta=0.02)
+        self.assertAlmostEqual(waits[11], 0.2, delta=0.02)
+
+    def test_penalize_blocks_chat(self):
+        limiter = tb.TelegramRateLimiter(global_rate=1000, chat_rate=100, chat_burst=100)
+        limiter.penalize(1, 2)
+        self.assertAlmostEqual(limiter.reserve(1), 2.0, delta=0.05)
+        self.assertLessEqual(limiter.reserve(2), 0.01)
+
+
+class FakeSend:
+    """ChatSendQueue uchun send(): chaqiruvlarni yozadi, berilgan update'larga bir marta 429 qaytaradi"""
+
+    def __init__(self, throttle=()):
+        self.throttle = set(throttle)
+        self.sent = []
+        self.lock = threading.Lock()
+
+    def __call__(self, method, params, files, timeout, max_retries):
+        text = params["text"]
+        with self.lock:
+            if text in self.throttle:
+                self.throttle.discard(text)
+                return {"ok": False, "error_code": 429, "parameters": {"retry_after": 0.2}}
+            self.sent.append((time.monotonic(), params["chat_id"], text))
+        return {"ok": True, "result": {"text": text}}
+
+    def texts(self, chat_id):
+        return [text for _, chat, text in self.sent if chat == chat_id]
+
+
+def job(chat_id, text):
+    return ("sendMessage", {"chat_id": chat_id, "text": text}, None, 5, 0)
+
+
+class ChatSendQueueTest(unittest.TestCase):
+    def make(self, send, chat_rate=20):
+        limiter = tb.TelegramRateLimiter(global_rate=1000, chat_rate=chat_rate, chat_burst=1)
+        queue = tb.ChatSendQueue(limiter, send, workers=4, name=f"test-{id(self)}")
+        self.addCleanup(queue.close, 1)
+        return queue
+
+    def test_burst_is_queued_in_order_without_drops(self):
+        send = FakeSend()
+        queue = self.make(send)
+        results = [queue.call(1, job(1, str(i))) for i in range(10)]
+        # Birinchisi darhol yuboriladi, qolganlari navbatga
+        self.assertEqual(results[0]["result"], {"text": "0"})
+        self.assertEqual(results[1:], [tb.QUEUED_RESULT] * 9)
+        queue.close(timeout=5)
+        self.assertEqual(send.texts(1), [str(i) for i in range(10)])
+        times = [at for at, _, _ in send.sent]
+        self.assertTrue(all(b - a >= 0.04 for a, b in zip(times, times[1:])), times)
+        self.assertEqual(queue.stats()["pending"], 0)
+
+    def test_queued_chat_does_not_delay_other_chats(self):
+        send = FakeSend()
+        queue = self.make(send, chat_rate=2)
+        for i in range(3):
+            queue.call(1, job(1, f"a{i}"))
+        started = time.monotonic()
+        result = queue.call(2, job(2, "b"), block=True)
+        self.assertEqual(result["result"], {"text": "b"})
+        self.assertLess(time.monotonic() - started, 0.1)
+        self.assertEqual(queue.stats()["chats"], 1)
+
+    def test_block_waits_for_real_result(self):
+        send = FakeSend()
+        queue = self.make(send, chat_rate=10)
+        queue.call(1, job(1, "first"))
+        result = queue.call(1, job(1, "second"), block=True)
+        self.assertEqual(result["result"], {"text": "second"})
+        self.assertEqual(send.texts(1), ["first", "second"])
+
+    def test_429_is_rescheduled_and_keeps_order(self):
+        send = FakeSend(throttle={"1"})
+        queue = self.make(send)
+        for i in range(4):
+            queue.call(1, job(1, str(i)))
+        queue.close(timeout=5)
+        self.assertEqual(send.texts(1), ["0", "1", "2", "3"])
+        self.assertEqual(queue.stats()["throttled"], 1)
+        # Qayta yuborish retry_after'dan oldin bo'lmaydi
+        times = {text: at for at, _, text in send.sent}
+        self.assertGreaterEqual(times["1"] - times["0"], 0.19)
+
+    def test_429_on_direct_send_is_retried(self):
+        send = FakeSend(throttle={"x"})
+        queue = self.make(send)
+        result = queue.call(1, job(1, "x"), block=True)
+        self.assertEqual(result["result"], {"text": "x"})
+        self.assertEqual(queue.stats()["throttled"], 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
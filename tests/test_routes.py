@@ -0,0 +1,166 @@
+"""BotLogic._routes jadvali oldingi if/elif zanjiri bilan bir xil javob berishi.
+
+LegacyBot _handle_update boshidagi eski zanjirni (jadvaldan oldingi ko'rinishida) bajaradi,
+qolgan flow umumiy. Til, state, matn va chat kombinatsiyalari bo'yicha Telegram
+chaqiruvlari hamda yakuniy state/til solishtiriladi.
+
+    python -m pytest tests/
+"""
+import copy
+import os
+import sys
+import unittest
+from unittest import mock
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, "tools"))
+sys.path.insert(0, ROOT)
+
+import fake_firestore  # noqa: E402
+import telegram_bot as tb  # noqa: E402
+from fake_telegram import FakeTelegram  # noqa: E402
+
+
+class LegacyBot(tb.BotLogic):
+    """_routes'dan oldingi if/elif zanjiri; mos kelmagan matnlar umumiy flow'ga o'tadi"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._routes = {}
+
+    def _handle_update(self, update):
+        message = update.get("message")
+        if not message:
+            return super()._handle_update(update)
+        chat_id = message["chat"]["id"]
+        user_id = message["from"]["id"]
+        text = message.get("text", "")
+
+        lang = self.db.get_user_lang(user_id)
+        state = self.db.get_user_state(user_id)
+        is_hr_chat = str(chat_id) == str(tb.Config.HR_CHAT_ID)
+
+        if is_hr_chat:
+            if self._handle_admin(update, chat_id, user_id, text, state):
+                return
+
+        if text in ["/start", "/menu"] or text == "Menu":
+            self.db.set_user_state(user_id, None)
+            if not lang:
+                welcome_msg = (
+                    "🌟 <b>Al-Xorazmiy xususiy maktabi</b> 🏫\n\n"
+                    "🌍 <i>Iltimos, tilni tanlang:</i>\n"
+                    "🌍 <i>Пожалуйста, выберите язык:</i>\n"
+                    "🌍 <i>Please select a language:</i>"
+                )
+                self.api.send_message(chat_id, welcome_msg, self._welcome_lang_menu())
+                return
+            self.api.send_message(chat_id, self._label("msg_welcome", lang), self._main_menu(lang, chat_id))
+            return
+
+        if text == "/stop":
+            self.db.set_user_state(user_id, None)
+            self.api.send_message(chat_id, self._label("msg_stopped", lang if lang else "uz"), self._keyboard("remove"))
+            return
+
+        if text in ["🇺🇿 O'zbek (Lotin)", "🇺🇿 Ўзбек (Кирил)", "🇷🇺 Русский", "🇬🇧 English"]:
+            if text == "🇺🇿 O'zbek (Lotin)":
+                new_lang = "uz"
+            elif text == "🇺🇿 Ўзбек (Кирил)":
+                new_lang = "uz_cyrl"
+            elif text == "🇷🇺 Русский":
+                new_lang = "ru"
+            else:
+                new_lang = "en"
+            self.db.set_user_lang(user_id, new_lang)
+            self.api.send_message(chat_id, self._label("msg_welcome", new_lang), self._main_menu(new_lang, chat_id))
+            return
+
+        action = self._action_from_text(text)
+
+        if action == "menu_lang":
+            self.api.send_message(chat_id, self._label("msg_select_lang", lang), self._lang_menu(lang))
+            return
+
+        if action in ["lang_uz", "lang_uz_cyrl", "lang_en", "lang_ru"]:
+            new_lang = action[len("lang_"):]
+            self.db.set_user_lang(user_id, new_lang)
+            self.api.send_message(chat_id, self._label("msg_lang_changed", new_lang), self._main_menu(new_lang, chat_id))
+            return
+
+        if action == "back":
+            self.api.send_message(chat_id, "Menu:", self._main_menu(lang, chat_id))
+            return
+
+        if not state:
+            for key in ("about", "contact", "location"):
+                if action == f"menu_{key}":
+                    self.api.send_message(chat_id, self._label(f"msg_{key}", lang), self._main_menu(lang, chat_id))
+                    return
+
+        # Zanjirdan o'tgan matn: qolgan flow (admin allaqachon tekshirilgan)
+        with mock.patch.object(self, "_handle_admin", return_value=False):
+            super()._handle_update(update)
+
+
+TEXTS = [
+    "/start", "/menu", "Menu", "/stop", "/admin",
+    "🇺🇿 O'zbek (Lotin)", "🇺🇿 Ўзбек (Кирил)", "🇷🇺 Русский", "🇬🇧 English", "🇷🇺 RUS", "🇺🇿 Kiril",
+    "🏫 Biz haqimizda", "🏫 О нас", "💬 Biz bilan bog'lanish", "📍 Manzilimiz", "🌐 Tilni almashtirish",
+    "⬅️ Orqaga", "⬅️ Назад", "💼 Bo'sh ish o'rinlari", "❌ Bekor qilish", "📋 Arizalar",
+    "Aliyev Vali", "+998901234567", "random text", "",
+]
+STATES = [
+    None,
+    {"step": "name", "data": {}, "mode": "job"},
+    {"step": "phone", "data": {"name": "Aliyev Vali"}, "mode": "job"},
+    {"mode": "admin"},
+]
+
+
+class RoutesEquivalenceTest(unittest.TestCase):
+    def setUp(self):
+        patcher = mock.patch.object(tb.Config, "HR_CHAT_ID", "-100")
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.fake = FakeTelegram().start()
+        self.addCleanup(self.fake.stop)
+
+    def run_cases(self, bot_class):
+        api = tb.TelegramAPI("x", api_base_url=self.fake.base_url,
+                             rate_limiter=tb.TelegramRateLimiter(1e9, 1e9, 10**6, 1e9, 10**6))
+        self.addCleanup(api.close)
+        db = tb.FirestoreDB(client=fake_firestore.FakeFirestore(), fs_module=fake_firestore, migrate=False)
+        self.addCleanup(db.close)
+        bot = bot_class(api, db, outbox=tb.Outbox(tb.LocalStore(":memory:")))
+        self.addCleanup(bot.outbox.close, 1)
+        results = []
+        user_id = 1000
+        for lang in ("uz", "ru", None):
+            for state in STATES:
+                for text in TEXTS:
+                    for chat in (None, -100):
+                        user_id += 1
+                        if lang:
+                            db.set_user_lang(user_id, lang)
+                        db.set_user_state(user_id, copy.deepcopy(state))
+                        before = len(self.fake.calls)
+                        bot.handle_update({"update_id": 1, "message": {
+                            "message_id": 1, "date": 0, "chat": {"id": chat or user_id}, "from": {"id": user_id},
+                            "text": text}})
+                        calls = [(method, {k: str(v) for k, v in params.items()})
+                                 for method, params in self.fake.calls[before:]]
+                        results.append(((lang, str(state), text, chat),
+                                        calls, db.get_user_state(user_id), db.get_user_lang(user_id)))
+        return results
+
+    def test_routes_match_legacy_chain(self):
+        legacy = self.run_cases(LegacyBot)
+        routed = self.run_cases(tb.BotLogic)
+        self.assertEqual(len(routed), 3 * len(STATES) * len(TEXTS) * 2)
+        for old, new in zip(legacy, routed):
+            self.assertEqual(old, new, old[0])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,84 @@
+"""Lavozim qidiruvi: normallashtirish, transliteratsiya, position_tokens va trigram indeksi.
+
+    python -m pytest tests/
+"""
+import os
+import sys
+import unittest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, "tools"))
+sys.path.insert(0, ROOT)
+
+import fake_firestore  # noqa: E402
+import telegram_bot as tb  # noqa: E402
+
+
+class NormalizeTest(unittest.TestCase):
+    def test_apostrophe_variants_and_cyrillic_match(self):
+        variants = ["O'qituvchi", "Oʻqituvchi", "o`qituvchi", "O’QITUVCHI", "Ўқитувчи"]
+        self.assertEqual({tb._normalize_search_text(v) for v in variants}, {"oqituvchi"})
+
+    def test_russian_is_transliterated(self):
+        self.assertEqual(tb._normalize_search_text("Учитель английского"), "uchitel angliyskogo")
+        self.assertEqual(tb._normalize_search_text("Шофёр"), "shofyor")
+
+    def test_punctuation_and_spaces_collapse(self):
+        self.assertEqual(tb._normalize_search_text("  Bosh-hisobchi!\n(IT) "), "bosh hisobchi it")
+        self.assertEqual(tb._normalize_search_text(None), "")
+
+
+class SearchTokensTest(unittest.TestCase):
+    def test_words_and_prefixes(self):
+        self.assertEqual(tb._search_tokens("Ingliz tili"), ["ing", "ingl", "ingli", "ingliz", "til", "tili"])
+
+    def test_short_words(self):
+        # 1 harfli so'zlar tashlanadi, 2 harflilar prefikssiz qo'shiladi
+        self.assertEqual(tb._search_tokens("IT va 1C"), ["1c", "it", "va"])
+
+    def test_scripts_give_same_tokens(self):
+        self.assertEqual(tb._search_tokens("Ўқитувчи"), tb._search_tokens("o'qituvchi"))
+        self.assertIn("oqi", tb._search_tokens("Ўқитувчи"))
+
+
+class PositionSearchTest(unittest.TestCase):
+    positions = ["Ingliz tili o'qituvchisi", "Matematika o'qituvchisi", "Bosh hisobchi", "Учитель математики"]
+
+    def setUp(self):
+        self.client = fake_firestore.FakeFirestore()
+        self.db = tb.FirestoreDB(client=self.client, fs_module=fake_firestore, migrate=False)
+        self.addCleanup(self.db.close)
+        self.db._ngram_index = None
+        for i, position in enumerate(self.positions):
+            self.assertTrue(self.db.save_application(i, {"position": position}, "f", "document",
+                                                     doc_id=f"app{i}", submitted_at=1700000000 + i))
+
+    def search(self, query):
+        return sorted(item["id"] for item in self.db.search_applications_by_position(query))
+
+    def test_cyrillic_query_finds_latin_position(self):
+        self.assertEqual(self.search("ўқитувчи"), ["app0", "app1"])
+
+    def test_prefix_and_multiword(self):
+        self.assertEqual(self.search("mat"), ["app1", "app3"])
+        self.assertEqual(self.search("ingl o'qit"), ["app0"])
+        self.assertEqual(self.search("hisob bosh"), ["app2"])
+
+    def test_no_match(self):
+        self.assertEqual(self.search("haydovchi"), [])
+        self.assertEqual(self.search("!!"), [])
+
+    def test_ngram_index_substring(self):
+        index = tb.PositionNgramIndex()
+        for i, position in enumerate(self.positions):
+            index.add(f"app{i}", position, i)
+        # Substring (so'z o'rtasi) ham topiladi, yangilari birinchi
+        self.assertEqual(index.search("qituv"), ["app1", "app0"])
+        self.assertEqual(index.search("matem"), ["app3", "app1"])
+        index.remove("app3")
+        self.assertEqual(index.search("matem"), ["app1"])
+        self.assertEqual(index.search("xyz"), [])
+
+
+if __name__ == "__main__":
+    unittest.main()
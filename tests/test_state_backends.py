@@ -0,0 +1,187 @@
+"""STATE_BACKEND omborlari: RESP klienti, xotira/Redis/Firestore backend'lari va jarayonlararo invalidatsiya.
+
+Redis o'rnida tools/resp_server.py (port=0), Firestore o'rnida tools/fake_firestore.py ishlatiladi:
+
+    python -m pytest tests/
+    python -m unittest discover tests
+"""
+import os
+import sys
+import time
+import unittest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, "tools"))
+sys.path.insert(0, ROOT)
+
+import fake_firestore  # noqa: E402
+import telegram_bot as tb  # noqa: E402
+from resp_server import RespServer  # noqa: E402
+
+
+def wait_for(predicate, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if predicate():
+            return True
+        time.sleep(0.02)
+    return bool(predicate())
+
+
+class RespServerCase(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.server = RespServer(port=0).start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.stop()
+
+    def setUp(self):
+        with self.server.store.lock:
+            self.server.store.data.clear()
+
+
+class RespConnectionTest(RespServerCase):
+    def setUp(self):
+        super().setUp()
+        host, port = self.server.server_address[:2]
+        self.conn = tb._RespConnection(host, port, timeout=5)
+        self.addCleanup(self.conn.close)
+
+    def test_pipeline_round_trip(self):
+        replies = self.conn.execute(
+            ("PING",),
+            ("SET", "k", b"v\r\nbinary\x00"),
+            ("GET", "k"),
+            ("GET", "missing"),
+            ("EXISTS", "k", "missing"),
+            ("DEL", "k", "missing"),
+            ("GET", "k"),
+        )
+        self.assertEqual(replies, ["PONG", "OK", b"v\r\nbinary\x00", None, 1, 1, None])
+
+    def test_set_conditions_and_expiry(self):
+        self.assertEqual(self.conn.execute(("SET", "k", "1", "NX"))[0], "OK")
+        self.assertIsNone(self.conn.execute(("SET", "k", "2", "NX"))[0])
+        self.assertIsNone(self.conn.execute(("SET", "other", "2", "XX"))[0])
+        self.assertEqual(self.conn.execute(("SET", "short", "x", "PX", 50))[0], "OK")
+        time.sleep(0.1)
+        self.assertEqual(self.conn.execute(("GET", "k"), ("GET", "short")), [b"1", None])
+
+    def test_error_reply_keeps_connection_usable(self):
+        with self.assertRaises(tb.RespError):
+            self.conn.execute(("NOSUCH",))
+        self.assertEqual(self.conn.execute(("PING", "hi")), [b"hi"])
+
+
+class BackendContract:
+    """Har bir StateBackend bajarishi kerak bo'lgan shartlar"""
+
+    def make_backend(self, client):
+        raise NotImplementedError
+
+    def wait_subscribed(self, count):
+        time.sleep(0.1)
+
+    def setUp(self):
+        super().setUp()
+        self.client = fake_firestore.FakeFirestore()
+        self.backend = self.make_backend(self.client)
+        self.addCleanup(self.backend.close)
+
+    def make_db(self, ttl_seconds=None):
+        store = tb.LocalStore(":memory:")
+        db = tb.FirestoreDB(local_store=store, client=self.client, fs_module=fake_firestore)
+        if ttl_seconds is not None:
+            db._user_langs.ttl_seconds = ttl_seconds
+        db.use_shared_state(self.make_backend(self.client))
+        self.addCleanup(store.close)
+        self.addCleanup(db.shared.close)
+        self.addCleanup(db.close)
+        return db
+
+    def test_round_trip(self):
+        self.assertIs(self.backend.get("state", "1"), tb._MISSING)
+        state = {"step": "name", "data": {"name": "Ali Valiyev"}, "mode": "job"}
+        self.backend.set("state", "1", state, 60, "origin-a")
+        self.backend.set("state", "2", None, 60, "origin-a")
+        self.assertEqual(self.backend.get("state", "1"), state)
+        # None ham qiymat: foydalanuvchida state yo'q
+        self.assertIsNone(self.backend.get("state", "2"))
+
+    def test_add_does_not_overwrite(self):
+        self.backend.set("lang", "1", "ru", 60, "origin-a")
+        self.backend.add("lang", "1", "uz", 60)
+        self.backend.add("lang", "2", "en", 60)
+        self.assertEqual(self.backend.get("lang", "1"), "ru")
+        self.assertEqual(self.backend.get("lang", "2"), "en")
+
+    def test_add_replaces_expired_value(self):
+        self.backend.add("lang", "1", "ru", 1)
+        time.sleep(1.2)
+        self.assertIs(self.backend.get("lang", "1"), tb._MISSING)
+        self.backend.add("lang", "1", "en", 60)
+        self.assertEqual(self.backend.get("lang", "1"), "en")
+
+    def test_set_publishes_invalidation(self):
+        received = []
+        self.backend.subscribe(lambda *args: received.append(args))
+        self.wait_subscribed(1)
+        self.backend.set("lang", "7", "en", 60, "origin-a")
+        self.assertTrue(wait_for(lambda: received))
+        self.assertEqual(received[0], ("origin-a", "lang", "7"))
+
+    def test_lang_change_invalidates_other_process(self):
+        a, b = self.make_db(), self.make_db()
+        self.wait_subscribed(2)
+        a.set_user_lang(1, "ru")
+        self.assertEqual(b.get_user_lang(1), "ru")
+        a.set_user_lang(1, "en")
+        self.assertTrue(wait_for(lambda: b.cached_user_lang(1) is tb._MISSING))
+        self.assertEqual(b.get_user_lang(1), "en")
+        # O'z yozuvi o'z cache'ini o'chirmaydi
+        self.assertEqual(a.cached_user_lang(1), "en")
+
+    def test_stale_local_lang_not_served_after_shared_expiry(self):
+        a, b = self.make_db(ttl_seconds=1), self.make_db(ttl_seconds=1)
+        self.wait_subscribed(2)
+        b.local.set_lang("1", "ru")
+        a.set_user_lang(1, "en")
+        self.assertTrue(wait_for(lambda: b.local.get_lang("1") is None))
+        a.flush()
+        # Umumiy kalit va cache muddati o'tgach til Firestore'dan olinadi, eski lokal qiymatdan emas
+        time.sleep(1.2)
+        self.assertEqual(b.get_user_lang(1), "en")
+
+
+class MemoryStateBackendTest(BackendContract, unittest.TestCase):
+    def setUp(self):
+        self.shared_backend = tb.MemoryStateBackend()
+        super().setUp()
+
+    def make_backend(self, client):
+        # Bitta jarayon: barcha "jarayonlar" bitta ombordan foydalanadi
+        return self.shared_backend
+
+
+class RedisStateBackendTest(BackendContract, RespServerCase):
+    def make_backend(self, client):
+        return tb.RedisStateBackend(self.server.url, prefix="test")
+
+    def wait_subscribed(self, count):
+        def subscribed():
+            with self.server.store.lock:
+                return len(self.server.store.channels.get(b"test:invalidate", ())) >= count
+        self.assertTrue(wait_for(subscribed))
+
+
+class FirestoreStateBackendTest(BackendContract, unittest.TestCase):
+    def make_backend(self, client):
+        owner = tb.FirestoreDB(client=client, fs_module=fake_firestore)
+        self.addCleanup(owner.close)
+        return tb.FirestoreStateBackend(owner, poll_interval=0.05)
+
+
+if __name__ == "__main__":
+    unittest.main()
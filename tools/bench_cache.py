@@ -0,0 +1,123 @@
+"""LRUCacheWithTTL (bot'ning oldingi cache'i) va ShardedTTLCache o'tkazuvchanligini solishtirish.
+
+    python tools/bench_cache.py [--ops 200000] [--threads 1 5 32]
+
+Har bir thread ~90% get / 10% set aralashmasini bajaradi (bot'dagi state/til
+cache'lari kabi). Natija: umumiy operatsiyalar/soniya.
+"""
+import argparse
+import os
+import random
+import sys
+import threading
+import time
+from collections import OrderedDict
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from telegram_bot import ShardedTTLCache  # noqa: E402
+
+
+class LRUCacheWithTTL:
+    """LRU cache with TTL (Time To Live) and max size limit - ShardedTTLCache'dan oldingi, solishtirish uchun"""
+    def __init__(self, max_size=1000, ttl_seconds=3600):
+        self.cache = OrderedDict()
+        self.timestamps = {}
+        self.max_size = max_size
+        self.ttl_seconds = ttl_seconds
+        self._lock = threading.Lock()
+        # Metrikalar uchun
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, default=None):
+        """Cache'dagi qiymat yoki default"""
+        with self._lock:
+            if key not in self.cache:
+                self.misses += 1
+                return default
+
+            # Check TTL
+            if time.time() - self.timestamps.get(key, 0) > self.ttl_seconds:
+                self._remove(key)
+                self.misses += 1
+                return default
+
+            # Move to end (most recently used)
+            self.cache.move_to_end(key)
+            self.hits += 1
+            return self.cache[key]
+
+    def set(self, key, value):
+        with self._lock:
+            if key in self.cache:
+                self.cache.move_to_end(key)
+            else:
+                # Check size limit
+                if len(self.cache) >= self.max_size:
+                    # Remove oldest item
+                    oldest_key = next(iter(self.cache))
+                    self._remove(oldest_key)
+
+            self.cache[key] = value
+            self.timestamps[key] = time.time()
+
+    def delete(self, key):
+        with self._lock:
+            self._remove(key)
+
+    def _remove(self, key):
+        self.cache.pop(key, None)
+        self.timestamps.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self.cache.clear()
+            self.timestamps.clear()
+
+    def __len__(self):
+        return len(self.cache)
+
+
+def run(cache, threads, total_ops, keys, write_ratio):
+    per_thread = total_ops // threads
+    barrier = threading.Barrier(threads + 1)
+
+    def worker(seed):
+        rnd = random.Random(seed)
+        ops = [(rnd.random() < write_ratio, rnd.randrange(keys)) for _ in range(per_thread)]
+        barrier.wait()
+        for is_write, key in ops:
+            if is_write:
+                cache.set(key, key)
+            else:
+                cache.get(key)
+
+    workers = [threading.Thread(target=worker, args=(i,)) for i in range(threads)]
+    for t in workers:
+        t.start()
+    barrier.wait()
+    start = time.perf_counter()
+    for t in workers:
+        t.join()
+    return per_thread * threads / (time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Cache benchmark")
+    parser.add_argument("--ops", type=int, default=200000, help="Jami operatsiyalar soni")
+    parser.add_argument("--threads", type=int, nargs="+", default=[1, 5, 32])
+    parser.add_argument("--keys", type=int, default=800, help="Kalitlar soni (cache hajmidan katta qilinsa - eviction ko'p bo'ladi)")
+    parser.add_argument("--size", type=int, default=1000)
+    parser.add_argument("--write-ratio", type=float, default=0.1)
+    args = parser.parse_args()
+
+    print(f"{'threads':>7} {'LRUCacheWithTTL':>18} {'ShardedTTLCache':>18} {'speedup':>8}")
+    for threads in args.threads:
+        old = run(LRUCacheWithTTL(args.size, 3600), threads, args.ops, args.keys, args.write_ratio)
+        new = run(ShardedTTLCache(args.size, 3600), threads, args.ops, args.keys, args.write_ratio)
+        print(f"{threads:>7} {old:>14,.0f} op/s {new:>14,.0f} op/s {new / old:>7.2f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,89 @@
+"""JSON codec micro-benchmark: getUpdates javobini decode va sendMessage so'rovini encode qilish.
+
+    python tools/bench_codec.py [--file getupdates.json] [--repeat 2000]
+
+--file - yozib olingan getUpdates javobi ({"ok": true, "result": [...]}) yoki
+update'lar ro'yxati. Berilmasa 100 ta update'dan iborat namunaviy batch yasaladi.
+"""
+import argparse
+import json
+import sys
+import time
+import urllib.parse
+
+try:
+    import orjson
+except ModuleNotFoundError:
+    orjson = None
+
+
+def sample_batch(size=100):
+    updates = []
+    for i in range(size):
+        user = {"id": 100000 + i, "is_bot": False, "first_name": f"User{i}", "language_code": "uz"}
+        chat = {"id": 100000 + i, "first_name": f"User{i}", "type": "private"}
+        if i % 5 == 4:
+            updates.append({"update_id": 1000 + i, "callback_query": {
+                "id": str(9000 + i), "from": user, "chat_instance": "-123", "data": f"page_{i % 7}_abc{i}",
+                "message": {"message_id": i, "date": 1700000000 + i, "chat": chat, "text": "<b>Arizalar</b>"},
+            }})
+        else:
+            updates.append({"update_id": 1000 + i, "message": {
+                "message_id": i, "from": user, "chat": chat, "date": 1700000000 + i,
+                "text": "💼 Bo'sh ish o'rinlari" if i % 2 else "Aliyev Vali Valiyevich",
+            }})
+    return {"ok": True, "result": updates}
+
+
+def timeit(fn, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        fn()
+    return (time.perf_counter() - start) / repeat * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description="JSON codec benchmark")
+    parser.add_argument("--file", help="Yozib olingan getUpdates javobi (JSON)")
+    parser.add_argument("--repeat", type=int, default=2000)
+    args = parser.parse_args()
+
+    if args.file:
+        with open(args.file, "rb") as f:
+            payload = json.loads(f.read())
+        if isinstance(payload, list):
+            payload = {"ok": True, "result": payload}
+    else:
+        payload = sample_batch()
+    raw = json.dumps(payload, ensure_ascii=False).encode()
+    markup = {"keyboard": [[{"text": "💼 Bo'sh ish o'rinlari"}], [{"text": "📍 Manzilimiz"}, {"text": "🏫 Biz haqimizda"}],
+                           [{"text": "💬 Biz bilan bog'lanish"}], [{"text": "🌐 Tilni o'zgartirish"}]],
+              "resize_keyboard": True}
+    markup_json = json.dumps(markup)
+    params = {"chat_id": 123456789, "text": "<b>Assalomu alaykum!</b> Bo'limni tanlang 👇", "parse_mode": "HTML"}
+
+    print(f"getUpdates batch: {len(payload.get('result') or [])} ta update, {len(raw)} bayt")
+    rows = [
+        ("decode getUpdates: json.loads", lambda: json.loads(raw)),
+        ("encode sendMessage: urlencode + json.dumps(markup)",
+         lambda: urllib.parse.urlencode(dict(params, reply_markup=json.dumps(markup))).encode()),
+        ("encode sendMessage: json + json.dumps(markup)",
+         lambda: json.dumps(dict(params, reply_markup=json.dumps(markup))).encode()),
+        ("encode sendMessage: json + pre-rendered markup",
+         lambda: json.dumps(dict(params, reply_markup=markup_json)).encode()),
+    ]
+    if orjson is not None:
+        rows += [
+            ("decode getUpdates: orjson.loads", lambda: orjson.loads(raw)),
+            ("encode sendMessage: orjson + pre-rendered markup",
+             lambda: orjson.dumps(dict(params, reply_markup=markup_json))),
+        ]
+    else:
+        print("orjson o'rnatilmagan - faqat stdlib json o'lchanadi")
+
+    for name, fn in rows:
+        print(f"{name:<52} {timeit(fn, args.repeat):>9.2f} µs")
+
+
+if __name__ == "__main__":
+    sys.exit(main())
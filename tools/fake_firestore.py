@@ -0,0 +1,288 @@
+"""Xotiradagi fake Firestore (test, benchmark va replay uchun).
+
+FirestoreDB ishlatadigan google-cloud-firestore API qismini takrorlaydi:
+collection/document, get/set(merge)/update/delete, where/order_by/limit/
+start_after/stream so'rovlari, batch (create bilan), transaction va get_all.
+
+    import fake_firestore
+    db = FirestoreDB(client=fake_firestore.FakeFirestore(), fs_module=fake_firestore)
+
+Modulning o'zi `firestore` moduli o'rnida ishlaydi (SERVER_TIMESTAMP, Increment,
+Query.DESCENDING, transactional). `latency` har bir RPC'ga kechikish qo'shadi.
+"""
+import copy
+import threading
+import time
+import uuid
+from datetime import datetime, timezone
+
+
+class _Sentinel:
+    def __init__(self, name):
+        self.name = name
+
+    def __repr__(self):
+        return f"Sentinel({self.name})"
+
+
+SERVER_TIMESTAMP = _Sentinel("SERVER_TIMESTAMP")
+
+
+class Increment:
+    def __init__(self, value):
+        self.value = value
+
+
+class Query:
+    ASCENDING = "ASCENDING"
+    DESCENDING = "DESCENDING"
+
+
+class AlreadyExists(Exception):
+    code = 409
+
+
+class NotFound(Exception):
+    code = 404
+
+
+def transactional(fn):
+    """@firestore.transactional o'rnida: funksiya bajarilib, tranzaksiya commit qilinadi"""
+    def wrapper(transaction, *args, **kwargs):
+        with transaction.store.lock:
+            result = fn(transaction, *args, **kwargs)
+            transaction.commit()
+        return result
+    return wrapper
+
+
+def _apply(old, data, merge):
+    out = dict(old or {}) if merge else {}
+    for key, value in data.items():
+        if value is SERVER_TIMESTAMP:
+            value = datetime.now(timezone.utc)
+        elif isinstance(value, Increment):
+            value = (out.get(key) or 0) + value.value
+        elif isinstance(value, dict) and merge:
+            value = _apply(out.get(key) if isinstance(out.get(key), dict) else {}, value, True)
+        out[key] = value
+    return out
+
+
+class DocumentSnapshot:
+    def __init__(self, reference, data):
+        self.reference = reference
+        self.id = reference.id
+        self._data = data
+        self.exists = data is not None
+
+    def to_dict(self):
+        return copy.deepcopy(self._data) if self._data is not None else None
+
+    def get(self, field):
+        return (self._data or {}).get(field)
+
+
+class DocumentReference:
+    def __init__(self, store, collection, doc_id):
+        self.store = store
+        self.collection_id = collection
+        self.id = doc_id
+        self.path = f"{collection}/{doc_id}"
+
+    def _docs(self):
+        return self.store.data.setdefault(self.collection_id, {})
+
+    def get(self, transaction=None):
+        self.store._rpc(reads=1)
+        with self.store.lock:
+            return DocumentSnapshot(self, copy.deepcopy(self._docs().get(self.id)))
+
+    def set(self, data, merge=False):
+        self.store._rpc(writes=1)
+        with self.store.lock:
+            self._set_locked(data, merge)
+
+    def update(self, data):
+        self.store._rpc(writes=1)
+        with self.store.lock:
+            self._update_locked(data)
+
+    def delete(self):
+        self.store._rpc(writes=1)
+        with self.store.lock:
+            self._docs().pop(self.id, None)
+
+    def _set_locked(self, data, merge=False):
+        docs = self._docs()
+        docs[self.id] = _apply(docs.get(self.id), data, merge)
+
+    def _update_locked(self, data):
+        if self.id not in self._docs():
+            raise NotFound(self.path)
+        self._set_locked(data, merge=True)
+
+
+_OPERATORS = {
+    "==": lambda x, v: x == v,
+    "!=": lambda x, v: x != v,
+    ">": lambda x, v: x is not None and x > v,
+    ">=": lambda x, v: x is not None and x >= v,
+    "<": lambda x, v: x is not None and x < v,
+    "<=": lambda x, v: x is not None and x <= v,
+    "in": lambda x, v: x in v,
+    "array_contains": lambda x, v: v in (x or []),
+}
+
+
+class FakeQuery:
+    def __init__(self, store, collection, filters=(), orders=(), limit_to=None, after=None):
+        self.store = store
+        self.collection_id = collection
+        self._filters = tuple(filters)
+        self._orders = tuple(orders)
+        self._limit = limit_to
+        self._after = after
+
+    def _copy(self, **changes):
+        args = dict(filters=self._filters, orders=self._orders, limit_to=self._limit, after=self._after)
+        args.update(changes)
+        return FakeQuery(self.store, self.collection_id, **args)
+
+    def where(self, field, op, value):
+        return self._copy(filters=self._filters + ((field, op, value),))
+
+    def order_by(self, field, direction=Query.ASCENDING):
+        return self._copy(orders=self._orders + ((field, direction),))
+
+    def limit(self, count):
+        return self._copy(limit_to=count)
+
+    def start_after(self, snapshot):
+        return self._copy(after=snapshot)
+
+    def _sort_key(self, doc_id, data):
+        return tuple(data.get(field) for field, _ in self._orders) + (doc_id,)
+
+    def stream(self, transaction=None):
+        with self.store.lock:
+            items = [(doc_id, copy.deepcopy(data)) for doc_id, data in self.store.data.get(self.collection_id, {}).items()]
+        items = [
+            (doc_id, data) for doc_id, data in items
+            if all(_OPERATORS[op](data.get(field), value) for field, op, value in self._filters)
+        ]
+        descending = bool(self._orders) and self._orders[0][1] == Query.DESCENDING
+        items.sort(key=lambda item: self._sort_key(*item), reverse=descending)
+        if self._after is not None:
+            cursor = self._sort_key(self._after.id, self._after._data or {})
+            items = [
+                item for item in items
+                if (self._sort_key(*item) < cursor if descending else self._sort_key(*item) > cursor)
+            ]
+        if self._limit is not None:
+            items = items[:self._limit]
+        self.store._rpc(reads=max(len(items), 1))
+        for doc_id, data in items:
+            yield DocumentSnapshot(DocumentReference(self.store, self.collection_id, doc_id), data)
+
+    def get(self, transaction=None):
+        return list(self.stream(transaction))
+
+
+class CollectionReference(FakeQuery):
+    def __init__(self, store, name):
+        super().__init__(store, name)
+        self.id = name
+
+    def document(self, doc_id=None):
+        return DocumentReference(self.store, self.collection_id, doc_id or uuid.uuid4().hex[:20])
+
+
+class WriteBatch:
+    def __init__(self, store):
+        self.store = store
+        self._ops = []
+
+    def set(self, reference, data, merge=False):
+        self._ops.append(("set", reference, data, merge))
+
+    def create(self, reference, data):
+        self._ops.append(("create", reference, data, False))
+
+    def update(self, reference, data):
+        self._ops.append(("update", reference, data, False))
+
+    def delete(self, reference):
+        self._ops.append(("delete", reference, None, False))
+
+    def commit(self):
+        self.store._rpc(writes=len(self._ops), commits=1)
+        with self.store.lock:
+            # Shartlar avval tekshiriladi: batch yo to'liq yoziladi, yo umuman yozilmaydi
+            for op, reference, _, _ in self._ops:
+                exists = reference.id in reference._docs()
+                if op == "create" and exists:
+                    raise AlreadyExists(reference.path)
+                if op == "update" and not exists:
+                    raise NotFound(reference.path)
+            for op, reference, data, merge in self._ops:
+                if op == "delete":
+                    reference._docs().pop(reference.id, None)
+                elif op == "update":
+                    reference._update_locked(data)
+                else:
+                    reference._set_locked(data, merge)
+        ops, self._ops = self._ops, []
+        return ops
+
+
+class Transaction(WriteBatch):
+    pass
+
+
+class FakeFirestore:
+    """Firestore klienti o'rnida ishlatiladigan xotiradagi ombor"""
+
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.data = {}
+        self.lock = threading.RLock()
+        self._counter_lock = threading.Lock()
+        self.reads = 0
+        self.writes = 0
+        self.commits = 0
+
+    def _rpc(self, reads=0, writes=0, commits=0):
+        with self._counter_lock:
+            self.reads += reads
+            self.writes += writes
+            self.commits += commits
+        if self.latency:
+            time.sleep(self.latency)
+
+    def collection(self, name):
+        return CollectionReference(self, name)
+
+    def batch(self):
+        return WriteBatch(self)
+
+    def transaction(self):
+        return Transaction(self)
+
+    def get_all(self, references, transaction=None):
+        references = list(references)
+        self._rpc(reads=len(references))
+        with self.lock:
+            return [
+                DocumentSnapshot(ref, copy.deepcopy(ref._docs().get(ref.id)))
+                for ref in references
+            ]
+
+    def stats(self):
+        with self._counter_lock:
+            return {"reads": self.reads, "writes": self.writes, "commits": self.commits}
+
+    def dump(self):
+        """Barcha hujjatlar nusxasi: {collection: {doc_id: data}}"""
+        with self.lock:
+            return copy.deepcopy(self.data)
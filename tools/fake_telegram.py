@@ -0,0 +1,242 @@
+"""Lokal fake Telegram Bot API serveri (test va benchmark uchun).
+
+Bot'ni haqiqiy api.telegram.org o'rniga shu serverga ulash uchun:
+
+    TELEGRAM_API_BASE_URL=http://127.0.0.1:8081 python telegram_bot.py
+
+Server barcha chaqiruvlarni yozib boradi, getUpdates uchun navbatdagi
+update'larni qaytaradi va webhook rejimida update'larni bot'ning
+webhook URL'iga secret token bilan POST qiladi.
+"""
+import argparse
+import itertools
+import json
+import threading
+import time
+import urllib.parse
+import urllib.request
+from email.parser import BytesParser
+from email.policy import HTTP
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+def _parse_params(content_type, body):
+    """Form, JSON va multipart so'rov tanasini dict'ga aylantirish"""
+    content_type = content_type or ""
+    if not body:
+        return {}
+    if content_type.startswith("application/json"):
+        return json.loads(body)
+    if content_type.startswith("multipart/form-data"):
+        msg = BytesParser(policy=HTTP).parsebytes(
+            b"Content-Type: " + content_type.encode() + b"\r\n\r\n" + body
+        )
+        params = {}
+        for part in msg.iter_parts():
+            name = part.get_param("name", header="content-disposition")
+            if part.get_filename():
+                params[name] = {"filename": part.get_filename(), "size": len(part.get_payload(decode=True) or b"")}
+            else:
+                params[name] = part.get_content()
+        return params
+    return {k: v[-1] for k, v in urllib.parse.parse_qs(body.decode(), keep_blank_values=True).items()}
+
+
+class FakeTelegram:
+    """In-memory Telegram Bot API holati va HTTP server"""
+
+    def __init__(self, host="127.0.0.1", port=0, latency=0.0):
+        self.latency = latency
+        self.calls = []
+        self.webhook = None
+        self._errors = {}
+        self._updates = []
+        self._update_ids = itertools.count(1)
+        self._message_ids = itertools.count(1)
+        self._cond = threading.Condition()
+        self._server = ThreadingHTTPServer((host, port), self._make_handler())
+        self._server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def base_url(self):
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    # --- Update'lar ---
+
+    def push_update(self, update):
+        """Update'ni navbatga qo'yish (update_id bo'lmasa avtomatik beriladi)"""
+        update = dict(update)
+        update.setdefault("update_id", next(self._update_ids))
+        with self._cond:
+            self._updates.append(update)
+            self._cond.notify_all()
+        return update
+
+    def push_message(self, user_id, text=None, chat_id=None, **extra):
+        message = {
+            "message_id": next(self._message_ids),
+            "date": int(time.time()),
+            "chat": {"id": chat_id or user_id, "type": "private"},
+            "from": {"id": user_id, "is_bot": False, "first_name": f"User{user_id}"},
+        }
+        if text is not None:
+            message["text"] = text
+        message.update(extra)
+        return self.push_update({"message": message})
+
+    def deliver_webhook(self, update, secret=None, timeout=10):
+        """Update'ni o'rnatilgan webhook'ga POST qilish, HTTP status kodni qaytaradi"""
+        if not self.webhook:
+            raise RuntimeError("Webhook o'rnatilmagan")
+        if "update_id" not in update:
+            update = dict(update, update_id=next(self._update_ids))
+        req = urllib.request.Request(
+            self.webhook["url"],
+            data=json.dumps(update).encode(),
+            headers={
+                "Content-Type": "application/json",
+                "X-Telegram-Bot-Api-Secret-Token": secret if secret is not None else self.webhook.get("secret_token", ""),
+            },
+            method="POST",
+        )
+        try:
+            with urllib.request.urlopen(req, timeout=timeout) as resp:
+                return resp.status
+        except urllib.error.HTTPError as e:
+            return e.code
+
+    def inject_error(self, method, error_code=429, description="Too Many Requests", retry_after=None, count=1):
+        """Keyingi `count` ta `method` chaqiruviga xato javob qaytarish (masalan 429)"""
+        payload = {"ok": False, "error_code": error_code, "description": description}
+        if retry_after is not None:
+            payload["parameters"] = {"retry_after": retry_after}
+        with self._cond:
+            self._errors.setdefault(method, []).extend([payload] * count)
+
+    def _pop_error(self, method):
+        with self._cond:
+            errors = self._errors.get(method)
+            return errors.pop(0) if errors else None
+
+    def calls_for(self, method):
+        return [params for name, params in self.calls if name == method]
+
+    # --- Bot API ---
+
+    def _get_updates(self, params):
+        offset = int(params.get("offset") or 0)
+        timeout = min(float(params.get("timeout") or 0), 30)
+        limit = int(params.get("limit") or 100)
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            # offset'dan kichik update'lar tasdiqlangan hisoblanadi
+            self._updates = [u for u in self._updates if u["update_id"] >= offset]
+            while not self._updates:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+            return self._updates[:limit]
+
+    def _result(self, method, params):
+        if method == "getUpdates":
+            return self._get_updates(params)
+        if method == "setWebhook":
+            self.webhook = params
+            return True
+        if method == "deleteWebhook":
+            self.webhook = None
+            return True
+        if method in ("sendMessage", "sendPhoto", "sendDocument", "editMessageText"):
+            chat_id = params.get("chat_id")
+            return {
+                "message_id": next(self._message_ids),
+                "date": int(time.time()),
+                "chat": {"id": int(chat_id) if str(chat_id).lstrip("-").isdigit() else chat_id},
+                "text": params.get("text") or params.get("caption"),
+            }
+        if method == "getMe":
+            return {"id": 1, "is_bot": True, "first_name": "FakeBot", "username": "fake_bot"}
+        return True
+
+    def _make_handler(self):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            # Sarlavha va tana alohida yoziladi - Nagle + delayed ACK har javobga ~40ms qo'shadi
+            disable_nagle_algorithm = True
+
+            def do_POST(self):
+                length = int(self.headers.get("Content-Length") or 0)
+                body = self.rfile.read(length) if length else b""
+                parts = self.path.strip("/").split("/")
+                if len(parts) != 2 or not parts[0].startswith("bot"):
+                    self._reply(404, {"ok": False, "error_code": 404, "description": "Not Found"})
+                    return
+                method = parts[1]
+                try:
+                    params = _parse_params(self.headers.get("Content-Type"), body)
+                except ValueError as e:
+                    self._reply(400, {"ok": False, "error_code": 400, "description": str(e)})
+                    return
+                fake.calls.append((method, params))
+                if fake.latency and method != "getUpdates":
+                    time.sleep(fake.latency)
+                error = fake._pop_error(method)
+                if error:
+                    self._reply(error["error_code"], error)
+                    return
+                self._reply(200, {"ok": True, "result": fake._result(method, params)})
+
+            do_GET = do_POST
+
+            def _reply(self, status, payload):
+                data = json.dumps(payload).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, *args):
+                pass
+
+        return Handler
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Lokal fake Telegram Bot API serveri")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8081)
+    parser.add_argument("--latency", type=float, default=0.0, help="Har bir chaqiruvga qo'shiladigan kechikish (s)")
+    args = parser.parse_args()
+
+    fake = FakeTelegram(args.host, args.port, latency=args.latency).start()
+    print(f"Fake Telegram: {fake.base_url}  (TELEGRAM_API_BASE_URL={fake.base_url})")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        fake.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,184 @@
+"""Bot o'tkazuvchanligini o'lchash: fake Telegram + fake Firestore bilan to'liq ariza flow'i.
+
+    python tools/loadtest.py --users 2000 --workers 1 4 8 16 --api-latency 0.02 --db-latency 0.005
+
+Har bir sintetik foydalanuvchi /start dan CV bosqichigacha butun flow'dan o'tadi.
+Foydalanuvchi keyingi xabarini oldingisiga javob olgandan keyin yuboradi (closed loop),
+bir vaqtda --concurrency ta foydalanuvchi faol. Update'lar ChatDispatcher orqali
+BotLogic.handle_update'ga beriladi, Telegram va Firestore chaqiruvlari lokal
+fake'larga ketadi (tools/fake_telegram.py, tools/fake_firestore.py).
+
+Natija: har worker soni uchun updates/sec va har bosqich uchun p50/p99 kechikish
+(navbatda kutish + qayta ishlash).
+"""
+import argparse
+import itertools
+import logging
+import os
+import sys
+import tempfile
+import threading
+import time
+from collections import defaultdict
+
+TOOLS_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, TOOLS_DIR)
+sys.path.insert(0, os.path.dirname(TOOLS_DIR))
+
+import fake_firestore  # noqa: E402
+import telegram_bot as tb  # noqa: E402
+from fake_telegram import FakeTelegram  # noqa: E402
+
+HR_CHAT_ID = "-1001000000000"
+
+# (bosqich nomi, xabar maydonlari)
+FLOW = [
+    ("start", {"text": "/start"}),
+    ("lang", {"text": "🇺🇿 O'zbek (Lotin)"}),
+    ("jobs", {"text": "💼 Bo'sh ish o'rinlari"}),
+    ("name", {"text": "Aliyev Vali Valiyevich"}),
+    ("phone", {"text": "+998901234567"}),
+    ("position", {"text": "👨‍🏫 O'qituvchi"}),
+    ("position_manual", {"text": "Matematika"}),
+    ("exp", {"text": "5 yil maktabda ishlaganman"}),
+    ("cv", {"document": {"file_id": "BQACAgIAAxkBAAIB", "file_name": "cv.pdf"}}),
+]
+
+
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    index = min(len(values) - 1, max(0, int(round(pct / 100 * len(values) + 0.5)) - 1))
+    return values[index]
+
+
+class LoadTest:
+    def __init__(self, args, workers):
+        self.args = args
+        self.workers = workers
+        self.update_ids = itertools.count(1)
+        self.message_ids = itertools.count(1)
+        self.lock = threading.Lock()
+        self.latencies = defaultdict(list)   # bosqich -> [soniya]
+        self.handle_times = defaultdict(list)
+        self.sent_at = {}
+        self.finished_users = 0
+        self.done = threading.Event()
+        self.next_user = itertools.count(1)
+
+    def make_update(self, user_id, fields):
+        message = {
+            "message_id": next(self.message_ids),
+            "date": int(time.time()),
+            "chat": {"id": user_id, "type": "private"},
+            "from": {"id": user_id, "is_bot": False, "first_name": f"User{user_id}"},
+        }
+        message.update(fields)
+        return {"update_id": next(self.update_ids), "message": message}
+
+    def send_step(self, user_id, step):
+        update = self.make_update(user_id, FLOW[step][1])
+        with self.lock:
+            self.sent_at[update["update_id"]] = (user_id, step, time.perf_counter())
+        self.dispatcher.submit(update)
+
+    def start_next_user(self):
+        user_id = next(self.next_user)
+        if user_id <= self.args.users:
+            self.send_step(100000 + user_id, 0)
+
+    def handle(self, update):
+        started = time.perf_counter()
+        self.bot.handle_update(update)
+        finished = time.perf_counter()
+        with self.lock:
+            user_id, step, sent = self.sent_at.pop(update["update_id"])
+            name = FLOW[step][0]
+            self.latencies[name].append(finished - sent)
+            self.handle_times[name].append(finished - started)
+        if step + 1 < len(FLOW):
+            self.send_step(user_id, step + 1)
+            return
+        with self.lock:
+            self.finished_users += 1
+            if self.finished_users >= self.args.users:
+                self.done.set()
+        self.start_next_user()
+
+    def run(self):
+        args = self.args
+        tmpdir = tempfile.mkdtemp(prefix="loadtest-")
+        with FakeTelegram(latency=args.api_latency) as fake:
+            if args.rate_limits:
+                limiter = tb.Config.rate_limiter()
+            else:
+                limiter = tb.TelegramRateLimiter(global_rate=1e9, chat_rate=1e9, chat_burst=10**6,
+                                                 group_rate=1e9, group_burst=10**6)
+            api = tb.TelegramAPI("loadtest", api_base_url=fake.base_url, rate_limiter=limiter)
+            store = tb.LocalStore(os.path.join(tmpdir, "local.db"))
+            client = fake_firestore.FakeFirestore(latency=args.db_latency)
+            db = tb.FirestoreDB(local_store=store, client=client, fs_module=fake_firestore)
+            outbox = tb.Outbox(store, workers=tb.Config.OUTBOX_WORKERS)
+            self.bot = tb.BotLogic(api, db, outbox=outbox)
+            self.dispatcher = tb.ChatDispatcher(self.handle, max_workers=self.workers, name=f"loadtest-{self.workers}")
+
+            started = time.perf_counter()
+            for _ in range(min(args.concurrency, args.users)):
+                self.start_next_user()
+            completed = self.done.wait(args.timeout)
+            elapsed = time.perf_counter() - started
+
+            self.dispatcher.shutdown(wait=True)
+            outbox.close(timeout=30)
+            api.close()
+            db.close()
+            store.close()
+            api_calls = len(fake.calls)
+
+        total_updates = sum(len(v) for v in self.latencies.values())
+        return {
+            "completed": completed,
+            "elapsed": elapsed,
+            "updates": total_updates,
+            "rate": total_updates / elapsed if elapsed else 0.0,
+            "api_calls": api_calls,
+            "firestore": client.stats(),
+        }
+
+    def report(self, result):
+        status = "" if result["completed"] else "  (TIMEOUT - hamma foydalanuvchi tugatmadi)"
+        print(f"\n=== workers={self.workers}: {result['updates']} update, {result['elapsed']:.2f}s, "
+              f"{result['rate']:.0f} updates/s{status}")
+        fs = result["firestore"]
+        print(f"    Telegram API chaqiruvlari: {result['api_calls']}, Firestore: "
+              f"{fs['reads']} o'qish, {fs['writes']} yozish, {fs['commits']} commit")
+        print(f"    {'bosqich':<16} {'p50 ms':>9} {'p99 ms':>9} {'handle p50':>11} {'handle p99':>11}")
+        for name, _ in FLOW:
+            values = self.latencies.get(name, [])
+            handle = self.handle_times.get(name, [])
+            print(f"    {name:<16} {percentile(values, 50) * 1000:>9.1f} {percentile(values, 99) * 1000:>9.1f} "
+                  f"{percentile(handle, 50) * 1000:>11.1f} {percentile(handle, 99) * 1000:>11.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Bot load test (fake Telegram + fake Firestore)")
+    parser.add_argument("--users", type=int, default=1000, help="Sintetik foydalanuvchilar soni")
+    parser.add_argument("--concurrency", type=int, default=200, help="Bir vaqtda faol foydalanuvchilar")
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 4, 8, 16], help="ChatDispatcher worker sonlari")
+    parser.add_argument("--api-latency", type=float, default=0.02, help="Fake Telegram javob kechikishi (s)")
+    parser.add_argument("--db-latency", type=float, default=0.005, help="Fake Firestore RPC kechikishi (s)")
+    parser.add_argument("--rate-limits", action="store_true", help="Haqiqiy Telegram rate limitlarini qo'llash")
+    parser.add_argument("--timeout", type=float, default=600, help="Bitta o'lchov uchun maksimal vaqt (s)")
+    args = parser.parse_args()
+
+    logging.getLogger("TelegramBot").setLevel(logging.WARNING)
+    tb.Config.HR_CHAT_ID = HR_CHAT_ID
+
+    for workers in args.workers:
+        test = LoadTest(args, workers)
+        test.report(test.run())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,190 @@
+"""Yozib olingan update'larni (UPDATE_CAPTURE_DIR) BotLogic orqali qayta o'ynatish.
+
+    python tools/replay.py captures/ --speed 0 --save base.json
+    python tools/replay.py captures/ --speed 0 --baseline base.json --threshold 0.2
+
+Update'lar ChatDispatcher -> BotLogic.handle_update'ga beriladi, Telegram va
+Firestore chaqiruvlari lokal fake'larga ketadi (tools/fake_telegram.py,
+tools/fake_firestore.py). Har replay bo'sh bazadan boshlanadi.
+
+--speed 1 - asl vaqt oraliqlari bilan, 10 - 10 barobar tezroq, 0 - iloji boricha tez.
+Natija: handle_update, _handle_admin va _handle_callback uchun p50/p95/p99.
+--baseline bilan solishtirilganda p50 yoki p99 --threshold dan ko'proq
+sekinlashsa, skript 1 kodi bilan chiqadi (CI uchun).
+"""
+import argparse
+import json
+import logging
+import os
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter, defaultdict
+
+TOOLS_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, TOOLS_DIR)
+sys.path.insert(0, os.path.dirname(TOOLS_DIR))
+
+import fake_firestore  # noqa: E402
+import telegram_bot as tb  # noqa: E402
+from fake_telegram import FakeTelegram  # noqa: E402
+from loadtest import percentile  # noqa: E402
+
+TIMED = ("handle_update", "_handle_admin", "_handle_callback")
+
+
+def load_capture(paths):
+    """[(qabul vaqti, [update, ...]), ...] - barcha fayllardan vaqt tartibida"""
+    files = []
+    for path in paths:
+        files.extend(tb.UpdateCapture.files(path) if os.path.isdir(path) else [path])
+    batches = []
+    for path in files:
+        batches.extend(tb.UpdateCapture.read(path))
+    batches.sort(key=lambda batch: batch[0])
+    return batches
+
+
+class Timings:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.samples = defaultdict(list)
+
+    def wrap(self, name, func):
+        def timed(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                elapsed = time.perf_counter() - start
+                with self._lock:
+                    self.samples[name].append(elapsed)
+        return timed
+
+    def summary(self):
+        out = {}
+        for name in TIMED:
+            values = self.samples.get(name, [])
+            out[name] = {
+                "count": len(values),
+                "mean_ms": sum(values) / len(values) * 1000 if values else 0.0,
+                "p50_ms": percentile(values, 50) * 1000,
+                "p95_ms": percentile(values, 95) * 1000,
+                "p99_ms": percentile(values, 99) * 1000,
+                "max_ms": max(values) * 1000 if values else 0.0,
+            }
+        return out
+
+
+def replay(batches, args, timings):
+    tmpdir = tempfile.mkdtemp(prefix="replay-")
+    with FakeTelegram(latency=args.api_latency) as fake:
+        limiter = tb.TelegramRateLimiter(global_rate=1e9, chat_rate=1e9, chat_burst=10**6,
+                                         group_rate=1e9, group_burst=10**6)
+        api = tb.TelegramAPI("replay", api_base_url=fake.base_url, rate_limiter=limiter)
+        store = tb.LocalStore(os.path.join(tmpdir, "local.db"))
+        client = fake_firestore.FakeFirestore(latency=args.db_latency)
+        db = tb.FirestoreDB(local_store=store, client=client, fs_module=fake_firestore)
+        outbox = tb.Outbox(store, workers=tb.Config.OUTBOX_WORKERS)
+        bot = tb.BotLogic(api, db, outbox=outbox)
+        # Instance atributlari class metodlarini yopadi - ichki chaqiruvlar ham o'lchanadi
+        bot._handle_admin = timings.wrap("_handle_admin", bot._handle_admin)
+        bot._handle_callback = timings.wrap("_handle_callback", bot._handle_callback)
+        dispatcher = tb.ChatDispatcher(timings.wrap("handle_update", bot.handle_update),
+                                       max_workers=args.workers, name="replay")
+
+        first_at = batches[0][0]
+        started = time.perf_counter()
+        for received_at, updates in batches:
+            if args.speed > 0:
+                delay = (received_at - first_at) / args.speed - (time.perf_counter() - started)
+                if delay > 0:
+                    time.sleep(delay)
+            for update in updates:
+                dispatcher.submit(update)
+        dispatcher.shutdown(wait=True)
+        elapsed = time.perf_counter() - started
+
+        outbox.close(timeout=30)
+        api.close()
+        db.close()
+        store.close()
+        return {
+            "elapsed": elapsed,
+            "failed": dispatcher.stats()["failed"],
+            "api_calls": len(fake.calls),
+            "firestore": client.stats(),
+        }
+
+
+def compare(current, baseline, threshold):
+    """Baseline'dan threshold ulushidan ko'proq sekinlashgan ko'rsatkichlar"""
+    regressions = []
+    for name in TIMED:
+        for key in ("p50_ms", "p99_ms"):
+            old = (baseline.get(name) or {}).get(key) or 0.0
+            new = current[name][key]
+            if old > 0 and new > old * (1 + threshold):
+                regressions.append(f"{name} {key}: {old:.2f} -> {new:.2f} ms (+{(new / old - 1) * 100:.0f}%)")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Capture qilingan update'larni BotLogic orqali qayta o'ynatish")
+    parser.add_argument("paths", nargs="+", help="Capture fayllari yoki katalog(lar)")
+    parser.add_argument("--speed", type=float, default=0, help="1 - asl tezlik, N - N barobar tez, 0 - maksimal")
+    parser.add_argument("--workers", type=int, default=tb.Config.WORKERS, help="ChatDispatcher worker soni")
+    parser.add_argument("--repeat", type=int, default=1, help="Replay necha marta takrorlanadi")
+    parser.add_argument("--api-latency", type=float, default=0.0, help="Fake Telegram javob kechikishi (s)")
+    parser.add_argument("--db-latency", type=float, default=0.0, help="Fake Firestore RPC kechikishi (s)")
+    parser.add_argument("--hr-chat-id", default=tb.Config.HR_CHAT_ID or "-1001000000000",
+                        help="HR chat id (capture qilingan botniki bilan bir xil bo'lishi kerak)")
+    parser.add_argument("--save", help="Natijani JSON faylga yozish (keyingi solishtirish uchun)")
+    parser.add_argument("--baseline", help="Oldingi --save natijasi bilan solishtirish")
+    parser.add_argument("--threshold", type=float, default=0.2, help="Ruxsat etilgan sekinlashish ulushi")
+    args = parser.parse_args()
+
+    logging.getLogger("TelegramBot").setLevel(logging.WARNING)
+    tb.Config.HR_CHAT_ID = args.hr_chat_id
+
+    batches = load_capture(args.paths)
+    if not batches:
+        sys.exit("Capture fayllarida update topilmadi")
+    kinds = Counter(next((k for k in u if k != "update_id"), "unknown") for _, updates in batches for u in updates)
+    total = sum(kinds.values())
+    span = batches[-1][0] - batches[0][0]
+    print(f"{total} update, {len(batches)} batch, asl davomiylik {span:.0f}s: "
+          + ", ".join(f"{kind}={count}" for kind, count in kinds.most_common()))
+
+    timings = Timings()
+    for run in range(args.repeat):
+        result = replay(batches, args, timings)
+        fs = result["firestore"]
+        print(f"  replay {run + 1}: {result['elapsed']:.2f}s, {total / result['elapsed']:.0f} updates/s, "
+              f"{result['failed']} xato, Telegram API: {result['api_calls']}, "
+              f"Firestore: {fs['reads']} o'qish / {fs['writes']} yozish")
+
+    summary = timings.summary()
+    print(f"\n  {'':<18} {'count':>7} {'mean':>8} {'p50':>8} {'p95':>8} {'p99':>8} {'max':>8}  (ms)")
+    for name in TIMED:
+        s = summary[name]
+        print(f"  {name:<18} {s['count']:>7} {s['mean_ms']:>8.2f} {s['p50_ms']:>8.2f} "
+              f"{s['p95_ms']:>8.2f} {s['p99_ms']:>8.2f} {s['max_ms']:>8.2f}")
+
+    if args.save:
+        with open(args.save, "w", encoding="utf-8") as f:
+            json.dump(summary, f, indent=2)
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            regressions = compare(summary, json.load(f), args.threshold)
+        if regressions:
+            print("\nSekinlashish aniqlandi:")
+            for line in regressions:
+                print(f"  {line}")
+            sys.exit(1)
+        print(f"\nBaseline bilan farq {args.threshold * 100:.0f}% chegarasida")
+
+
+if __name__ == "__main__":
+    main()
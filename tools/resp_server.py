@@ -0,0 +1,243 @@
+"""Redis protokoli (RESP2) bilan ishlaydigan lokal, xotiradagi server.
+
+Bir nechta bot jarayonini Redis o'rnatmasdan sinash uchun:
+
+    python tools/resp_server.py --port 6379
+    STATE_BACKEND=redis://127.0.0.1:6379/0 python telegram_bot.py
+
+Faqat bot ishlatadigan buyruqlar: PING, ECHO, AUTH, SELECT, GET, SET (EX/PX/NX/XX),
+DEL, EXISTS, DBSIZE, FLUSHALL, PUBLISH, SUBSCRIBE, UNSUBSCRIBE, QUIT.
+Ma'lumotlar diskka yozilmaydi, SELECT e'tiborga olinmaydi (bitta baza).
+"""
+import argparse
+import socketserver
+import threading
+import time
+
+
+# SUBSCRIBE/UNSUBSCRIBE javoblarini o'zi yuboradi
+NO_REPLY = object()
+
+
+class RespStore:
+    def __init__(self):
+        self.data = {}          # key -> (value, expires_at | None)
+        self.channels = {}      # channel -> set(handler)
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        entry = self.data.get(key)
+        if entry is None:
+            return None
+        if entry[1] is not None and entry[1] <= time.monotonic():
+            del self.data[key]
+            return None
+        return entry[0]
+
+
+def _encode(value):
+    if value is None:
+        return b"$-1\r\n"
+    if isinstance(value, Exception):
+        return b"-ERR %s\r\n" % str(value).encode()
+    if isinstance(value, bool):
+        return b":%d\r\n" % int(value)
+    if isinstance(value, int):
+        return b":%d\r\n" % value
+    if isinstance(value, str):
+        return b"+%s\r\n" % value.encode()
+    if isinstance(value, (list, tuple)):
+        return b"*%d\r\n" % len(value) + b"".join(_encode(item) for item in value)
+    return b"$%d\r\n%s\r\n" % (len(value), value)
+
+
+class RespHandler(socketserver.StreamRequestHandler):
+    disable_nagle_algorithm = True
+
+    def setup(self):
+        super().setup()
+        self.write_lock = threading.Lock()
+        self.subscriptions = set()
+
+    def send(self, *replies):
+        with self.write_lock:
+            self.wfile.write(b"".join(_encode(reply) for reply in replies))
+            self.wfile.flush()
+
+    def read_command(self):
+        line = self.rfile.readline()
+        if not line:
+            return None
+        if not line.startswith(b"*"):
+            # Inline buyruq (masalan, telnet orqali)
+            return line.split()
+        args = []
+        for _ in range(int(line[1:])):
+            length = int(self.rfile.readline()[1:])
+            args.append(self.rfile.read(length + 2)[:-2])
+        return args
+
+    def handle(self):
+        store = self.server.store
+        try:
+            while True:
+                args = self.read_command()
+                if args is None:
+                    break
+                if not args:
+                    continue
+                name = args[0].upper().decode()
+                if name == "QUIT":
+                    self.send("OK")
+                    break
+                method = getattr(self, f"cmd_{name.lower()}", None)
+                if method is None:
+                    self.send(ValueError(f"unknown command '{name}'"))
+                    continue
+                try:
+                    reply = method(store, *args[1:])
+                except (TypeError, ValueError, IndexError) as e:
+                    reply = ValueError(f"wrong arguments for '{name}': {e}")
+                if reply is not NO_REPLY:
+                    self.send(reply)
+        except (ConnectionError, OSError):
+            pass
+        finally:
+            with store.lock:
+                for channel in self.subscriptions:
+                    store.channels.get(channel, set()).discard(self)
+
+    def cmd_ping(self, store, message=None):
+        return message if message is not None else "PONG"
+
+    def cmd_echo(self, store, message):
+        return message
+
+    def cmd_auth(self, store, *args):
+        return "OK"
+
+    def cmd_select(self, store, index):
+        return "OK"
+
+    def cmd_get(self, store, key):
+        with store.lock:
+            return store.get(key)
+
+    def cmd_set(self, store, key, value, *options):
+        expires_at = None
+        only_new = only_existing = False
+        i = 0
+        while i < len(options):
+            option = options[i].upper()
+            if option == b"EX":
+                expires_at = time.monotonic() + int(options[i + 1])
+                i += 1
+            elif option == b"PX":
+                expires_at = time.monotonic() + int(options[i + 1]) / 1000
+                i += 1
+            elif option == b"NX":
+                only_new = True
+            elif option == b"XX":
+                only_existing = True
+            else:
+                raise ValueError(f"syntax error near {option!r}")
+            i += 1
+        with store.lock:
+            exists = store.get(key) is not None
+            if (only_new and exists) or (only_existing and not exists):
+                return None
+            store.data[key] = (value, expires_at)
+        return "OK"
+
+    def cmd_del(self, store, *keys):
+        deleted = 0
+        with store.lock:
+            for key in keys:
+                if store.get(key) is not None:
+                    del store.data[key]
+                    deleted += 1
+        return deleted
+
+    def cmd_exists(self, store, *keys):
+        with store.lock:
+            return sum(1 for key in keys if store.get(key) is not None)
+
+    def cmd_dbsize(self, store):
+        with store.lock:
+            return sum(1 for key in list(store.data) if store.get(key) is not None)
+
+    def cmd_flushall(self, store, *args):
+        with store.lock:
+            store.data.clear()
+        return "OK"
+
+    def cmd_publish(self, store, channel, message):
+        with store.lock:
+            handlers = list(store.channels.get(channel, ()))
+        delivered = 0
+        for handler in handlers:
+            try:
+                handler.send([b"message", channel, message])
+                delivered += 1
+            except (OSError, ValueError):
+                # Ulanish shu orada yopilgan (ValueError - yopilgan faylga yozish)
+                pass
+        return delivered
+
+    def cmd_subscribe(self, store, *channels):
+        for channel in channels:
+            with store.lock:
+                store.channels.setdefault(channel, set()).add(self)
+            self.subscriptions.add(channel)
+            self.send([b"subscribe", channel, len(self.subscriptions)])
+        return NO_REPLY
+
+    def cmd_unsubscribe(self, store, *channels):
+        for channel in channels or list(self.subscriptions):
+            with store.lock:
+                store.channels.get(channel, set()).discard(self)
+            self.subscriptions.discard(channel)
+            self.send([b"unsubscribe", channel, len(self.subscriptions)])
+        return NO_REPLY
+
+
+class RespServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, host="127.0.0.1", port=6379):
+        super().__init__((host, port), RespHandler)
+        self.store = RespStore()
+
+    @property
+    def url(self):
+        host, port = self.server_address[:2]
+        return f"redis://{host}:{port}/0"
+
+    def start(self):
+        """Fon thread'ida ishga tushirish (testlar uchun port=0 bilan)"""
+        threading.Thread(target=self.serve_forever, name="resp-server", daemon=True).start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Lokal Redis protokoli serveri (xotirada)")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=6379)
+    args = parser.parse_args()
+    server = RespServer(args.host, args.port)
+    print(f"RESP server: {server.url}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()